@@ -0,0 +1,338 @@
+"""
+Benchmark suite: solve a fixed, seeded selection of instances of data/PDPT, data/PDPT-vehicle and data/PDPTWT with each
+model, timing instance parsing, model build and optimization separately. The results are written as JSON, compared with
+a baseline to flag regressions, and their objectives compared with those of data/Results to flag wrong answers.
+
+usage: python benchmarks/bench.py [--models Lyu Rais] [--max-requests 10] [--save-baseline] [--root-gap]
+"""
+from pathlib import Path
+
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from abstract_model import AbstractModel
+from aggregated import Aggregated
+from alns import Alns
+from branch_and_price import BranchAndPrice
+from lyu import Lyu
+from rais import Rais
+from sampaio import Sampaio
+from symmetry import interchangeable_vehicles
+from utils import get_instance_data
+
+from datetime import datetime
+from typing import Any, Optional
+
+import argparse
+import json
+import math
+import platform
+import random
+import re
+import subprocess
+import time
+
+import gurobipy as gb
+import pandas as pd
+
+
+_ROOT = Path(__file__).resolve().parent.parent
+_DATA_PATH = _ROOT / 'data'
+_BENCHMARKS_PATH = _ROOT / 'benchmarks'
+DEFAULT_BASELINE = _BENCHMARKS_PATH / 'baseline.json'
+
+# reference results of each dataset, see reference_objectives
+_DATASETS = {
+    'PDPT': 'Results-PDPT.txt',
+    'PDPT-vehicle': 'Results-PDPT-vehicle.txt',
+    'PDPTWT': 'Results-PDPTWT.txt',
+}
+# models run on each dataset, as in run.py Rais cannot solve PDPTWT instances and Sampaio only solves them
+_DATASET_MODELS = {
+    'PDPT': ('Rais', 'Lyu', 'Aggregated', 'Alns', 'Bnp'),
+    'PDPT-vehicle': ('Rais', 'Lyu', 'Aggregated', 'Alns', 'Bnp'),
+    'PDPTWT': ('Sampaio', 'Lyu', 'Aggregated', 'Alns', 'Bnp'),
+}
+_MODELS = {'Rais': Rais, 'Lyu': Lyu, 'Sampaio': Sampaio, 'Aggregated': Aggregated, 'Alns': Alns, 'Bnp': BranchAndPrice}
+# models running their own search, given the time limit as argument instead of as Gurobi parameter
+_OWN_SEARCH = ('Alns', 'Bnp')
+_PHASES = ('parse', 'build', 'optimize')
+
+# objectives closer than this are equal: Gurobi's default MIPGap, and the references rounded to 2 decimals
+_REL_TOL = 1e-4
+_ABS_TOL = 0.01
+# phases faster than this many seconds are never flagged, their time being mostly noise
+_MIN_SECONDS = 0.05
+
+
+def _size(config: str) -> tuple[int, int, int]:
+    """
+    Returns the number of requests, vehicles and transfer stations of a configuration, e.g. PDPT-R5-K2-T1 or
+    3R-4K-4T-240L
+    """
+    match = re.match(r'PDPT-R(\d+)-K(\d+)-T(\d+)', config) or re.match(r'(\d+)R-(\d+)K-(\d+)T', config)
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+def select_instances(per_config: int = 1, seed: int = 0, max_requests: Optional[int] = 10,
+                     max_vehicles: Optional[int] = None) -> list[tuple[str, Path]]:
+    """
+    Returns the same selection of instances for the same arguments: per_config random instances of each configuration,
+    from the smallest configuration to the largest
+    :param per_config: instances per configuration
+    :param seed: seed of the random selection
+    :param max_requests: largest number of requests of the configurations, no limit if None
+    :param max_vehicles: largest number of vehicles of the configurations, no limit if None
+    :return: list of (dataset, path of the instance)
+    """
+    rng = random.Random(seed)
+    selection = []
+    for dataset in _DATASETS:
+        configs: dict[str, list[Path]] = {}
+        for path in sorted((_DATA_PATH / dataset).rglob('*.txt')):
+            configs.setdefault(path.stem.rsplit('-', 1)[0], []).append(path)
+        for config in sorted(configs, key=lambda c: (_size(c), c)):
+            r, k, _ = _size(config)
+            if (max_requests is not None and r > max_requests) or (max_vehicles is not None and k > max_vehicles):
+                continue
+            files = configs[config]
+            selection.extend((dataset, path) for path in rng.sample(files, min(per_config, len(files))))
+    return selection
+
+
+def reference_objectives(dataset: str) -> pd.DataFrame:
+    """
+    Returns the best objective reported for each instance of a dataset in data/Results
+    :return: a DataFrame indexed by instance name, with columns 'Objective' and 'Optimal', the latter True if some
+    model proved the objective optimal
+    """
+    df = pd.read_csv(_DATA_PATH / 'Results' / _DATASETS[dataset], sep='\t', comment='#')
+    df = df[df['Objective'].apply(math.isfinite)]
+    df = df.assign(Optimal=df['Status'] == 'OPTIMAL')
+    return df.sort_values('Objective').groupby('Instance').agg(Objective=('Objective', 'first'),
+                                                               Optimal=('Optimal', 'any'))
+
+
+def _equal(a: float, b: float) -> bool:
+    return abs(a - b) <= max(_ABS_TOL, _REL_TOL * abs(b))
+
+
+def _optimize(model: AbstractModel) -> float:
+    """
+    Optimize a MILP model
+    :return: the bound at the end of the root node
+    """
+    bounds = []
+
+    def root_bound(m: gb.Model, where: int) -> None:
+        if where == gb.GRB.Callback.MIP and m.cbGet(gb.GRB.Callback.MIP_NODCNT) == 0:
+            bounds.append(m.cbGet(gb.GRB.Callback.MIP_OBJBND))
+
+    model.callbacks.append(root_bound)
+    model.optimize()
+    model.callbacks.remove(root_bound)
+    # the last MIP callback of the root may come before its last cuts
+    return model.model.ObjBound if model.model.NodeCount <= 1 or not bounds else bounds[-1]
+
+
+def _new_milp(model_name: str, graph, vehicles, requests, options: dict[str, Any], time_limit: float,
+              threads: Optional[int]) -> AbstractModel:
+    model = _MODELS[model_name](graph, vehicles, requests, **options)
+    model.model.update()
+    model.model.setParam('TimeLimit', time_limit)
+    if threads is not None:
+        model.model.setParam('Threads', threads)
+    return model
+
+
+def run(dataset: str, path: Path, model_name: str, time_limit: float, threads: Optional[int],
+        symmetry_breaking: bool = False, root_gap: bool = False) -> dict[str, Any]:
+    """
+    Solve an instance with a model, timing each phase
+    :param symmetry_breaking: set to True to build the MILP models with symmetry_breaking=True
+    :param root_gap: set to True to also solve the MILP models with tight_big_m=False, to compare the bounds at the
+    end of their root node, see time_windows.TimeWindows
+    :return: a dict with the times of the phases in seconds, the result of the model, the size of the Gurobi model,
+    its branch-and-bound nodes and its bound at the end of the root node, and that of the model with tight_big_m=False
+    if root_gap
+    """
+    row = {'dataset': dataset, 'instance': path.name, 'model': model_name}
+    try:
+        start = time.perf_counter()
+        graph, vehicles, requests = get_instance_data(path, sampaio=model_name == 'Sampaio')
+        row['parse'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if model_name in _OWN_SEARCH:
+            model: AbstractModel = _MODELS[model_name](graph, vehicles, requests, time_limit=time_limit)
+        else:
+            options = {'symmetry_breaking': True} if symmetry_breaking else {}
+            model = _new_milp(model_name, graph, vehicles, requests, options, time_limit, threads)
+            row['variables'], row['constraints'] = model.model.NumVars, model.model.NumConstrs
+            if symmetry_breaking:
+                row['interchangeable'] = sum(map(len, interchangeable_vehicles(graph, vehicles)))
+        row['build'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if model_name in _OWN_SEARCH:
+            model.optimize()
+        else:
+            row['root_bound'] = _optimize(model)
+        row['optimize'] = time.perf_counter() - start
+        if model_name not in _OWN_SEARCH:
+            row['nodes'] = model.model.NodeCount
+            if root_gap:
+                loose = _new_milp(model_name, graph, vehicles, requests, dict(options, tight_big_m=False), time_limit,
+                                  threads)
+                row['root_bound_loose'] = _optimize(loose)
+
+        if model_name not in _OWN_SEARCH and model.model.SolCount == 0:
+            row.update(status=model.get_status(), objective=math.inf, gap=math.inf)
+        else:
+            row['status'], row['objective'], row['gap'], _ = model.get_result()
+    except gb.GurobiError as e:
+        row.update(status='ERROR', objective=math.inf, gap=math.inf, error=str(e))
+    return row
+
+
+def check_objective(row: dict[str, Any], reference: pd.DataFrame) -> Optional[str]:
+    """
+    Compare the objective of a run with the reference one, store both in row
+    :return: why the objective is wrong, None if it is not known to be wrong
+    """
+    if row['instance'] not in reference.index:
+        return None
+    best, optimal = reference.loc[row['instance']]
+    row['reference'], row['reference_optimal'] = float(best), bool(optimal)
+    objective = row['objective']
+    if not math.isfinite(objective):
+        return None
+    row['objective_diff'] = objective - best
+    if optimal and objective < best and not _equal(objective, best):
+        return f'objective {objective} below the proven optimum {best}'
+    if row['status'] == 'OPTIMAL' and objective > best and not _equal(objective, best):
+        return f'objective {objective} proven optimal, but {best} was found'
+    return None
+
+
+def root_gaps(row: dict[str, Any]) -> None:
+    """
+    Store in row the relative gaps between the root bounds of a run and the reference objective, or the objective of
+    the run if there is none
+    """
+    best = row.get('reference', row['objective'])
+    for bound, gap in (('root_bound', 'root_gap'), ('root_bound_loose', 'root_gap_loose')):
+        if bound in row and math.isfinite(best) and best != 0:
+            row[gap] = max(0.0, best - row[bound]) / abs(best)
+
+
+def compare(runs: list[dict[str, Any]], baseline: list[dict[str, Any]], threshold: float) -> list[str]:
+    """
+    Returns the regressions of the runs with respect to the baseline runs: phases slower by more than threshold
+    (relative), optimal solutions no longer found and worse objectives
+    """
+    previous = {(b['dataset'], b['instance'], b['model']): b for b in baseline}
+    regressions = []
+    for row in runs:
+        before = previous.get((row['dataset'], row['instance'], row['model']))
+        if before is None:
+            continue
+        name = f'{row["instance"]} {row["model"]}'
+        for phase in _PHASES:
+            if phase not in row or phase not in before:
+                continue
+            if row[phase] > max(before[phase] * (1 + threshold), before[phase] + _MIN_SECONDS):
+                regressions.append(f'{name}: {phase} {before[phase]:.3f}s -> {row[phase]:.3f}s')
+        if before['status'] == 'OPTIMAL' and row['status'] != 'OPTIMAL':
+            regressions.append(f'{name}: status OPTIMAL -> {row["status"]}')
+        elif (math.isfinite(before['objective']) and row['objective'] > before['objective']
+              and not _equal(row['objective'], before['objective'])):
+            regressions.append(f'{name}: objective {before["objective"]} -> {row["objective"]}')
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the models on a fixed selection of instances')
+    parser.add_argument('--models', nargs='+', choices=list(_MODELS), default=list(_MODELS), help='models to run')
+    parser.add_argument('--per-config', type=int, default=1, help='instances per configuration')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the selection of the instances')
+    parser.add_argument('--max-requests', type=int, default=10, help='largest configuration to run, in requests')
+    parser.add_argument('--max-vehicles', type=int, help='largest configuration to run, in vehicles')
+    parser.add_argument('--time-limit', type=float, default=60, help='seconds given to each optimization')
+    parser.add_argument('--threads', type=int, help='Gurobi threads, Gurobi decides by default')
+    parser.add_argument('--symmetry-breaking', action='store_true',
+                        help='order the interchangeable vehicles in the MILP models, see symmetry.py')
+    parser.add_argument('--root-gap', action='store_true',
+                        help='also solve the MILP models with the big-M of the original models, comparing the gaps at '
+                             'the end of the root node, see time_windows.py')
+    parser.add_argument('--output', type=Path, help='JSON file to write, benchmarks/results/<date>.json by default')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help='JSON file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results to the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown of a phase flagged as a regression')
+    args = parser.parse_args()
+
+    instances = select_instances(args.per_config, args.seed, args.max_requests, args.max_vehicles)
+    references = {dataset: reference_objectives(dataset) for dataset in _DATASETS}
+
+    runs, wrong = [], []
+    for dataset, path in instances:
+        for model_name in _DATASET_MODELS[dataset]:
+            if model_name not in args.models:
+                continue
+            row = run(dataset, path, model_name, args.time_limit, args.threads, args.symmetry_breaking, args.root_gap)
+            problem = check_objective(row, references[dataset])
+            if problem:
+                wrong.append(f'{path.name} {model_name}: {problem}')
+            root_gaps(row)
+            runs.append(row)
+            times = '  '.join(f'{phase} {row[phase]:.3f}s' for phase in _PHASES if phase in row)
+            nodes = f'  nodes {row["nodes"]:.0f}' if 'nodes' in row else ''
+            symmetric = f'  interchangeable {row["interchangeable"]}' if 'interchangeable' in row else ''
+            gap = f'  root gap {row["root_gap"]:.2%}' if 'root_gap' in row else ''
+            if 'root_gap_loose' in row:
+                gap += f' (loose big-M {row["root_gap_loose"]:.2%})'
+            result = f'{row["status"]:<12}{row["objective"]:<14.4f}'
+            print(f'{path.name:<28}{model_name:<12}{result}{times}{nodes}{gap}{symmetric}', flush=True)
+
+    regressions = []
+    if args.baseline.exists():
+        regressions = compare(runs, json.loads(args.baseline.read_text())['runs'], args.threshold)
+    else:
+        print(f'No baseline at {args.baseline}, run with --save-baseline to create it')
+
+    report = {
+        'meta': {'date': datetime.now().isoformat(timespec='seconds'), 'commit': _git_commit(),
+                 'gurobi': '.'.join(map(str, gb.gurobi.version())), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'args': {k: str(v) for k, v in vars(args).items()}},
+        'runs': runs,
+        'regressions': regressions,
+        'wrong': wrong,
+    }
+    output = args.output or _BENCHMARKS_PATH / 'results' / f'{datetime.now():%Y%m%d-%H%M%S}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    # infinite objectives and gaps are written as Infinity, which json reads back
+    output.write_text(json.dumps(report, indent=1))
+    print(f'Results written to {output}')
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=1))
+        print(f'Baseline written to {args.baseline}')
+
+    for title, lines in (('Wrong objectives', wrong), ('Regressions', regressions)):
+        if lines:
+            print(f'\n{title}:')
+            print('\n'.join(f'  {line}' for line in lines))
+    return 1 if wrong or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,92 @@
 from abc import ABC
+from typing import Any, Callable, Mapping, Optional
+
+import gurobipy as gb
+
+import gurobi_env
+from graph import Graph
+from heuristic import Solution
+from request import Request
+from solution_decoder import SolutionDecoder
+from time_windows import TimeWindows
+from vehicle import Vehicle
+
+
+# Ways of building the Gurobi model: one expression per constraint, or one sparse matrix per constraint family
+BUILDERS = ('expr', 'matrix')
 
 
 class AbstractModel(ABC):
 
     def __init__(self):
         self.model = None
+        # functions called as f(model, where) from the Gurobi callback during optimize
+        self.callbacks: list[Callable[[gb.Model, int], None]] = []
+        # variables of the model by name, e.g. variables['x'][i, j, k] is x_k_i_j
+        self.variables: dict[str, Mapping[tuple, gb.Var]] = {}
+        # time, size and memory of each constraint family when built with profile_build=True, see BuildProfiler.report
+        self.build_profile: Optional[dict[str, Any]] = None
+        # instance data the model was built from, used to decode its solutions
+        self.graph: Optional[Graph] = None
+        self.vehicles: Optional[set[Vehicle]] = None
+        self.requests: Optional[set[Request]] = None
+        self._decoder: Optional[SolutionDecoder] = None
+        # time windows of the vehicles bounding the a and b variables, if any, see TimeWindows
+        self.time_windows: Optional[TimeWindows] = None
+
+    @staticmethod
+    def new_model(name: str) -> gb.Model:
+        """
+        Returns an empty Gurobi model in the environment shared by the models of the process, see gurobi_env
+        """
+        return gurobi_env.new_model(name)
 
     def optimize(self):
-        self.model.optimize()
+        if self.callbacks:
+            self.model.optimize(self._callback)
+        else:
+            self.model.optimize()
+
+    def _callback(self, model: gb.Model, where: int) -> None:
+        for callback in self.callbacks:
+            callback(model, where)
+
+    def on_load(self, graph, vehicles, requests, **options) -> None:
+        """
+        Called on a model whose self.model and self.variables were read from a file instead of built by __init__, see
+        model_cache. Set up here whatever else __init__ would have set up
+        :param options: the keyword arguments of __init__
+        """
+        pass
+
+    def set_start(self, values: dict[str, dict[tuple, float]]) -> None:
+        """
+        Give Gurobi an initial solution (MIP start), e.g. the one built by heuristic.mip_start
+        :param values: start values by variable name and key, with the same keys as self.variables. The variables of
+        a name missing from values are left undefined for Gurobi to complete, the missing keys of a name are set to 0.
+        The a and b values are moved into self.time_windows, if any, e.g. those of the nodes a vehicle does not visit
+        :return: nothing
+        """
+        for name, variables in self.variables.items():
+            if name not in values:
+                continue
+            start = values[name]
+            if self.time_windows is not None and name == 'a':
+                start = {key: max(value, self.time_windows.earliest.get(key, value)) for key, value in start.items()}
+            if self.time_windows is not None and name == 'b':
+                start = {key: min(value, self.time_windows.latest.get(key, value)) for key, value in start.items()}
+            self.model.setAttr('Start', list(variables.values()), [start.get(key, 0) for key in variables.keys()])
+
+    def get_solution(self, callback: bool = False) -> Solution:
+        """
+        Returns the routes of the vehicles, the legs and transfers of the requests, the loads and, except for Rais, the
+        arrival and departure times of the current solution, see heuristic.Solution
+        :param callback: set to True to decode the new incumbent from a MIPSOL callback
+        :return: the solution
+        """
+        if self._decoder is None:
+            self._decoder = SolutionDecoder(self.variables, self.graph, self.vehicles, self.requests)
+        return self._decoder.decode(self.model, callback)
 
     def get_result(self) -> tuple[str, float, float, float]:
         return self.get_status(), round(self.model.ObjVal, 7), self.model.MIPGap, self.model.Runtime
@@ -0,0 +1,298 @@
+import gurobipy as gb
+
+from itertools import product
+
+from abstract_model import AbstractModel
+from build_profiler import BuildProfiler
+from graph import Graph, NodeType
+from heuristic import Solution
+from request import Request
+from solution_decoder import SolutionDecoder
+from symmetry import add_symmetry_breaking
+from time_windows import TimeWindows
+from variables import SparseTupledict, may_carry
+from vehicle import Vehicle
+
+
+_ROUTED_TYPES = (NodeType.PICKUP, NodeType.DELIVERY, NodeType.TRANSFER_STATION)
+_DEPOT_TYPES = (NodeType.ORIGIN_DEPOT, NodeType.DESTINATION_DEPOT)
+
+
+class Aggregated(AbstractModel):
+    """
+    Lyu's routes and times with a request flow f_r_i_j that does not say which vehicle travels the arc: the vehicle
+    carrying a request is only tracked at the nodes it leaves (v_r_k_i) and at the transfer stations it reaches
+    (w_r_k_t). Every pickup and delivery is visited by a single vehicle, which therefore carries the requests leaving
+    it, so only the arcs leaving a transfer station need the vehicle of the request. The model has |A||R| + |N||R||K|
+    request variables instead of Lyu's |A||R||K|
+    """
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *,
+                 symmetry_breaking: bool = False, tight_big_m: bool = True, profile_build: bool = False):
+        """
+        :param symmetry_breaking: set to True to order the interchangeable vehicles, see symmetry.add_symmetry_breaking
+        :param tight_big_m: set to False to take the big-M of (A11) and (49) and the bounds of (50) from the time
+        windows of the nodes instead of those of the vehicles, see TimeWindows
+        :param profile_build: set to True to measure the build of each constraint family, see self.build_profile
+        """
+        super().__init__()
+        self.graph, self.vehicles, self.requests = graph, vehicles, requests
+        self.time_windows = windows = TimeWindows(graph, vehicles, tighten=tight_big_m)
+
+        model = self.new_model('Aggregated')
+        model.modelSense = gb.GRB.MINIMIZE
+
+        model.setParam('TimeLimit', 3600)
+        profiler = BuildProfiler(model, profile_build)
+
+        transfer_stations = {t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION}
+        depot_nodes = {n for n in graph.nodes if n.type in _DEPOT_TYPES}
+        stops = graph.nodes - depot_nodes
+
+        # x_k_i_j = 1 if vehicle k travels through arc (i,j)
+        x = model.addVars(
+            [(arc.src.index, arc.dst.index, k.index)
+             for arc in graph.arcs
+             for k in vehicles],
+            lb=0, ub=1, vtype=gb.GRB.BINARY
+        )
+
+        # f_r_i_j = 1 if request r is transported through arc (i,j), by any vehicle
+        # only created where r may travel, the missing f_r_i_j evaluate to 0
+        f = SparseTupledict(model.addVars(
+            [(arc.src.index, arc.dst.index, r.index)
+             for arc in graph.arcs
+             for r in requests if may_carry(arc, r)],
+            lb=0, ub=1, vtype=gb.GRB.BINARY
+        ))
+
+        # v_r_k_i = 1 if request r leaves node i on vehicle k, never from d(r)
+        v = SparseTupledict(model.addVars(
+            [(i.index, r.index, k.index)
+             for i in stops
+             for r in requests if i != r.destination
+             for k in vehicles],
+            lb=0, ub=1, vtype=gb.GRB.BINARY
+        ))
+
+        # w_r_k_t = 1 if request r reaches transfer station t on vehicle k
+        w = model.addVars(
+            [(t.index, r.index, k.index)
+             for t in transfer_stations
+             for r in requests
+             for k in vehicles],
+            lb=0, ub=1, vtype=gb.GRB.BINARY
+        )
+
+        # a_k_i represent the arrival time for vehicle k at location i
+        a = model.addVars(
+            [(n.index, k.index)
+             for n in graph.nodes
+             for k in vehicles],
+            lb=0, ub=float('inf'), vtype=gb.GRB.CONTINUOUS
+        )
+
+        # b_k_i represent the departure time for vehicle k at location i
+        b = model.addVars(
+            [(n.index, k.index)
+             for n in graph.nodes
+             for k in vehicles],
+            lb=0, ub=float('inf'), vtype=gb.GRB.CONTINUOUS
+        )
+
+        profiler.record('variables')
+        model.setObjective(
+            gb.quicksum(
+                arc.cost * x[arc.src.index, arc.dst.index, k.index] * k.travel_unit_cost
+                for arc in graph.arcs
+                for k in vehicles)
+        )
+        profiler.record('objective')
+
+        def leaving(i, r):
+            return gb.quicksum(f[arc.src.index, arc.dst.index, r.index] for arc in graph.out_arcs(i))
+
+        def entering(i, r):
+            return gb.quicksum(f[arc.src.index, arc.dst.index, r.index] for arc in graph.in_arcs(i))
+
+        def visits(i, k):
+            return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.out_arcs(i))
+
+        # (A1) ∑(i,j)∈A f_r_i_j = 1 ∀r ∈ R, i = p(r)
+        for r in requests:
+            model.addConstr(leaving(r.pickup, r) == 1, '(A1)')
+        profiler.record('(A1)')
+
+        # (A2) ∑(j,i)∈A f_r_j_i = 1 ∀r ∈ R, i = d(r)
+        for r in requests:
+            model.addConstr(entering(r.destination, r) == 1, '(A2)')
+        profiler.record('(A2)')
+
+        # (A3) ∑(i,j)∈A f_r_i_j − ∑(j,i)∈A f_r_j_i = 0 ∀r ∈ R, ∀i ∈ N\{O ∪ O' ∪ {p(r),d(r)}}
+        for r, i in product(requests, stops):
+            if i != r.pickup and i != r.destination:
+                model.addConstr(leaving(i, r) - entering(i, r) == 0, '(A3)')
+        profiler.record('(A3)')
+
+        # (A4) ∑k∈K v_r_k_i = ∑(i,j)∈A f_r_i_j ∀r ∈ R, ∀i ∈ N\{O ∪ O' ∪ {d(r)}}
+        for r, i in product(requests, stops):
+            if i != r.destination:
+                model.addConstr(
+                    gb.quicksum(v[i.index, r.index, k.index] for k in vehicles) == leaving(i, r), '(A4)'
+                )
+        profiler.record('(A4)')
+
+        # (A5) v_r_k_i ≤ ∑(i,j)∈A x_k_i_j ∀r ∈ R, ∀k ∈ K, ∀i ∈ P ∪ D \ {d(r)}
+        for r, k, i in product(requests, vehicles, stops - transfer_stations):
+            if i != r.destination:
+                model.addConstr(v[i.index, r.index, k.index] <= visits(i, k), '(A5)')
+        profiler.record('(A5)')
+
+        # (A6) f_r_i_j ≤ ∑k∈K x_k_i_j ∀r ∈ R, ∀(i,j) ∈ A, i ∈ P ∪ D
+        # a single vehicle visits i, see (45): it carries the requests leaving i
+        for arc, r in product(graph.arcs, requests):
+            if arc.src.type in (NodeType.PICKUP, NodeType.DELIVERY) and may_carry(arc, r):
+                model.addConstr(
+                    f[arc.src.index, arc.dst.index, r.index]
+                    <= gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for k in vehicles),
+                    '(A6)'
+                )
+        profiler.record('(A6)')
+
+        # (A7) f_r_t_j + v_r_k_t − 1 ≤ x_k_t_j ∀r ∈ R, ∀k ∈ K, ∀(t,j) ∈ A, t ∈ T
+        for t in transfer_stations:
+            for arc, r, k in product(graph.out_arcs(t), requests, vehicles):
+                if may_carry(arc, r):
+                    model.addConstr(
+                        f[t.index, arc.dst.index, r.index] + v[t.index, r.index, k.index] - 1
+                        <= x[t.index, arc.dst.index, k.index],
+                        '(A7)'
+                    )
+        profiler.record('(A7)')
+
+        # (A8) ∑k∈K w_r_k_t = ∑(i,t)∈A f_r_i_t ∀r ∈ R, ∀t ∈ T
+        for r, t in product(requests, transfer_stations):
+            model.addConstr(gb.quicksum(w[t.index, r.index, k.index] for k in vehicles) == entering(t, r), '(A8)')
+        profiler.record('(A8)')
+
+        # (A9) w_r_k_t ≥ f_r_i_t + v_r_k_i − 1 ∀r ∈ R, ∀k ∈ K, ∀(i,t) ∈ A, t ∈ T
+        for t in transfer_stations:
+            for arc, r, k in product(graph.in_arcs(t), requests, vehicles):
+                if may_carry(arc, r):
+                    model.addConstr(
+                        w[t.index, r.index, k.index]
+                        >= f[arc.src.index, t.index, r.index] + v[arc.src.index, r.index, k.index] - 1,
+                        '(A9)'
+                    )
+        profiler.record('(A9)')
+
+        # (A10) ∑r∈R q_r v_r_k_i ≤ u_k ∀k ∈ K, ∀i ∈ P ∪ D ∪ T
+        for k, i in product(vehicles, stops):
+            model.addConstr(
+                gb.quicksum(r.load * v[i.index, r.index, k.index] for r in requests) <= k.capacity, '(A10)'
+            )
+        profiler.record('(A10)')
+
+        # (A11) a_k1_t − b_k2_t ≤ M(2 − w_r_k1_t − v_r_k2_t) ∀r ∈ R, t ∈ T, k1,k2 ∈ K, k1 != k2
+        for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
+            if k1 != k2:
+                M = windows.transfer_big_m(t, k1, k2)
+                model.addConstr(
+                    a[t.index, k1.index] - b[t.index, k2.index]
+                    <= M * (2 - w[t.index, r.index, k1.index] - v[t.index, r.index, k2.index])
+                )
+        profiler.record('(A11)')
+
+        # (25) ∑(i,j)∈A x_k_i_j = 1 ∀k ∈ K, i = o(k)
+        for k in vehicles:
+            model.addConstr(visits(k.origin, k) == 1, '(25)')
+        profiler.record('(25)')
+
+        # (27) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, ∀i ∈ P ∪ D ∪ T
+        for k, i in product(vehicles, graph.nodes):
+            if i.type in _ROUTED_TYPES:
+                model.addConstr(
+                    visits(i, k) - gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.in_arcs(i))
+                    == 0,
+                    '(27)'
+                )
+        profiler.record('(27)')
+
+        # (40) ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, i = o(k)
+        for k in vehicles:
+            model.addConstr(
+                gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.in_arcs(k.origin)) == 0, '(40)'
+            )
+        profiler.record('(40)')
+
+        # (41) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k)
+        for k, i in product(vehicles, depot_nodes):
+            if i != k.origin:
+                model.addConstr(visits(i, k) == 0, '(41)')
+        profiler.record('(41)')
+
+        # (42) ∑(j,i)∈A x_k_j_i = 1 ∀k ∈ K, i = o'(k)
+        for k in vehicles:
+            model.addConstr(
+                gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.in_arcs(k.dest)) == 1, '(42)'
+            )
+        profiler.record('(42)')
+
+        # (43) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, i = o'(k) is implied by (41)
+
+        # (44) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, ∀i ∈ T
+        for k, i in product(vehicles, transfer_stations):
+            model.addConstr(visits(i, k) <= 1, '(44)')
+        profiler.record('(44)')
+
+        # (45) ∑(i,j)∈A ∑k∈K x_k_i_j = 1 ∀i ∈ P ∪ D
+        for i in stops - transfer_stations:
+            model.addConstr(gb.quicksum(visits(i, k) for k in vehicles) == 1, '(45)')
+        profiler.record('(45)')
+
+        # (49) b_k_i + τ_k_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
+        for arc, k in product(graph.arcs, vehicles):
+            M = windows.arc_big_m(arc, k)
+            model.addConstr(
+                b[arc.src.index, k.index] + arc.cost - a[arc.dst.index, k.index]
+                <= M * (1 - x[arc.src.index, arc.dst.index, k.index])
+            )
+        profiler.record('(49)')
+
+        # (50) a_k_i ≥ Ei , bk_i ≤ Li ∀i ∈ N, ∀k ∈ K, with the time windows of the vehicles
+        for i, k in product(graph.nodes, vehicles):
+            model.addConstr(a[i.index, k.index] >= windows.earliest[i.index, k.index])
+            model.addConstr(b[i.index, k.index] <= windows.latest[i.index, k.index])
+        profiler.record('(50)')
+
+        # (51) a_k_i ≤ b_k_i ∀i ∈ N, ∀k ∈ K
+        for i, k in product(graph.nodes, vehicles):
+            model.addConstr(a[i.index, k.index] <= b[i.index, k.index])
+        profiler.record('(51)')
+
+        if symmetry_breaking:
+            add_symmetry_breaking(model, x, graph, vehicles, requests)
+            profiler.record('(S)')
+
+        self.model = model
+        self.variables = {'x': x, 'f': f, 'v': v, 'w': w, 'a': a, 'b': b}
+        if profile_build:
+            self.build_profile = profiler.report()
+
+    def on_load(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *,
+                symmetry_breaking: bool = False, tight_big_m: bool = True, profile_build: bool = False) -> None:
+        self.time_windows = TimeWindows(graph, vehicles, tighten=tight_big_m)
+
+    def get_solution(self, callback: bool = False) -> Solution:
+        """
+        See AbstractModel.get_solution. The legs of the requests follow f, each arc travelled by the vehicle carrying
+        the request when it leaves the tail of the arc, see v
+        """
+        if self._decoder is None:
+            self._decoder = SolutionDecoder(self.variables, self.graph, self.vehicles, self.requests)
+        f, v = self.variables['f'], self.variables['v']
+        read = self.model.cbGetSolution if callback else (lambda variables: self.model.getAttr('X', variables))
+        travelled = [key for key, value in zip(f.keys(), read(list(f.values()))) if value > 0.5]
+        carrier = {(i, r): k for (i, r, k), value in zip(v.keys(), read(list(v.values()))) if value > 0.5}
+        flow = [(i, j, carrier[i, r], r) for i, j, r in travelled]
+        return self._decoder.decode(self.model, callback, flow=flow)
@@ -0,0 +1,257 @@
+import math
+import random
+import time
+
+import numpy as np
+
+from typing import Callable, Optional
+
+from abstract_model import AbstractModel
+from graph import Graph
+from heuristic import RoutePlan, Solution
+from request import Request
+from vehicle import Vehicle
+
+
+# scores of an operator pair whose result is a new best solution, improves the current one or is accepted anyway
+_SCORES = (33, 9, 13)
+# weight of the scores of the last segment when the weights of the operators are updated
+_REACTION = 0.1
+_SEGMENT_LENGTH = 50
+# a solution 5% worse than the current one is accepted with probability 0.5 at the start, 0.5^1000 at the end
+_START_WORSENING = 0.05
+_FINAL_TEMPERATURE_RATIO = 1e-3
+# randomness of worst and related removal, see Ropke and Pisinger (2006)
+_DETERMINISM = 3
+# cost of leaving a request unserved, in units of the longest arc
+_UNSERVED_PENALTY = 10
+
+
+class Alns(AbstractModel):
+    """
+    Adaptive large neighbourhood search (Ropke and Pisinger, 2006) over the routes of heuristic.RoutePlan: at each
+    iteration a destroy operator removes some requests and a repair operator inserts them back, possibly splitting them
+    at a transfer station. Operators are chosen with adaptive weights, solutions accepted by simulated annealing
+    """
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *, time_limit: float = 10,
+                 iteration_limit: Optional[int] = None, seed: int = 0):
+        """
+        :param time_limit: seconds after which the search stops
+        :param iteration_limit: maximum number of destroy and repair iterations, unlimited if None
+        :param seed: seed of the random choices
+        """
+        super().__init__()
+        self.graph = graph
+        self.vehicles = vehicles
+        self.requests = sorted(requests, key=lambda r: r.index)
+        self.time_limit = time_limit
+        self.iteration_limit = iteration_limit
+        self.random = random.Random(seed)
+
+        self.destroy_operators: list[Callable[[RoutePlan, int], list[Request]]] = [
+            self._random_removal, self._worst_removal, self._related_removal, self._transfer_removal
+        ]
+        self.repair_operators: list[Callable[[RoutePlan, list[Request]], list[Request]]] = [
+            self._greedy_insertion, self._direct_insertion, self._regret_insertion
+        ]
+
+        self.solution: Optional[Solution] = None
+        self.iterations = 0
+        self._status = 'LOADED'
+        self._objective = float('inf')
+        self._runtime = 0.0
+
+        plan = RoutePlan(graph, vehicles, requests)
+        self._penalty = _UNSERVED_PENALTY * float(np.max(plan.cost[np.isfinite(plan.cost)], initial=1))
+        self._distance = np.where(np.isfinite(plan.cost), plan.cost, plan.cost[np.isfinite(plan.cost)].max(initial=1))
+
+    def optimize(self) -> None:
+        start = time.perf_counter()
+        plan = RoutePlan(self.graph, self.vehicles, set(self.requests))
+        order = sorted(self.requests, key=lambda r: (r.pickup.latest_time, r.destination.latest_time,
+                                                     -float(r.load), r.index))
+        unserved = self._greedy_insertion(plan, order)
+
+        current = best = (plan, unserved)
+        current_value = best_value = self._value(plan, unserved)
+        start_temperature = -_START_WORSENING * current_value / math.log(0.5) or 1.0
+
+        destroy_weights = [1.0] * len(self.destroy_operators)
+        repair_weights = [1.0] * len(self.repair_operators)
+        destroy_scores, repair_scores = [0.0] * len(destroy_weights), [0.0] * len(repair_weights)
+        destroy_uses, repair_uses = [0] * len(destroy_weights), [0] * len(repair_weights)
+
+        self.iterations = 0
+        elapsed = time.perf_counter() - start
+        while elapsed < self.time_limit and (self.iteration_limit is None or self.iterations < self.iteration_limit):
+            d = self.random.choices(range(len(destroy_weights)), destroy_weights)[0]
+            r = self.random.choices(range(len(repair_weights)), repair_weights)[0]
+
+            plan = current[0].copy()
+            # remove up to a third of the requests
+            most = min(len(plan.legs), max(2, len(self.requests) // 3))
+            removed = self.destroy_operators[d](plan, self.random.randint(1, most)) if most else []
+            unserved = self.repair_operators[r](plan, removed + list(current[1]))
+            value = self._value(plan, unserved)
+
+            temperature = start_temperature * _FINAL_TEMPERATURE_RATIO ** (elapsed / self.time_limit)
+            score = 0
+            if value < best_value - 1e-9:
+                best, best_value = (plan, unserved), value
+                score = _SCORES[0]
+            if value < current_value - 1e-9:
+                score = score or _SCORES[1]
+            elif self.random.random() < math.exp((current_value - value) / temperature):
+                score = score or _SCORES[2]
+            if score:
+                current, current_value = (plan, unserved), value
+
+            destroy_scores[d] += score
+            repair_scores[r] += score
+            destroy_uses[d] += 1
+            repair_uses[r] += 1
+            self.iterations += 1
+            if self.iterations % _SEGMENT_LENGTH == 0:
+                _update_weights(destroy_weights, destroy_scores, destroy_uses)
+                _update_weights(repair_weights, repair_scores, repair_uses)
+
+            elapsed = time.perf_counter() - start
+
+        plan, unserved = best
+        if unserved:
+            self.solution, self._objective, self._status = None, float('inf'), 'INFEASIBLE'
+        else:
+            self.solution = plan.solution()
+            self._objective = self.solution.cost
+            self._status = 'TIME_LIMIT' if elapsed >= self.time_limit else 'ITERATION_LIMIT'
+        self._runtime = time.perf_counter() - start
+
+    def get_result(self) -> tuple[str, float, float, float]:
+        # no lower bound is known, hence the gap is infinite
+        return self.get_status(), round(self._objective, 7), float('inf'), self._runtime
+
+    def get_status(self):
+        return self._status
+
+    def get_solution(self, callback: bool = False) -> Solution:
+        return self.solution
+
+    def _value(self, plan: RoutePlan, unserved: list[Request]) -> float:
+        return plan.total_cost() + self._penalty * len(unserved)
+
+    # Destroy operators: remove n requests from the plan and return them
+
+    def _random_removal(self, plan: RoutePlan, n: int) -> list[Request]:
+        removed = self.random.sample(sorted(plan.legs, key=lambda r: r.index), n)
+        for r in removed:
+            plan.remove_request(r)
+        return removed
+
+    def _worst_removal(self, plan: RoutePlan, n: int) -> list[Request]:
+        """
+        Remove the requests whose removal saves the most, with some randomness
+        """
+        removed = []
+        for _ in range(n):
+            cost = plan.total_cost()
+            savings = []
+            for r in sorted(plan.legs, key=lambda r: r.index):
+                other = plan.copy()
+                other.remove_request(r)
+                savings.append((cost - other.total_cost(), r))
+            savings.sort(key=lambda s: (-s[0], s[1].index))
+            r = savings[int(self.random.random() ** _DETERMINISM * len(savings))][1]
+            plan.remove_request(r)
+            removed.append(r)
+        return removed
+
+    def _related_removal(self, plan: RoutePlan, n: int) -> list[Request]:
+        """
+        Remove a random request and the requests whose pickup and delivery are closest to its own
+        """
+        served = sorted(plan.legs, key=lambda r: r.index)
+        seed = self.random.choice(served)
+        removed = self._remove_closest(plan, served, n, lambda r: self._relatedness(seed, r))
+        return removed
+
+    def _transfer_removal(self, plan: RoutePlan, n: int) -> list[Request]:
+        """
+        Remove the requests transferred at a random transfer station, then those closest to it, so that they can be
+        rearranged around the station
+        """
+        served = sorted(plan.legs, key=lambda r: r.index)
+        if not plan.transfer_stations:
+            return self._random_removal(plan, n)
+        t = self.random.choice(plan.transfer_stations)
+
+        def distance(r: Request) -> float:
+            if any(leg[2] == t for leg in plan.legs[r][:-1]):
+                return -1  # transferred at t
+            return min(self._distance[plan.pos[r.pickup], t], self._distance[t, plan.pos[r.destination]])
+
+        return self._remove_closest(plan, served, n, distance)
+
+    def _remove_closest(self, plan: RoutePlan, served: list[Request], n: int,
+                        distance: Callable[[Request], float]) -> list[Request]:
+        ranked = sorted(served, key=lambda r: (distance(r), r.index))
+        removed = []
+        for _ in range(n):
+            removed.append(ranked.pop(int(self.random.random() ** _DETERMINISM * len(ranked))))
+        for r in removed:
+            plan.remove_request(r)
+        return removed
+
+    def _relatedness(self, r1: Request, r2: Request) -> float:
+        p1, p2 = r1.pickup, r2.pickup
+        d1, d2 = r1.destination, r2.destination
+        return (math.dist(p1.coordinates, p2.coordinates) + math.dist(d1.coordinates, d2.coordinates)
+                + abs(p1.latest_time - p2.latest_time) + abs(d1.latest_time - d2.latest_time))
+
+    # Repair operators: insert the requests back into the plan and return those that could not be inserted
+
+    def _greedy_insertion(self, plan: RoutePlan, requests: list[Request], *, transfers: bool = True) -> list[Request]:
+        """
+        Insert the requests in the given order where they increase the cost the least
+        """
+        return [r for r in requests if not plan.insert_request(r, transfers)]
+
+    def _direct_insertion(self, plan: RoutePlan, requests: list[Request]) -> list[Request]:
+        """
+        Greedy insertion in random order, without transfers
+        """
+        requests = list(requests)
+        self.random.shuffle(requests)
+        return self._greedy_insertion(plan, requests, transfers=False)
+
+    def _regret_insertion(self, plan: RoutePlan, requests: list[Request]) -> list[Request]:
+        """
+        Regret-2 insertion: insert first the request that would lose the most if it were not inserted in its cheapest
+        way, transfers included
+        """
+        pending = list(requests)
+        while pending:
+            regrets = []
+            for r in pending:
+                insertions = plan.feasible_insertions(r, True, 2)
+                if not insertions:
+                    regret = -1.0
+                elif len(insertions) == 1:
+                    regret = float('inf')
+                else:
+                    regret = insertions[1][0] - insertions[0][0]
+                regrets.append((regret, r, insertions))
+            regret, r, insertions = max(regrets, key=lambda x: (x[0], -x[1].index))
+            if not insertions:
+                break
+            _, plan.routes, plan.legs[r] = insertions[0]
+            pending.remove(r)
+        return pending
+
+
+def _update_weights(weights: list[float], scores: list[float], uses: list[int]) -> None:
+    for i in range(len(weights)):
+        if uses[i]:
+            weights[i] = (1 - _REACTION) * weights[i] + _REACTION * scores[i] / uses[i]
+        weights[i] = max(weights[i], 0.1)
+        scores[i], uses[i] = 0, 0
@@ -0,0 +1,65 @@
+from alns import Alns
+from utils import get_instance_data, log_result, pick_pdpt_instances
+
+from pathlib import Path
+
+import argparse
+import math
+
+import pandas as pd
+
+
+_DATA_PATH = Path(__file__).resolve().parent.parent / 'data'
+
+
+def reference_objectives() -> pd.DataFrame:
+    """
+    Returns the best objective reported for each instance in data/Results/Results-PDPT.txt
+    :return: a DataFrame indexed by instance name, with columns 'Objective' and 'Optimal'
+    """
+    df = pd.read_csv(_DATA_PATH / 'Results' / 'Results-PDPT.txt', sep='\t', comment='#')
+    df = df[df['Objective'].apply(math.isfinite)]
+    df = df.assign(Optimal=df['Status'] == 'OPTIMAL')
+    return df.sort_values('Objective').groupby('Instance')[['Objective', 'Optimal']].first()
+
+
+def benchmark(instances: list[str], time_limit: float, log: bool = False) -> pd.DataFrame:
+    """
+    Solve the PDPT instances with Alns and compare the objectives with the reference ones
+    :param instances: names of the instances, e.g. PDPT-R5-K2-T1-Q100-0.txt
+    :param time_limit: seconds given to Alns for each instance
+    :param log: set to True to also log each result to results/PDPT.csv, see utils.log_result
+    :return: a DataFrame with the reference objective, the Alns one and their gap (in %) for each instance
+    """
+    reference = reference_objectives()
+    rows = []
+    for instance in instances:
+        config = instance.rsplit('-', 2)[0]
+        graph, vehicles, requests = get_instance_data(_DATA_PATH / 'PDPT' / config / instance)
+
+        alns = Alns(graph, vehicles, requests, time_limit=time_limit)
+        alns.optimize()
+        result = alns.get_result()
+        if log:
+            log_result('PDPT', 'Alns', instance, result)
+
+        best, optimal = reference.loc[instance] if instance in reference.index else (math.inf, False)
+        gap = 100 * (result[1] - best) / best if math.isfinite(best) else math.nan
+        rows.append((instance, best, optimal, result[1], gap, alns.iterations))
+        print(f'{instance}\treference {best:.3f}{" (optimal)" if optimal else ""}\tAlns {result[1]:.3f}\t'
+              f'gap {gap:.2f}%')
+
+    return pd.DataFrame(rows, columns=['Instance', 'Reference', 'Optimal', 'Alns', 'Gap', 'Iterations'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare Alns with the objectives of data/Results/Results-PDPT.txt')
+    parser.add_argument('--configs', type=int, default=18, help='number of PDPT configurations, from the smallest')
+    parser.add_argument('--per-config', type=int, default=2, help='instances per configuration')
+    parser.add_argument('--time-limit', type=float, default=10, help='seconds given to Alns for each instance')
+    parser.add_argument('--log', action='store_true', help='also log the results to results/PDPT.csv')
+    args = parser.parse_args()
+
+    df = benchmark(pick_pdpt_instances(args.configs, args.per_config, 'Lyu'), args.time_limit, args.log)
+    print(f'\nMean gap {df["Gap"].mean():.2f}% over {df["Gap"].count()} instances with a reference objective, '
+          f'{(df["Gap"] <= 1e-4).sum()} matched or improved')
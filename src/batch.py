@@ -0,0 +1,334 @@
+from abstract_model import AbstractModel
+from aggregated import Aggregated
+from alns import Alns
+from branch_and_price import BranchAndPrice
+from heuristic import mip_start
+from lyu import Lyu
+from model_cache import build_model
+from rais import Rais
+from results_store import DEFAULT_STORE_PATH, ResultsStore
+from sampaio import Sampaio
+from utils import get_instance_data, log_result, pick_pdpt_instances, pick_pdptwt_instances
+
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import re
+import time
+
+
+_DATA_PATH = Path(__file__).resolve().parent.parent / 'data'
+_MODELS = {'rais': Rais, 'lyu': Lyu, 'sampaio': Sampaio, 'aggregated': Aggregated, 'alns': Alns,
+           'bnp': BranchAndPrice}
+# models running their own search, given the time limit as argument instead of as Gurobi parameter
+_OWN_SEARCH = ('Alns', 'Bnp')
+# seconds a job may run past its time limit, e.g. to finish building the model, before it is killed
+_GRACE = 60
+
+
+@dataclass
+class Job:
+    """
+    A model to run on an instance
+    :param model: either 'Rais', 'Lyu', 'Sampaio', 'Aggregated', 'Alns' or 'Bnp'
+    :param path: file containing the instance data
+    :param problem: results file the result is logged to, see utils.log_result
+    :param name: model name logged with the result, e.g. 'Rais_vi'. Defaults to model
+    :param options: keyword arguments of the model, e.g. {'vi': True}
+    :param heuristic_start: set to True to start from the solution of the construction heuristic
+    :param cached: set to True to read the model from the model cache if it was built before, see model_cache
+    """
+    model: str
+    path: Path
+    problem: str
+    name: str = ''
+    options: dict[str, Any] = field(default_factory=dict)
+    heuristic_start: bool = False
+    cached: bool = False
+
+    def __post_init__(self):
+        self.name = self.name or self.model
+
+    @property
+    def vi(self) -> bool:
+        return bool(self.options.get('vi', False))
+
+    def params(self, time_limit: float) -> dict[str, Any]:
+        """
+        Returns the parameters that identify the run of the job in a ResultsStore, valid inequalities excluded
+        """
+        params = {key: value for key, value in self.options.items() if key != 'vi'}
+        if self.heuristic_start:
+            params['heuristic_start'] = True
+        params['time_limit'] = time_limit
+        return params
+
+
+def instance_path(instance: str) -> Optional[Path]:
+    """
+    Returns the file of a PDPT, PDPT-vehicle or PDPTWT instance
+    :param instance: name of the instance, e.g. PDPT-R5-K2-T1-Q100-0.txt, PDPT-R5-K10-T1-0 or 3R-4K-4T-240L-0
+    :return: the path of the instance file, None if it does not exist
+    """
+    instance = instance if instance.endswith('.txt') else instance + '.txt'
+    if re.match(r'PDPT-R\d+-K\d+-T\d+-Q100-\d+\.txt', instance):
+        path = _DATA_PATH / 'PDPT' / instance.rsplit('-', 2)[0] / instance
+    elif re.match(r'PDPT-R\d+-K\d+-T\d+-\d+\.txt', instance):
+        path = _DATA_PATH / 'PDPT-vehicle' / instance
+    elif re.match(r'\d+R-\d+K-\d+T-\d+[LMS]-\d+\.txt', instance):
+        path = _DATA_PATH / 'PDPTWT' / instance.rsplit('-', 2)[0].replace('-', '') / instance
+    else:
+        return None
+    return path if path.exists() else None
+
+
+def can_solve(model: str, path: Path) -> bool:
+    """
+    Returns whether the model can solve the instance found at path: Rais only solves PDPT instances, Sampaio only
+    PDPTWT instances
+    """
+    pdptwt = 'PDPTWT' in path.parts
+    return not ((model.lower() == 'rais' and pdptwt) or (model.lower() == 'sampaio' and not pdptwt))
+
+
+def make_jobs(model: str, instances: list[str], problem: Optional[str] = None, **kwargs) -> list[Job]:
+    """
+    Returns a job for each instance the model can solve, see run.py for the combinations allowed
+    :param model: either 'Rais', 'Lyu', 'Sampaio', 'Aggregated', 'Alns' or 'Bnp'
+    :param instances: names of the instances, see instance_path
+    :param problem: results file of the jobs. If None it is 'PDPT', 'PDPT-VEHICLES' or 'PDPTWT' after the instance
+    :param kwargs: other fields of Job, e.g. options={'vi': True}
+    :return: list of jobs
+    """
+    jobs = []
+    for instance in instances:
+        path = instance_path(instance)
+        if path is None:
+            print(f'Instance {instance} does not exist')
+            continue
+        if not can_solve(model, path):
+            print(f'{model.title()} model cannot solve {instance}')
+            continue
+        if problem is not None:
+            job_problem = problem
+        elif 'PDPTWT' in path.parts:
+            job_problem = 'PDPTWT'
+        else:
+            job_problem = 'PDPT-VEHICLES' if 'PDPT-vehicle' in path.parts else 'PDPT'
+        jobs.append(Job(model.title(), path, job_problem, **kwargs))
+    return jobs
+
+
+def solve(job: Job, threads: int, time_limit: float,
+          prepare: Optional[Callable[[AbstractModel], None]] = None) -> tuple[str, float, float, float]:
+    """
+    Build and solve the model of a job within time_limit seconds, building time included
+    :param job: model and instance to solve
+    :param threads: number of threads Gurobi may use
+    :param time_limit: seconds given to the job
+    :param prepare: if given, called on the Gurobi models once built, just before they are optimized, e.g. to add a
+    callback or set parameters
+    :return: a tuple of status, objective, gap and time, see AbstractModel.get_result
+    """
+    start = time.perf_counter()
+    g, v, r = get_instance_data(job.path, sampaio=job.model == 'Sampaio')
+
+    def remaining() -> float:
+        return max(1.0, time_limit - (time.perf_counter() - start))
+
+    if job.model in _OWN_SEARCH:
+        model: AbstractModel = _MODELS[job.model.lower()](g, v, r, time_limit=remaining(), **job.options)
+    elif job.cached:
+        model = build_model(_MODELS[job.model.lower()], job.path, **job.options)
+    else:
+        model = _MODELS[job.model.lower()](g, v, r, **job.options)
+    if job.model not in _OWN_SEARCH:
+        model.model.setParam('Threads', threads)
+        if job.heuristic_start:
+            start_values = mip_start(g, v, r)
+            if start_values is not None:
+                model.set_start(start_values)
+        model.model.setParam('TimeLimit', remaining())
+        if prepare is not None:
+            prepare(model)
+    model.optimize()
+
+    if job.model not in _OWN_SEARCH and model.model.SolCount == 0:
+        return model.get_status(), math.inf, math.inf, model.model.Runtime
+    return model.get_result()
+
+
+def _worker(job: Job, threads: int, time_limit: float, conn: Connection) -> None:
+    """
+    Entry point of the worker processes: send the result of the job, or the error that stopped it, to the parent
+    """
+    try:
+        conn.send(('OK', solve(job, threads, time_limit)))
+    except Exception as e:
+        conn.send(('ERROR', repr(e)))
+    finally:
+        conn.close()
+
+
+def skip_done(jobs: list[Job], store: ResultsStore, time_limit: float) -> list[Job]:
+    """
+    Returns the jobs whose result is not in the store yet, to resume an interrupted campaign
+    """
+    done = {}
+    todo = []
+    for job in jobs:
+        key = (job.problem, job.model, job.name, job.vi, json.dumps(job.params(time_limit), sort_keys=True))
+        if key not in done:
+            done[key] = store.done(job.problem, job.model, name=job.name, vi=job.vi, params=job.params(time_limit))
+        if job.path.name not in done[key]:
+            todo.append(job)
+    return todo
+
+
+def available_cores() -> int:
+    """
+    Returns the number of cores this process may run on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def run_batch(jobs: list[Job], workers: Optional[int] = None, threads: Optional[int] = None,
+              time_limit: float = 3600, log: bool = True,
+              store: Optional[ResultsStore] = None) -> list[tuple[Job, tuple[str, float, float, float]]]:
+    """
+    Run the jobs in parallel, each in its own process. Results are logged by this process only, so that the results
+    files are never written concurrently
+    :param jobs: jobs to run
+    :param workers: number of jobs run at the same time, by default one per core
+    :param threads: Gurobi threads of each job, by default the cores are split evenly among the workers
+    :param time_limit: seconds given to each job, building time included. A job still running _GRACE seconds later
+    is killed and logged with status 'TIMEOUT'
+    :param log: set to False to not log the results
+    :param store: store to add the results to. If None the results are logged to the CSV files, see utils.log_result
+    :return: list of jobs and results, in order of completion
+    """
+    cores = available_cores()
+    workers = max(1, min(workers or cores, len(jobs)))
+    threads = threads or max(1, cores // workers)
+
+    # spawn rather than fork: Gurobi environments must not be inherited by the workers
+    context = multiprocessing.get_context('spawn')
+    pending = list(reversed(jobs))
+    running: dict[Connection, tuple[Job, Any, float]] = {}
+    results = []
+
+    def finish(conn: Connection, result: tuple[str, float, float, float]) -> None:
+        job, process, _ = running.pop(conn)
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+        conn.close()
+        if log and store is not None:
+            store.add(job.problem, job.model, job.path.name, result, name=job.name, vi=job.vi,
+                      params=job.params(time_limit))
+        elif log:
+            log_result(job.problem, job.name, job.path.name, result)
+        print(job.path.name, f'\t{job.name}\t', result, flush=True)
+        results.append((job, result))
+
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.pop()
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_worker, args=(job, threads, time_limit, sender), daemon=True)
+            process.start()
+            sender.close()
+            running[receiver] = (job, process, time.perf_counter())
+
+        deadline = min(started for _, _, started in running.values()) + time_limit + _GRACE
+        for conn in wait(list(running), timeout=max(0.0, deadline - time.perf_counter())):
+            started = running[conn][2]
+            try:
+                outcome, value = conn.recv()
+            except EOFError:  # the worker died without a result, e.g. out of memory
+                outcome, value = 'ERROR', f'worker exited with code {running[conn][1].exitcode}'
+            if outcome == 'ERROR':
+                print(f'{running[conn][0].path.name} {running[conn][0].name} failed: {value}')
+                value = ('ERROR', math.inf, math.inf, time.perf_counter() - started)
+            finish(conn, value)
+
+        now = time.perf_counter()
+        for conn in [conn for conn, (_, _, started) in running.items() if now - started > time_limit + _GRACE]:
+            running[conn][1].kill()
+            finish(conn, ('TIMEOUT', math.inf, math.inf, now - running[conn][2]))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve many instances with the specified model in parallel')
+    parser.add_argument('model', type=str, help='Model to use')
+    parser.add_argument('instances', type=str, nargs='*', help='Instances to run, e.g. PDPT-R5-K2-T1-Q100-6')
+    parser.add_argument('--pdpt', type=int, nargs=2, metavar=('N', 'K'),
+                        help='also run K instances of each of the first N PDPT configurations, see pick_pdpt_instances')
+    parser.add_argument('--pdptwt', type=int, metavar='K',
+                        help='also run K instances of each PDPTWT configuration, see pick_pdptwt_instances')
+    parser.add_argument('--workers', type=int, help='jobs run at the same time, by default one per core')
+    parser.add_argument('--threads', type=int, help='Gurobi threads per job, by default cores / workers')
+    parser.add_argument('--time-limit', type=float, default=3600, help='seconds given to each job')
+    parser.add_argument('--problem', type=str, help='results file to log to, by default after the instance')
+    parser.add_argument('--vi', action='store_true', help='Rais and Sampaio only: add the valid inequalities')
+    parser.add_argument('--separate-vi', action='store_true',
+                        help='Rais and Sampaio only: add the violated valid inequalities and cuts from a callback')
+    parser.add_argument('--benders', action='store_true',
+                        help='Lyu only, experimental: check the request flow of each incumbent in a callback instead '
+                             'of modelling it, saving memory but solving much slower')
+    parser.add_argument('--mip-start', action='store_true',
+                        help='start from the solution of the cheapest insertion heuristic')
+    parser.add_argument('--model-cache', action='store_true',
+                        help='read the models built before from the model cache, see model_cache.py')
+    parser.add_argument('--store', type=Path, default=DEFAULT_STORE_PATH,
+                        help='results store to add the results to, see results_store.py')
+    parser.add_argument('--resume', action='store_true', help='skip the jobs whose result is already in the store')
+    parser.add_argument('--csv', action='store_true', help='log the results to the CSV files instead of the store')
+    parser.add_argument('--no-log', action='store_true', help='do not log the results')
+
+    args = parser.parse_args()
+
+    model = args.model
+    if model.lower() not in _MODELS:
+        print('Model must be either Rais, Lyu, Sampaio, Aggregated, Alns or Bnp')
+        exit(1)
+
+    reference = model.title() if model.lower() in ['rais', 'lyu'] else 'Lyu'
+    instances = list(args.instances)
+    if args.pdpt:
+        instances += pick_pdpt_instances(args.pdpt[0], args.pdpt[1], reference)
+    if args.pdptwt:
+        instances += pick_pdptwt_instances(args.pdptwt, 'Sampaio' if model.lower() == 'sampaio' else 'Lyu')
+
+    options, suffix = {}, ''
+    if (args.vi or args.separate_vi) and model.lower() in ['rais', 'sampaio']:
+        if args.vi:
+            options['vi'], suffix = True, '_vi'
+        if args.separate_vi:
+            options['separate_vi'], suffix = True, suffix + '_cuts'
+    elif args.benders and model.lower() == 'lyu':
+        options, suffix = {'benders': True}, '_benders'
+    if args.mip_start:
+        suffix += '_start'
+    jobs = make_jobs(model, instances, args.problem, name=model.title() + suffix,
+                     options=options, heuristic_start=args.mip_start, cached=args.model_cache)
+    # --resume reads the store even when nothing is logged
+    store = None if args.csv or (args.no_log and not args.resume) else ResultsStore(args.store)
+    if args.resume and store is not None:
+        jobs = skip_done(jobs, store, args.time_limit)
+    if not jobs:
+        print('Nothing to run')
+        exit(1)
+
+    run_batch(jobs, args.workers, args.threads, args.time_limit, log=not args.no_log, store=store)
@@ -0,0 +1,610 @@
+import heapq
+import itertools
+import math
+import time
+
+import gurobipy as gb
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from abstract_model import AbstractModel
+from graph import Graph, NodeType
+from heuristic import RoutePlan, Solution, cheapest_insertion
+from request import Request
+from vehicle import Vehicle
+
+
+# columns with the most negative reduced cost added for each vehicle at each pricing
+_COLUMNS_PER_VEHICLE = 5
+# labels extended by a pricing before it stops, the bound of the node is then no longer proven
+_MAX_LABELS = 200_000
+# seconds given to the restricted master problem solved as a MIP at the root, for an incumbent
+_ROOT_MIP_TIME_LIMIT = 10
+_EPSILON = 1e-6
+
+
+@dataclass(frozen=True)
+class Column:
+    """
+    Route of a vehicle with its schedule and the legs of the requests it carries, a variable of the master problem
+    """
+    vehicle: int
+    # Node.index of the nodes visited, with the arrival and departure time at each of them
+    route: tuple[int, ...]
+    arrival: tuple[float, ...]
+    departure: tuple[float, ...]
+    # legs (r, u, v): request r is carried from node u, p(r) or a transfer station, to node v, d(r) or a station
+    legs: tuple[tuple[int, int, int], ...]
+    cost: float
+    # arcs ('arc', i, j) and legs ('leg', r, u, v) of the column
+    features: frozenset = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        arcs = {('arc', i, j) for i, j in zip(self.route, self.route[1:])}
+        legs = {('leg', *leg) for leg in self.legs}
+        object.__setattr__(self, 'features', frozenset(arcs | legs))
+
+    def transfer_time(self, t: int, into: bool) -> float:
+        """
+        Returns when the vehicle arrives at transfer station t if into, otherwise when it leaves t
+        """
+        p = self.route.index(t)
+        return self.arrival[p] if into else self.departure[p]
+
+
+class BranchAndPrice(AbstractModel):
+    """
+    Branch and price over vehicle routes. The master problem chooses a route (column) for each vehicle so that each
+    request is picked up once and carried to its delivery, possibly through transfer stations where it is left by a
+    vehicle and taken by another one no earlier than it arrived. Columns are priced by a resource-constrained shortest
+    path (time, load, requests on board) for each vehicle, and fractional solutions are branched on whether a vehicle
+    uses an arc or carries a leg of a request
+    """
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *, time_limit: float = 3600,
+                 node_limit: Optional[int] = None):
+        """
+        :param time_limit: seconds after which the search stops
+        :param node_limit: maximum number of branch and bound nodes, unlimited if None
+        """
+        super().__init__()
+        self.graph, self.vehicles, self.requests = graph, vehicles, requests
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+
+        self.nodes = {n.index: n for n in graph.nodes}
+        self.vehicle = {k.index: k for k in vehicles}
+        self.request = {r.index: r for r in requests}
+        self.distance = {(arc.src.index, arc.dst.index): arc.cost for arc in graph.arcs}
+        self.transfer_stations = sorted(n.index for n in graph.nodes if n.type is NodeType.TRANSFER_STATION)
+        # positions of the nodes and vehicles, to schedule and decode the solutions
+        self.plan = RoutePlan(graph, vehicles, requests)
+        self.pricing = {k.index: _Pricing(self, k) for k in vehicles}
+
+        self.solution: Optional[Solution] = None
+        self.objective = math.inf
+        self.bound = -math.inf
+        self.explored = 0
+        # False once the bound of a node is not proven, e.g. because a pricing stopped at _MAX_LABELS
+        self.proven = True
+        self._status = 'LOADED'
+        self._runtime = 0.0
+
+        self.model = self.new_model('BranchAndPrice')
+        # cost of the artificial variables, which keep the master problem feasible until the columns it needs are found:
+        # more than any solution, each route leaving each node at most once
+        self._big = 1 + len(vehicles) * max((k.travel_unit_cost for k in vehicles), default=1) * sum(
+            max((arc.cost for arc in graph.out_arcs(n)), default=0) for n in graph.nodes)
+        self._artificials: list[gb.Var] = []
+        # (a) each vehicle has a route
+        self._convexity = {k: self.model.addConstr(self._artificial() == 1, f'(a)[{k}]') for k in self.vehicle}
+        # (b) each request is picked up once
+        self._cover = {r: self.model.addConstr(self._artificial() == 1, f'(b)[{r}]') for r in self.request}
+        # (c) each request left at a transfer station is taken from there
+        self._link = {(r, t): self.model.addConstr(gb.LinExpr() == 0, f'(c)[{r},{t}]')
+                      for r in self.request for t in self.transfer_stations}
+        # (d) ... no earlier than it was left, by request, transfer station and time, see _add_sync
+        self._sync: dict[tuple[int, int], dict[float, gb.Constr]] = {key: {} for key in self._link}
+        # branching constraints ∑ λ ≥ 1 over the columns of vehicle k with a feature, by (k, feature)
+        self._forced: dict[tuple[int, tuple], gb.Constr] = {}
+
+        self.columns: list[Column] = []
+        self._vars: list[gb.Var] = []
+        self._known: set[tuple] = set()
+        for k in vehicles:
+            self._add_column(self.pricing[k.index].empty_route())
+
+    def _artificial(self) -> gb.LinExpr:
+        var = self.model.addVar(obj=self._big, name='artificial')
+        self._artificials.append(var)
+        return gb.LinExpr(var)
+
+    def optimize(self) -> None:
+        start = time.perf_counter()
+        heuristic = cheapest_insertion(self.graph, self.vehicles, self.requests, deadline=start + self.time_limit)
+        if heuristic is not None:
+            self.solution, self.objective = heuristic, heuristic.cost
+            for column in self._columns_of(heuristic):
+                self._add_column(column)
+
+        # open nodes (lower bound, order, branching decisions (k, feature, value))
+        heap: list[tuple[float, int, tuple]] = [(-math.inf, 0, ())]
+        order = itertools.count(1)
+        self.explored, self.proven = 0, True
+        while heap:
+            if time.perf_counter() - start > self.time_limit or (self.node_limit and self.explored >= self.node_limit):
+                break
+            bound, _, branches = heapq.heappop(heap)
+            if bound >= self.objective - _EPSILON:
+                continue
+            self.explored += 1
+            result = self._solve_node(branches, start)
+            if result is None:  # infeasible node
+                continue
+            value, exact, values = result
+            if exact:
+                bound = max(bound, value)
+            else:
+                self.proven = False
+            if bound >= self.objective - _EPSILON:
+                continue
+            if not branches:
+                self._root_mip(start)
+
+            feature = self._branching_feature(values)
+            if feature is None:
+                # all arcs and legs are integral, the columns of a vehicle only differing in their schedule
+                if not self._set_incumbent([column for column, x in zip(self.columns, values) if x > _EPSILON]):
+                    self.proven = False
+                continue
+            for branch in (0, 1):
+                heapq.heappush(heap, (bound, next(order), branches + ((*feature, branch),)))
+
+        self._runtime = time.perf_counter() - start
+        if not heap and self.proven:
+            self.bound = self.objective
+            self._status = 'OPTIMAL' if self.solution is not None else 'INFEASIBLE'
+        else:
+            self.bound = min([b for b, _, _ in heap] + [self.objective]) if self.proven else -math.inf
+            self._status = 'NODE_LIMIT' if self.node_limit and self.explored >= self.node_limit else 'TIME_LIMIT'
+
+    def get_result(self) -> tuple[str, float, float, float]:
+        gap = math.inf
+        if self.solution is not None and math.isfinite(self.bound):
+            gap = (self.objective - self.bound) / self.objective if self.objective > _EPSILON else 0.0
+        return self.get_status(), round(self.objective, 7), gap, self._runtime
+
+    def get_status(self):
+        return self._status
+
+    def get_solution(self, callback: bool = False) -> Solution:
+        return self.solution
+
+    # Master problem
+
+    def _add_column(self, column: Column) -> bool:
+        """
+        Add a column to the master problem, unless it is already there
+        :return: True if the column was added
+        """
+        key = (column.vehicle, column.route, column.arrival, column.departure, column.legs)
+        if key in self._known:
+            return False
+        self._known.add(key)
+
+        for r, u, v in column.legs:
+            if v in self.transfer_stations and column.transfer_time(v, True) not in self._sync[r, v]:
+                self._add_sync(r, v, column.transfer_time(v, True))
+
+        constrs, coefficients = [self._convexity[column.vehicle]], [1.0]
+        for r, u, v in column.legs:
+            if u == self.request[r].pickup.index:
+                constrs.append(self._cover[r])
+                coefficients.append(1.0)
+            for t, into in ((v, True), (u, False)):
+                if t not in self.transfer_stations:
+                    continue
+                constrs.append(self._link[r, t])
+                coefficients.append(1.0 if into else -1.0)
+                for tau, constr in self._sync[r, t].items():
+                    if _synchronizes(column.transfer_time(t, into), into, tau):
+                        constrs.append(constr)
+                        coefficients.append(1.0)
+        for (k, feature), constr in self._forced.items():
+            if k == column.vehicle and feature in column.features:
+                constrs.append(constr)
+                coefficients.append(1.0)
+
+        self._vars.append(self.model.addVar(obj=column.cost, column=gb.Column(coefficients, constrs)))
+        self.columns.append(column)
+        return True
+
+    def _add_sync(self, r: int, t: int, tau: float) -> None:
+        """
+        Add (d) for request r, transfer station t and time tau: the columns arriving at t with r from tau on and those
+        leaving t with r before tau cannot be chosen together. Times tau are the arrivals of the columns leaving r at
+        t, which is enough for integer solutions to be synchronized
+        """
+        expr = gb.LinExpr()
+        for column, var in zip(self.columns, self._vars):
+            for r2, u, v in column.legs:
+                for into in (into for into, node in ((True, v), (False, u)) if node == t):
+                    if r2 == r and _synchronizes(column.transfer_time(t, into), into, tau):
+                        expr.add(var)
+        self._sync[r, t][tau] = self.model.addConstr(expr <= 1, f'(d)[{r},{t}]')
+
+    def _solve_node(self, branches: tuple, start: float) -> Optional[tuple[float, bool, list[float]]]:
+        """
+        Solve the linear relaxation of the master problem under the branching decisions of a node by column generation
+        :return: its value, whether it is a proven lower bound of the node, and the values of the columns; None if the
+        node is infeasible
+        """
+        forbidden = {(k, feature) for k, feature, branch in branches if branch == 0}
+        forced = {(k, feature) for k, feature, branch in branches if branch == 1}
+        for key in set(self._forced) - forced:
+            self.model.remove(self._forced.pop(key))
+        for k, feature in forced - set(self._forced):
+            expr = self._artificial() + gb.quicksum(var for column, var in zip(self.columns, self._vars)
+                                                    if column.vehicle == k and feature in column.features)
+            self._forced[k, feature] = self.model.addConstr(expr >= 1, '(branch)')
+        for column, var in zip(self.columns, self._vars):
+            var.UB = 0 if any((column.vehicle, f) in forbidden for f in column.features) else gb.GRB.INFINITY
+
+        while True:
+            self.model.optimize()
+            if self.model.Status != gb.GRB.OPTIMAL:
+                return None
+            duals = _Duals(self)
+            # the exact pricing only runs once the heuristic one finds no column
+            for heuristic in (True, False):
+                exact, added = not heuristic, 0
+                for pricing in self.pricing.values():
+                    columns, complete = pricing.price(duals, forbidden, heuristic, start + self.time_limit)
+                    exact = exact and complete
+                    added += sum(self._add_column(column) for column in columns)
+                    if added and not heuristic:
+                        break
+                if added:
+                    break
+            if not added:
+                break
+            if time.perf_counter() - start > self.time_limit:
+                # the values of the columns just added are still to be found
+                self.model.optimize()
+                break
+        exact = exact and not added
+
+        values = [var.X for var in self._vars]
+        if sum(var.X for var in self._artificials) > _EPSILON:
+            return None if exact else (self.model.ObjVal, False, values)
+        return self.model.ObjVal, exact, values
+
+    def _branching_feature(self, values: list[float]) -> Optional[tuple[int, tuple]]:
+        """
+        Returns the (vehicle, feature) whose value is the most fractional, legs before arcs, None if all are integral
+        """
+        totals: dict[tuple[int, tuple], float] = {}
+        for column, value in zip(self.columns, values):
+            if value > _EPSILON:
+                for feature in column.features:
+                    totals[column.vehicle, feature] = totals.get((column.vehicle, feature), 0.0) + value
+        fractional = [(key[1][0] != 'leg', -min(value, 1 - value), repr(key), key) for key, value in totals.items()
+                      if _EPSILON < value < 1 - _EPSILON]
+        return min(fractional)[3] if fractional else None
+
+    def _root_mip(self, start: float) -> None:
+        """
+        Solve the master problem restricted to the columns found so far as a MIP, for an incumbent
+        """
+        remaining = self.time_limit - (time.perf_counter() - start)
+        if remaining <= 0:
+            return
+        for var in self._vars:
+            var.VType = gb.GRB.BINARY
+        for var in self._artificials:
+            var.UB = 0
+        time_limit = self.model.Params.TimeLimit
+        self.model.Params.TimeLimit = min(_ROOT_MIP_TIME_LIMIT, remaining)
+        self.model.optimize()
+        if self.model.SolCount > 0:
+            self._set_incumbent([column for column, var in zip(self.columns, self._vars) if var.X > 0.5])
+        self.model.Params.TimeLimit = time_limit
+        for var in self._vars:
+            var.VType = gb.GRB.CONTINUOUS
+        for var in self._artificials:
+            var.UB = gb.GRB.INFINITY
+
+    # Solutions
+
+    def _set_incumbent(self, columns: list[Column]) -> bool:
+        """
+        Keep the routes and legs of some columns, one route per vehicle, as incumbent if they cost less than it. The
+        vehicles are scheduled anew, as early as they can
+        :return: False if the routes cannot be scheduled, i.e. some vehicles wait for each other at transfer stations
+        """
+        plan = self.plan.copy()
+        position = {k.index: p for p, k in enumerate(plan.vehicles)}
+        legs: dict[int, dict[int, tuple[int, int]]] = {}
+        for column in columns:
+            plan.routes[position[column.vehicle]] = [plan.pos[self.nodes[i]] for i in column.route]
+            for r, u, v in column.legs:
+                legs.setdefault(r, {})[u] = (column.vehicle, v)
+        plan.legs = {}
+        for r, following in legs.items():
+            request = self.request[r]
+            u, chain = request.pickup.index, []
+            while u != request.destination.index:
+                k, v = following.pop(u)
+                chain.append((position[k], plan.pos[self.nodes[u]], plan.pos[self.nodes[v]], float(request.load)))
+                u = v
+            plan.legs[request] = chain
+        if plan.schedule(plan.routes, plan.legs) is None:
+            return False
+        if plan.total_cost() < self.objective - _EPSILON:
+            self.solution = plan.solution()
+            self.objective = self.solution.cost
+        return True
+
+    def _columns_of(self, solution: Solution) -> list[Column]:
+        """
+        Returns the columns of the routes of a solution, e.g. of heuristic.cheapest_insertion
+        """
+        plan = RoutePlan.from_solution(self.graph, self.vehicles, self.requests, solution)
+        arrival, departure = plan.schedule(plan.routes, plan.legs)
+        columns = []
+        for p, k in enumerate(plan.vehicles):
+            legs = tuple(sorted((r.index, u.index, v.index) for r, r_legs in solution.legs.items()
+                                for vehicle, u, v in r_legs if vehicle == k))
+            route = tuple(plan.nodes[i].index for i in plan.routes[p])
+            columns.append(Column(k.index, route, tuple(arrival[p]), tuple(departure[p]), legs, plan.route_cost(p)))
+        return columns
+
+
+def _synchronizes(transfer: float, into: bool, tau: float) -> bool:
+    """
+    Returns True if a leg arriving at a transfer station at time transfer if into, or leaving it at time transfer
+    otherwise, is in constraint (d) of time tau
+    """
+    return transfer >= tau if into else transfer < tau
+
+
+class _Duals:
+    """
+    Dual values of the master problem read by the pricing
+    """
+
+    def __init__(self, bp: BranchAndPrice):
+        self.convexity = {k: constr.Pi for k, constr in bp._convexity.items()}
+        self.cover = {r: constr.Pi for r, constr in bp._cover.items()}
+        self.link = {key: constr.Pi for key, constr in bp._link.items()}
+        # (tau, dual) of the constraints (d) of each request and transfer station
+        self.sync = {key: [(tau, constr.Pi) for tau, constr in rows.items()] for key, rows in bp._sync.items()}
+        self.forced = {key: constr.Pi for key, constr in bp._forced.items()}
+
+    def transfer(self, r: int, t: int, into: bool, time: float) -> float:
+        """
+        Returns the reduced cost of arriving at transfer station t with request r at a time if into, otherwise of
+        leaving t with r at a time
+        """
+        link = -self.link[r, t] if into else self.link[r, t]
+        return link - sum(pi for tau, pi in self.sync[r, t] if _synchronizes(time, into, tau))
+
+
+class _Label:
+    __slots__ = ('node', 'arrival', 'time', 'load', 'onboard', 'visited', 'reduced_cost', 'cost', 'parent', 'legs',
+                 'alive')
+
+    def __init__(self, node, arrival, time, load, onboard, visited, reduced_cost, cost, parent, legs):
+        self.node = node
+        self.arrival = arrival
+        # departure time from node
+        self.time = time
+        self.load = load
+        # (r, u): request r is on board since node u, p(r) or a transfer station
+        self.onboard = onboard
+        # requests picked up and transfer stations visited so far
+        self.visited = visited
+        self.reduced_cost = reduced_cost
+        self.cost = cost
+        self.parent = parent
+        # legs ending at node
+        self.legs = legs
+        self.alive = True
+
+    def dominates(self, other: '_Label') -> bool:
+        return (self.reduced_cost <= other.reduced_cost + _EPSILON and self.time <= other.time
+                and self.visited <= other.visited)
+
+
+class _Pricing:
+    """
+    Resource-constrained shortest path of a vehicle from its origin to its destination depot, each arc and leg costing
+    its reduced cost in the master problem. Labels at the same node with the same requests on board are compared on
+    reduced cost, time and nodes visited
+    """
+
+    def __init__(self, bp: BranchAndPrice, vehicle: Vehicle):
+        self.bp = bp
+        self.vehicle = vehicle
+        self.origin, self.dest = vehicle.origin.index, vehicle.dest.index
+        depots = {n.index for n in bp.graph.nodes if n.type in (NodeType.ORIGIN_DEPOT, NodeType.DESTINATION_DEPOT)}
+        other_depots = depots - {self.origin, self.dest}
+        # arcs (j, distance) leaving each node, without those to other vehicles' depots or back to o(k) unless o(k) is
+        # also the destination, as in Sampaio instances
+        self.out = {
+            n.index: [(arc.dst.index, arc.cost) for arc in bp.graph.out_arcs(n) if arc.dst.index not in other_depots
+                      and (arc.dst.index != self.origin or self.origin == self.dest)]
+            for n in bp.graph.nodes if n.index not in other_depots
+        }
+        self.pickup_of = {r.pickup.index: r.index for r in bp.requests}
+        self.delivery_of = {r.destination.index: r.index for r in bp.requests}
+        self.load = {r.index: float(r.load) for r in bp.requests}
+
+    def empty_route(self) -> Column:
+        """
+        Returns the route of the vehicle when it carries no request
+        """
+        start = float(self.vehicle.origin.earliest_time)
+        if self.origin == self.dest:
+            return Column(self.vehicle.index, (self.origin, self.dest), (start, start), (start, start), (), 0.0)
+        distance = self.bp.distance[self.origin, self.dest]
+        arrival = max(start + distance, float(self.vehicle.dest.earliest_time))
+        return Column(self.vehicle.index, (self.origin, self.dest), (start, arrival), (start, arrival), (),
+                      distance * self.vehicle.travel_unit_cost)
+
+    def price(self, duals: _Duals, forbidden: set[tuple[int, tuple]], heuristic: bool = False,
+              deadline: Optional[float] = None) -> tuple[list[Column], bool]:
+        """
+        Returns the columns of the vehicle with the most negative reduced cost, and False if the search stopped at
+        _MAX_LABELS or at the deadline, i.e. other columns may have a negative reduced cost
+        :param forbidden: the (vehicle, feature) branched to 0
+        :param heuristic: set to True to transfer each request at most once and only take requests at transfer
+        stations whose leg has a negative reduced cost by itself, missing some columns but much faster
+        :param deadline: time.perf_counter() past which the search stops, checked before extending each label
+        """
+        k, unit_cost, nodes = self.vehicle.index, self.vehicle.travel_unit_cost, self.bp.nodes
+        bonus = {feature: -pi for (vehicle, feature), pi in duals.forced.items() if vehicle == k}
+        banned = {feature for vehicle, feature in forbidden if vehicle == k}
+        # where a request on board was taken from only matters to the legs branched on
+        branched = {feature[1] for feature in itertools.chain(bonus, banned) if feature[0] == 'leg'}
+
+        start = float(nodes[self.origin].earliest_time)
+        root = _Label(self.origin, start, start, 0.0, frozenset(), frozenset(), -duals.convexity[k], 0.0, None, ())
+        buckets: dict[tuple, list[_Label]] = {}
+        # labels are extended by increasing departure time, so that most are dominated before they are extended
+        queue = [(root.time, 0, root)]
+        order = itertools.count(1)
+        completed: list[_Label] = []
+        extended = 0
+
+        def push(label: _Label) -> None:
+            onboard = frozenset(item if item[0] in branched else item[0] for item in label.onboard)
+            bucket = buckets.setdefault((label.node, onboard), [])
+            if any(other.dominates(label) for other in bucket):
+                return
+            for other in bucket:
+                if label.dominates(other):
+                    other.alive = False
+            bucket[:] = [other for other in bucket if other.alive]
+            bucket.append(label)
+            heapq.heappush(queue, (label.time, next(order), label))
+
+        while queue:
+            _, _, label = heapq.heappop(queue)
+            if not label.alive:
+                continue
+            extended += 1
+            if extended > _MAX_LABELS:
+                return self._columns(completed), False
+            if deadline is not None and time.perf_counter() > deadline:
+                return self._columns(completed), False
+            for j, distance in self.out[label.node]:
+                if ('arc', label.node, j) in banned:
+                    continue
+                node = nodes[j]
+                arrival = max(label.time + distance, float(node.earliest_time))
+                if arrival > node.latest_time:
+                    continue
+                cost = label.cost + distance * unit_cost
+                reduced_cost = label.reduced_cost + distance * unit_cost + bonus.get(('arc', label.node, j), 0.0)
+
+                if j == self.dest:
+                    if not label.onboard:
+                        completed.append(_Label(j, arrival, arrival, 0.0, label.onboard, label.visited, reduced_cost,
+                                                cost, label, ()))
+                elif j in self.pickup_of:
+                    r = self.pickup_of[j]
+                    if (r not in label.visited and label.load + self.load[r] <= self.vehicle.capacity
+                            and all(item[0] != r for item in label.onboard)):
+                        push(_Label(j, arrival, arrival, label.load + self.load[r], label.onboard | {(r, j)},
+                                    label.visited | {r}, reduced_cost - duals.cover[r], cost, label, ()))
+                elif j in self.delivery_of:
+                    r = self.delivery_of[j]
+                    carried = next((item for item in label.onboard if item[0] == r), None)
+                    if carried is None or ('leg', r, carried[1], j) in banned:
+                        continue
+                    push(_Label(j, arrival, arrival, label.load - self.load[r], label.onboard - {carried},
+                                label.visited, reduced_cost + bonus.get(('leg', r, carried[1], j), 0.0), cost, label,
+                                ((r, carried[1], j),)))
+                elif node.type is NodeType.TRANSFER_STATION and j not in label.visited:
+                    for transfer in self._transfers(label, j, arrival, reduced_cost, cost, duals, bonus, banned,
+                                                    heuristic):
+                        push(transfer)
+
+        return self._columns(completed), True
+
+    def _transfers(self, label: _Label, t: int, arrival: float, reduced_cost: float, cost: float, duals: _Duals,
+                   bonus: dict, banned: set, heuristic: bool) -> list[_Label]:
+        """
+        Returns the labels leaving transfer station t: the vehicle leaves there some of the requests on board, waits
+        until some time and takes some of the requests other vehicles left there
+        """
+        node = self.bp.nodes[t]
+        droppable = sorted((r, u) for r, u in label.onboard if ('leg', r, u, t) not in banned
+                           and (not heuristic or u == self.bp.request[r].pickup.index))
+        carried = {r for r, _ in label.onboard}
+        takeable = [r for r in self.bp.request if r not in carried and (not heuristic or r not in label.visited)]
+        # departures worth waiting for are the times of the constraints (d), past which the dual values change
+        departures = sorted({arrival} | {tau for r in takeable for tau, _ in duals.sync[r, t]
+                                         if arrival < tau <= node.latest_time})
+        # legs and arcs with a bonus of a branching constraint make any request worth taking, see below
+        arc_bonus = any(feature[0] == 'arc' for feature in bonus)
+        leg_bonus = {feature[1] for feature in bonus if feature[0] == 'leg'}
+        # the most a request can gain at the transfer stations still to be visited, each where it is left or taken
+        gain = {r: 0.0 if heuristic else -sum(abs(duals.link[r, t2]) for t2 in self.bp.transfer_stations
+                                               if t2 != t and t2 not in label.visited) for r in takeable}
+
+        candidates_by_departure = []
+        for departure in departures:
+            candidates = []
+            for r in takeable:
+                delivery = self.bp.request[r].destination
+                distance = self.bp.distance.get((t, delivery.index))
+                if distance is not None and departure + distance > delivery.latest_time:
+                    continue
+                value = duals.transfer(r, t, False, departure)
+                # taking r costs the detour to d(r), which is no shorter than the route without it by the triangle
+                # inequality, or leads to other transfer stations: it is only worth it if its reduced cost and the
+                # most those stations can give back are negative
+                if value + gain[r] < -_EPSILON or arc_bonus or r in leg_bonus:
+                    candidates.append((r, value))
+            candidates_by_departure.append((departure, candidates))
+
+        labels = []
+        for dropped in _subsets(droppable):
+            onboard = label.onboard - set(dropped)
+            load = label.load - sum(self.load[r] for r, _ in dropped)
+            dropped_cost = reduced_cost + sum(duals.transfer(r, t, True, arrival) + bonus.get(('leg', r, u, t), 0.0)
+                                              for r, u in dropped)
+            legs = tuple((r, u, t) for r, u in dropped)
+            for departure, candidates in candidates_by_departure:
+                for taken in _subsets(candidates):
+                    taken_load = sum(self.load[r] for r, _ in taken)
+                    if load + taken_load > self.vehicle.capacity:
+                        continue
+                    labels.append(_Label(t, arrival, departure, load + taken_load,
+                                         onboard | {(r, t) for r, _ in taken}, label.visited | {t},
+                                         dropped_cost + sum(value for _, value in taken), cost, label, legs))
+        return labels
+
+    def _columns(self, completed: list[_Label]) -> list[Column]:
+        columns = []
+        for label in sorted(completed, key=lambda l: l.reduced_cost)[:_COLUMNS_PER_VEHICLE]:
+            if label.reduced_cost >= -_EPSILON:
+                break
+            route, arrival, departure, legs = [], [], [], []
+            node = label
+            while node is not None:
+                route.append(node.node)
+                arrival.append(node.arrival)
+                departure.append(node.time)
+                legs.extend(node.legs)
+                node = node.parent
+            columns.append(Column(self.vehicle.index, tuple(reversed(route)), tuple(reversed(arrival)),
+                                  tuple(reversed(departure)), tuple(sorted(legs)), label.cost))
+        return columns
+
+
+def _subsets(items: list) -> itertools.chain:
+    return itertools.chain.from_iterable(itertools.combinations(items, n) for n in range(len(items) + 1))
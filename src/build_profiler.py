@@ -0,0 +1,138 @@
+from bisect import bisect_right
+from typing import Any, Optional
+
+import sys
+import time
+
+import gurobipy as gb
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _peak_rss() -> Optional[int]:
+    """
+    Returns the peak resident set size of the process so far, in bytes, None if it cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class BuildProfiler:
+    """
+    Measures the build of a Gurobi model by constraint family, e.g. (8): the builder calls record after adding each
+    family, and whatever happened since the previous call is attributed to it
+    """
+
+    def __init__(self, model: gb.Model, enabled: bool = True):
+        """
+        :param model: model being built, still empty
+        :param enabled: set to False to make record do nothing, so that the builders can always call it
+        """
+        self.model = model
+        self.enabled = enabled
+        self.families: dict[str, dict[str, Any]] = {}
+        # first row added by each call to record, with its family, to attribute the rows left by presolve
+        self._rows: list[tuple[int, str]] = []
+        self._start = self._last = time.perf_counter()
+        self._last_rss = _peak_rss()
+        self._last_counts = (0, 0, 0)
+
+    def record(self, family: str) -> None:
+        """
+        Attribute to family the time, variables, constraints, non-zeros and peak memory growth since the previous call
+        :param family: name of the family, e.g. '(8)' or 'variables'. Families recorded more than once add up
+        """
+        if not self.enabled:
+            return
+        self.model.update()
+        counts = (self.model.NumVars, self.model.NumConstrs, self.model.NumNZs)
+        now, rss = time.perf_counter(), _peak_rss()
+
+        stats = self.families.setdefault(family, {'time': 0.0, 'variables': 0, 'constraints': 0, 'nonzeros': 0,
+                                                  'peak_rss_delta': 0 if rss is not None else None})
+        stats['time'] += now - self._last
+        stats['variables'] += counts[0] - self._last_counts[0]
+        stats['constraints'] += counts[1] - self._last_counts[1]
+        stats['nonzeros'] += counts[2] - self._last_counts[2]
+        if rss is not None:
+            stats['peak_rss_delta'] += rss - self._last_rss
+        if counts[1] > self._last_counts[1]:
+            self._rows.append((self._last_counts[1], family))
+
+        self._last, self._last_rss, self._last_counts = now, rss, counts
+
+    def report(self, presolve: bool = True) -> dict[str, Any]:
+        """
+        Returns the statistics of each family and of the whole model, in the order the families were recorded:
+        {'families': {family: {'time', 'variables', 'constraints', 'nonzeros', 'peak_rss_delta', 'presolved'}},
+        'model': {'time', 'variables', 'constraints', 'nonzeros'}, 'presolved': {...}}.
+        Times are in seconds and memory in bytes, 'presolved' is the number of constraints of the family left by
+        Gurobi presolve, 0 if presolve removed the family entirely
+        :param presolve: set to False to skip presolve, whose statistics are then None. They are None as well if Gurobi
+        cannot presolve the model, the reason being under 'presolve_error'
+        """
+        self.model.update()
+        report = {
+            'families': {family: dict(stats) for family, stats in self.families.items()},
+            'model': {'time': self._last - self._start, 'variables': self.model.NumVars,
+                      'constraints': self.model.NumConstrs, 'nonzeros': self.model.NumNZs},
+            'presolved': None
+        }
+        for stats in report['families'].values():
+            stats['presolved'] = None
+        if presolve:
+            try:
+                self._add_presolve_stats(report)
+            except gb.GurobiError as e:  # e.g. a size-limited license
+                report['presolve_error'] = str(e)
+        return report
+
+    def _add_presolve_stats(self, report: dict[str, Any]) -> None:
+        # presolve a copy whose constraints are named after their row, to find the family of the rows left
+        copy = self.model.copy()
+        constrs = copy.getConstrs()
+        copy.setAttr('ConstrName', constrs, [str(row) for row in range(len(constrs))])
+        start = time.perf_counter()
+        presolved = copy.presolve()
+        report['presolved'] = {'time': time.perf_counter() - start, 'variables': presolved.NumVars,
+                               'constraints': presolved.NumConstrs, 'nonzeros': presolved.NumNZs}
+
+        for stats in report['families'].values():
+            stats['presolved'] = 0
+        first_rows = [row for row, _ in self._rows]
+        for constr in presolved.getConstrs():
+            name = constr.ConstrName
+            if name.isdigit():
+                family = self._rows[bisect_right(first_rows, int(name)) - 1][1]
+                report['families'][family]['presolved'] += 1
+        presolved.dispose()
+        copy.dispose()
+
+
+def format_report(report: dict[str, Any]) -> str:
+    """
+    Returns the report of BuildProfiler as a table, one line per family
+    """
+    lines = [f'{"family":<12}{"time (s)":>10}{"vars":>10}{"constrs":>10}{"nonzeros":>12}{"presolved":>11}'
+             f'{"peak RSS +MB":>14}']
+    for family, stats in report['families'].items():
+        presolved = '-' if stats['presolved'] is None else stats['presolved'] if stats['constraints'] else ''
+        rss = '-' if stats['peak_rss_delta'] is None else f'{stats["peak_rss_delta"] / 2**20:.1f}'
+        lines.append(f'{family:<12}{stats["time"]:>10.3f}{stats["variables"]:>10}{stats["constraints"]:>10}'
+                     f'{stats["nonzeros"]:>12}{presolved:>11}{rss:>14}')
+    total = report['model']
+    lines.append(f'{"total":<12}{total["time"]:>10.3f}{total["variables"]:>10}{total["constraints"]:>10}'
+                 f'{total["nonzeros"]:>12}')
+    if report.get('presolve_error'):
+        lines.append(f'presolve failed: {report["presolve_error"]}')
+    elif report['presolved'] is not None:
+        presolved = report['presolved']
+        lines.append(f'{"presolved":<12}{presolved["time"]:>10.3f}{presolved["variables"]:>10}'
+                     f'{presolved["constraints"]:>10}{presolved["nonzeros"]:>12}')
+    return '\n'.join(lines)
@@ -0,0 +1,233 @@
+from dataclasses import dataclass, fields, replace
+from functools import lru_cache
+from pathlib import Path
+
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from graph import Arc, Graph, Node, NodeType
+from request import Request
+from vehicle import Vehicle
+
+
+# instances kept by read_compact_instance
+_CACHE_SIZE = 256
+
+
+@dataclass(frozen=True, eq=False)
+class CompactGraph:
+    """
+    Graph whose nodes are numbered 0..n-1 (node ids) and whose attributes are stored in NumPy arrays: the arcs are the
+    True entries of a boolean adjacency matrix, their costs the entries of a dense cost matrix
+    """
+    # Node.index of each node id, i.e. its position in the instance file
+    index: np.ndarray
+    # NodeType value of each node, e.g. 'p'
+    types: np.ndarray
+    # (n, 2) coordinates of the nodes
+    coordinates: np.ndarray
+    earliest_time: np.ndarray
+    latest_time: np.ndarray
+    # (n, n) Euclidean distances between the nodes
+    cost: np.ndarray
+    # (n, n) True where (i, j) is an arc of the graph
+    adjacency: np.ndarray
+    # number of arcs of the complete graph removed because no feasible solution can use them
+    removed_arcs: int = 0
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.index)
+
+    @property
+    def n_arcs(self) -> int:
+        return int(np.count_nonzero(self.adjacency))
+
+    def is_type(self, node_type: NodeType) -> np.ndarray:
+        """
+        Returns a boolean mask of the nodes of the given type
+        """
+        return self.types == node_type.value
+
+    def arcs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the node ids of the sources and of the destinations of the arcs, sorted by source and destination
+        """
+        return np.nonzero(self.adjacency)
+
+    def cost_csr(self) -> sp.csr_matrix:
+        """
+        Returns the cost of the arcs as a CSR matrix: row i lists the arcs leaving i. Arcs of cost 0, e.g. between an
+        origin and a destination depot in the same place, are stored as explicit zeros
+        """
+        src, dst = self.arcs()
+        return sp.csr_matrix((self.cost[src, dst], (src, dst)), shape=self.adjacency.shape)
+
+
+@dataclass(frozen=True, eq=False)
+class CompactInstance:
+    """
+    Instance data over a CompactGraph: vehicles and requests are numbered from 0 like Vehicle.index and Request.index,
+    their nodes are node ids
+    """
+    graph: CompactGraph
+    vehicle_origin: np.ndarray
+    vehicle_dest: np.ndarray
+    capacity: np.ndarray
+    request_pickup: np.ndarray
+    request_delivery: np.ndarray
+    load: np.ndarray
+    # travel unit cost of each vehicle, see Vehicle.travel_unit_cost
+    unit_cost: np.ndarray
+
+
+def distance_matrix(coordinates: np.ndarray) -> np.ndarray:
+    """
+    Returns the Euclidean distances between all pairs of points
+    :param coordinates: (n, 2) array of points
+    :return: (n, n) array of distances
+    """
+    diff = coordinates[:, None, :].astype(float) - coordinates[None, :, :]
+    return np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+
+
+def removable_arcs(graph: CompactGraph, request_pickup: np.ndarray, request_delivery: np.ndarray, *,
+                   sampaio: bool = False) -> np.ndarray:
+    """
+    Returns a boolean matrix, True where the arc (i,j) of the complete graph cannot be used by any feasible solution:
+    arcs into an origin depot, arcs out of a destination depot, arcs from a delivery to the pickup of the same request
+    and arcs (i,j) such that Ei + τ_i_j > Lj
+    :param graph: the complete graph
+    :param request_pickup: pickup node id of each request
+    :param request_delivery: delivery node id of each request
+    :param sampaio: Set to true if the instance data is for the Sampaio model (vehicles go back to the origin depot)
+    :return: (n, n) boolean array
+    """
+    removable = np.zeros_like(graph.adjacency)
+    if not sampaio:
+        removable[:, graph.is_type(NodeType.ORIGIN_DEPOT)] = True  # vehicles never return to an origin depot
+    removable[graph.is_type(NodeType.DESTINATION_DEPOT), :] = True  # vehicles never leave a destination depot
+    removable[request_delivery, request_pickup] = True  # a request is delivered after it is picked up
+    # the time window of j cannot be met
+    removable |= graph.earliest_time[:, None] + graph.cost > graph.latest_time[None, :]
+    return removable
+
+
+def read_instance_arrays(filepath: Path) -> dict[str, np.ndarray]:
+    """
+    Returns the content of an instance file as arrays, one entry per node in the order of the file: 'node' (label,
+    e.g. 'p1'), 'x', 'y', 'a' (earliest time), 'b' (latest time) and 'load', plus the 0-d array 'capacity'
+    :param filepath: Path of the .txt file containing the instance's parameters
+    """
+    with open(filepath, 'r') as f:
+        params_names = f.readline().replace('\n', '').split('\t')
+        params_values = f.readline().replace('\n', '').split('\t')
+        params = dict(zip(params_names, params_values))
+        f.readline()  # skip blank line
+        instance_data = f.readline().replace('\n', '').split('\t')
+        n_nodes = 2 * int(params['nr']) + 2 * int(params['nv']) + int(params['nt'])
+        columns = list(zip(*(f.readline().replace('\n', '').split('\t') for _ in range(n_nodes))))
+
+    data = dict(zip(instance_data, columns))
+    arrays = {'node': np.array(data['node'], dtype=str)}
+    for name in ('x', 'y', 'a', 'b', 'load'):
+        arrays[name] = np.array(data[name], dtype=int)
+    arrays['capacity'] = np.array(int(params['capacity']))
+    return arrays
+
+
+def compact_instance(arrays: dict[str, np.ndarray], *, sampaio: bool = False, prune: bool = True) -> CompactInstance:
+    """
+    Returns the CompactInstance of the arrays of read_instance_arrays, see utils.get_instance_data for the parameters
+    """
+    labels = arrays['node'].tolist()
+    keep = np.ones(len(labels), dtype=bool)
+    if sampaio:  # each vehicle goes back to its origin depot
+        keep = np.array([label[0] != NodeType.DESTINATION_DEPOT.value for label in labels], dtype=bool)
+    labels = [label for label, kept in zip(labels, keep) if kept]
+    node_id = {label: n for n, label in enumerate(labels)}
+
+    coordinates = np.stack([arrays['x'][keep], arrays['y'][keep]], axis=1)
+    graph = CompactGraph(
+        index=np.flatnonzero(keep),
+        types=np.array([label[0] for label in labels], dtype='<U1'),
+        coordinates=coordinates,
+        earliest_time=arrays['a'][keep],
+        latest_time=arrays['b'][keep],
+        cost=distance_matrix(coordinates),
+        adjacency=~np.eye(len(labels), dtype=bool)
+    )
+
+    # requests and vehicles are numbered in the order of their delivery and destination depot nodes
+    deliveries = [label for label in labels if label[0] == NodeType.DELIVERY.value]
+    request_pickup = np.array([node_id['p' + d[1:]] for d in deliveries], dtype=int)
+    request_delivery = np.array([node_id[d] for d in deliveries], dtype=int)
+    load = np.abs(arrays['load'][keep][request_delivery])
+    if sampaio:
+        origins = [label for label in labels if label[0] == NodeType.ORIGIN_DEPOT.value]
+        vehicle_origin = vehicle_dest = np.array([node_id[o] for o in origins], dtype=int)
+    else:
+        dests = [label for label in labels if label[0] == NodeType.DESTINATION_DEPOT.value]
+        vehicle_origin = np.array([node_id['o' + e[1:]] for e in dests], dtype=int)
+        vehicle_dest = np.array([node_id[e] for e in dests], dtype=int)
+
+    if prune:
+        n_arcs = graph.n_arcs
+        graph = replace(graph, adjacency=graph.adjacency & ~removable_arcs(graph, request_pickup, request_delivery,
+                                                                            sampaio=sampaio))
+        graph = replace(graph, removed_arcs=n_arcs - graph.n_arcs)
+
+    n_vehicles = len(vehicle_origin)
+    return CompactInstance(graph, vehicle_origin, vehicle_dest, np.full(n_vehicles, int(arrays['capacity'])),
+                           request_pickup, request_delivery, load, np.ones(n_vehicles, dtype=int))
+
+
+def read_compact_instance(filepath: Path, *, sampaio: bool = False, prune: bool = True) -> CompactInstance:
+    """
+    Returns the instance data as a CompactInstance, see utils.get_instance_data for the parameters.
+    Each instance is read once per process: later calls return the same CompactInstance, whose arrays are read-only,
+    until the size or the modification time of the file changes
+    """
+    stat = os.stat(filepath)
+    return _read_compact_instance(str(Path(filepath).resolve()), stat.st_mtime_ns, stat.st_size, sampaio, prune)
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _read_compact_instance(path: str, mtime_ns: int, size: int, sampaio: bool, prune: bool) -> CompactInstance:
+    # mtime_ns and size are only part of the key of the cache
+    instance = compact_instance(read_instance_arrays(Path(path)), sampaio=sampaio, prune=prune)
+    for data in (instance, instance.graph):
+        for f in fields(data):
+            value = getattr(data, f.name)
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+    return instance
+
+
+def to_instance_data(instance: CompactInstance) -> tuple[Graph, set[Vehicle], set[Request]]:
+    """
+    Returns the graph, vehicles and requests of a CompactInstance as taken by the models, see utils.get_instance_data.
+    Only the arcs of the graph are created, and they share the Node objects
+    """
+    graph = instance.graph
+    nodes = [Node(int(i), NodeType(t), (int(x), int(y)), int(e), int(l)) for i, t, (x, y), e, l
+             in zip(graph.index, graph.types, graph.coordinates, graph.earliest_time, graph.latest_time)]
+
+    src, dst = graph.arcs()
+    costs = graph.cost[src, dst].tolist()
+    arcs = [Arc(nodes[i], nodes[j], cost) for i, j, cost in zip(src.tolist(), dst.tolist(), costs)]
+    # the arcs are sorted by source: the arcs leaving a node are a slice of them, the arcs entering it a slice of order
+    out_ptr = np.searchsorted(src, np.arange(graph.n_nodes + 1)).tolist()
+    order = np.argsort(dst, kind='stable')
+    in_ptr = np.searchsorted(dst[order], np.arange(graph.n_nodes + 1)).tolist()
+    order = order.tolist()
+    out_arcs = {node: arcs[out_ptr[i]:out_ptr[i + 1]] for i, node in enumerate(nodes)}
+    in_arcs = {node: [arcs[a] for a in order[in_ptr[i]:in_ptr[i + 1]]] for i, node in enumerate(nodes)}
+
+    vehicles = {Vehicle(k, nodes[o], nodes[e], int(q), int(c)) for k, (o, e, q, c) in
+                enumerate(zip(instance.vehicle_origin, instance.vehicle_dest, instance.capacity, instance.unit_cost))}
+    requests = {Request(r, nodes[p], nodes[d], int(q))
+                for r, (p, d, q) in enumerate(zip(instance.request_pickup, instance.request_delivery, instance.load))}
+    return Graph(set(nodes), set(arcs), out_arcs, in_arcs, graph.removed_arcs), vehicles, requests
@@ -1,5 +1,5 @@
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 class NodeType(Enum):
@@ -18,6 +18,10 @@ class Node:
     earliest_time: int
     latest_time: int
 
+    def __hash__(self):
+        # nodes are dict keys and set members throughout the builders: the index identifies a node in an instance
+        return hash(self.index)
+
 
 @dataclass(frozen=True)
 class Arc:
@@ -25,8 +29,56 @@ class Arc:
     dst: Node
     cost: float
 
+    def __hash__(self):
+        return hash((self.src.index, self.dst.index))
+
 
 @dataclass(frozen=True)
 class Graph:
     nodes: set[Node]
     arcs: set[Arc]
+    _out_arcs: dict[Node, list[Arc]] = field(default=None, repr=False, compare=False)
+    _in_arcs: dict[Node, list[Arc]] = field(default=None, repr=False, compare=False)
+    # number of arcs of the complete graph removed because no feasible solution can use them
+    removed_arcs: int = field(default=0, compare=False)
+
+    def __post_init__(self):
+        if self._out_arcs is None or self._in_arcs is None:
+            out_arcs, in_arcs = build_adjacency(self.nodes, self.arcs)
+            object.__setattr__(self, '_out_arcs', out_arcs)
+            object.__setattr__(self, '_in_arcs', in_arcs)
+
+    def out_arcs(self, node: Node) -> list[Arc]:
+        """
+        Returns the arcs (i,j) leaving node i
+        """
+        return self._out_arcs.get(node, [])
+
+    def in_arcs(self, node: Node) -> list[Arc]:
+        """
+        Returns the arcs (j,i) entering node i
+        """
+        return self._in_arcs.get(node, [])
+
+
+def build_adjacency(nodes: set[Node], arcs: set[Arc]) -> tuple[dict[Node, list[Arc]], dict[Node, list[Arc]]]:
+    """
+    Index the arcs of a graph by source and by destination node
+    :param nodes: the nodes of the graph
+    :param arcs: the arcs of the graph
+    :return: a tuple containing the outgoing and the incoming arcs of each node
+    """
+    out_arcs = {n: [] for n in nodes}
+    in_arcs = {n: [] for n in nodes}
+    for arc in arcs:
+        out_arcs[arc.src].append(arc)
+        in_arcs[arc.dst].append(arc)
+    return out_arcs, in_arcs
+
+
+def remove_nodes(graph: Graph, nodes: set[Node]) -> Graph:
+    """
+    Returns the graph without some nodes and the arcs leaving or entering them
+    """
+    arcs = {arc for arc in graph.arcs if arc.src not in nodes and arc.dst not in nodes}
+    return Graph(graph.nodes - nodes, arcs, removed_arcs=graph.removed_arcs)
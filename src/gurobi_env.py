@@ -0,0 +1,65 @@
+from typing import Any, Optional
+
+import atexit
+import os
+
+import gurobipy as gb
+
+
+# parameters of the shared environment, and therefore defaults of every model, see configure
+DEFAULT_PARAMS: dict[str, Any] = {'OutputFlag': 0}
+
+_params: dict[str, Any] = dict(DEFAULT_PARAMS)
+_env: Optional[gb.Env] = None
+# process that created _env: a process forked from it must start its own environment
+_pid: Optional[int] = None
+
+
+def configure(**params) -> None:
+    """
+    Set default parameters of the models created from now on, e.g. configure(Threads=1, OutputFlag=1). The
+    environment keeps them for the rest of the process, a model can still override them with model.setParam
+    """
+    _params.update(params)
+    if _env is not None and _pid == os.getpid():
+        for name, value in params.items():
+            _env.setParam(name, value)
+
+
+def get_env() -> gb.Env:
+    """
+    Returns the Gurobi environment of the process, started on first use. Starting an environment checks out a
+    license, which is done once per process instead of once per model
+    """
+    global _env, _pid
+    if _env is None or _pid != os.getpid():
+        # a forked child inherits the parent's environment, which it must neither use nor dispose
+        _env = gb.Env(params=_params)
+        _pid = os.getpid()
+    return _env
+
+
+def new_model(name: str) -> gb.Model:
+    """
+    Returns an empty model in the environment of the process
+    """
+    return gb.Model(name, env=get_env())
+
+
+def read_model(filename: str) -> gb.Model:
+    """
+    Returns the model read from a file, e.g. an .mps file, in the environment of the process
+    """
+    return gb.read(filename, env=get_env())
+
+
+@atexit.register
+def dispose() -> None:
+    """
+    Release the environment of the process and its license, called at exit. The models created from it can no longer
+    be used, a later get_env starts a new environment
+    """
+    global _env, _pid
+    if _env is not None and _pid == os.getpid():
+        _env.dispose()
+    _env, _pid = None, None
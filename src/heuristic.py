@@ -0,0 +1,388 @@
+import numpy as np
+import time
+
+from copy import copy
+from dataclasses import dataclass
+from typing import Optional
+
+from graph import Graph, Node, NodeType
+from request import Request
+from vehicle import Vehicle
+
+
+# cheapest insertions of a request in each vehicle checked against the time windows
+_MAX_CANDIDATES = 100
+# cheapest insertions of each leg of a transfer combined with those of the other leg
+_MAX_TRANSFER_CANDIDATES = 3
+# constructions started over with the request that could not be inserted first
+_MAX_RESTARTS = 5
+
+
+@dataclass
+class Solution:
+    """
+    Routes of the vehicles and the way each request travels on them
+    """
+    # nodes visited by each vehicle, from o(k) to o'(k)
+    routes: dict[Vehicle, list[Node]]
+    # legs (k, i, j) of each request: vehicle k carries it from node i to node j. Two legs meet at a transfer station
+    legs: dict[Request, list[tuple[Vehicle, Node, Node]]]
+    # arrival and departure time of each vehicle at the nodes of its route, the arrival at o(k) of a vehicle that goes
+    # back to its origin depot is the time it gets back
+    arrival: dict[Vehicle, dict[Node, float]]
+    departure: dict[Vehicle, dict[Node, float]]
+    cost: float
+    # load of each vehicle on each arc of its route
+    loads: dict[Vehicle, list[float]]
+
+    def transfers(self) -> list[tuple[Request, Node, Vehicle, Vehicle]]:
+        """
+        Returns the transfers (r, t, k1, k2): vehicle k1 leaves request r at transfer station t, where k2 picks it up
+        """
+        return [(r, legs[p][2], legs[p][0], legs[p + 1][0]) for r, legs in self.legs.items()
+                for p in range(len(legs) - 1)]
+
+
+class RoutePlan:
+    """
+    Routes of the vehicles while a solution is built or repaired, nodes and vehicles are referred to by their position.
+    The routes are never modified in place, so that copies can share them
+    """
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request]):
+        self.nodes = sorted(graph.nodes, key=lambda n: n.index)
+        self.vehicles = sorted(vehicles, key=lambda k: k.index)
+        self.pos = {n: i for i, n in enumerate(self.nodes)}
+
+        self.cost = np.full((len(self.nodes), len(self.nodes)), np.inf)
+        for arc in graph.arcs:
+            self.cost[self.pos[arc.src], self.pos[arc.dst]] = arc.cost
+        self.earliest = [n.earliest_time for n in self.nodes]
+        self.latest = [n.latest_time for n in self.nodes]
+        self.transfer_stations = [i for i, n in enumerate(self.nodes) if n.type is NodeType.TRANSFER_STATION]
+
+        self.capacity = [float(k.capacity) for k in self.vehicles]
+        self.unit_cost = [float(k.travel_unit_cost) for k in self.vehicles]
+        self.routes = [[self.pos[k.origin], self.pos[k.dest]] for k in self.vehicles]
+        # legs (k, i, j, load) of the requests inserted so far
+        self.legs: dict[Request, list[tuple[int, int, int, float]]] = {}
+
+    @classmethod
+    def from_solution(cls, graph: Graph, vehicles: set[Vehicle], requests: set[Request],
+                      solution: Solution) -> 'RoutePlan':
+        """
+        Returns the plan of a solution, e.g. of a model, to insert or remove requests
+        :param graph: a graph with the nodes visited by the solution
+        """
+        plan = cls(graph, vehicles, requests)
+        position = {k: p for p, k in enumerate(plan.vehicles)}
+        plan.routes = [[plan.pos[n] for n in solution.routes[k]] for k in plan.vehicles]
+        plan.legs = {r: [(position[k], plan.pos[u], plan.pos[v], float(r.load)) for k, u, v in legs]
+                     for r, legs in solution.legs.items()}
+        return plan
+
+    def copy(self) -> 'RoutePlan':
+        plan = copy(self)
+        plan.routes, plan.legs = list(self.routes), dict(self.legs)
+        return plan
+
+    def route_cost(self, k: int) -> float:
+        route = self.routes[k]
+        if len(route) == 2 and route[0] == route[1]:
+            return 0.0
+        return float(sum(self.cost[i, j] for i, j in zip(route, route[1:]))) * self.unit_cost[k]
+
+    def total_cost(self) -> float:
+        return sum(self.route_cost(k) for k in range(len(self.routes)))
+
+    def loads(self, k: int) -> np.ndarray:
+        """
+        Returns the load of vehicle k on each arc of its route
+        """
+        route = self.routes[k]
+        loads = np.zeros(len(route) - 1)
+        for legs in self.legs.values():
+            for vehicle, i, j, load in legs:
+                if vehicle == k:
+                    loads[route.index(i):route.index(j)] += load
+        return loads
+
+    def insertions(self, k: int, u: int, v: int, load: float, n: int) -> list[tuple[float, int, int]]:
+        """
+        Cheapest ways of inserting u and then v in the route of vehicle k so that it can carry load from u to v
+        :param n: maximum number of insertions returned
+        :return: tuples (cost increase, gap of u, gap of v) sorted by cost increase, where gap g means between the g-th
+        and the (g+1)-th node of the route and -1 that the node is already visited (only for transfer stations)
+        """
+        route = self.routes[k]
+        prev, nxt = np.array(route[:-1]), np.array(route[1:])
+        base = self.cost[prev, nxt]
+        base[~np.isfinite(base)] = 0  # an unused vehicle that goes back to its origin depot has route [o(k), o(k)]
+        loads = self.loads(k)
+        free = self.capacity[k] - load
+        gaps = len(prev)
+
+        # highest[i, j] is the highest load on the arcs i..j of the route
+        highest = np.full((gaps, gaps), np.inf)
+        for i in range(gaps):
+            highest[i, i:] = np.maximum.accumulate(loads[i:])
+
+        du = self.cost[prev, u] + self.cost[u, nxt] - base
+        dv = self.cost[prev, v] + self.cost[v, nxt] - base
+        mu = route.index(u) if u in route else -1
+        mv = route.index(v) if v in route else -1
+
+        if mu >= 0 and mv >= 0:
+            return [(0.0, -1, -1)] if mu < mv and highest[mu, mv - 1] <= free else []
+        if mu >= 0:
+            delta = np.where(highest[mu] <= free, dv, np.inf)
+            delta[:mu] = np.inf
+            gu, gv = np.full(gaps, -1), np.arange(gaps)
+        elif mv >= 0:
+            delta = np.where(highest[:, mv - 1] <= free, du, np.inf) if mv > 0 else np.full(gaps, np.inf)
+            delta[mv:] = np.inf
+            gu, gv = np.arange(gaps), np.full(gaps, -1)
+        else:
+            delta = du[:, None] + dv[None, :]
+            np.fill_diagonal(delta, self.cost[prev, u] + self.cost[u, v] + self.cost[v, nxt] - base)
+            delta[np.tril_indices(gaps, -1)] = np.inf
+            delta[highest > free] = np.inf
+            gu, gv = (g.ravel() for g in np.indices((gaps, gaps)))
+            delta = delta.ravel()
+
+        delta = delta * self.unit_cost[k]
+        best = np.argsort(delta, kind='stable')[:n]
+        best = best[np.isfinite(delta[best])]
+        return [(float(delta[i]), int(gu[i]), int(gv[i])) for i in best]
+
+    def insert(self, k: int, u: int, gu: int, v: int, gv: int) -> list[int]:
+        """
+        Returns the route of vehicle k after the insertion of u and v, see insertions
+        """
+        route = list(self.routes[k])
+        if gv >= 0:
+            route.insert(gv + 1, v)
+        if gu >= 0:
+            route.insert(gu + 1, u)
+        return route
+
+    def schedule(self, routes: list[list[int]],
+                 legs: dict[Request, list[tuple[int, int, int, float]]]) -> Optional[tuple[list, list]]:
+        """
+        Earliest arrival and departure times at each position of the routes, a vehicle leaving a transfer station only
+        after the requests it takes over there have arrived
+        :return: the lists of arrival and departure times of each vehicle, None if a time window cannot be met
+        """
+        waits = {}
+        for request_legs in legs.values():
+            for (k1, _, t, _), (k2, _, _, _) in zip(request_legs, request_legs[1:]):
+                waits.setdefault((k2, t), []).append(k1)
+
+        arrival = [None] * len(routes)
+        passes = len(waits) + 1
+        for _ in range(passes + 1):
+            previous = arrival
+            arrival, departure = [], []
+            for k, route in enumerate(routes):
+                start = self.earliest[route[0]]
+                arr, dep = [start], [start]
+                if len(route) > 2 or route[0] != route[-1]:
+                    for i, j in zip(route, route[1:]):
+                        a = max(self.earliest[j], dep[-1] + self.cost[i, j])
+                        b = a
+                        for k1 in waits.get((k, j), ()):
+                            b = max(b, previous[k1][routes[k1].index(j)] if previous[k1] else a)
+                        if b > self.latest[j]:
+                            return None
+                        arr.append(a)
+                        dep.append(b)
+                else:
+                    arr.append(start)
+                    dep.append(start)
+                arrival.append(arr)
+                departure.append(dep)
+            if arrival == previous:
+                return arrival, departure
+        return None  # vehicles waiting for each other at the transfer stations
+
+    def feasible_insertions(self, r: Request, transfers: bool, n: int = 1) -> list[tuple[float, list, list]]:
+        """
+        Cheapest insertions of request r meeting the time windows, each on a different set of vehicles
+        :param transfers: set to True to also split r between two vehicles at a transfer station
+        :param n: maximum number of insertions returned
+        :return: tuples (cost increase, routes, legs of r) sorted by cost increase
+        """
+        p, d, load = self.pos[r.pickup], self.pos[r.destination], float(r.load)
+        candidates = []
+        for k in range(len(self.vehicles)):
+            for delta, gu, gv in self.insertions(k, p, d, load, _MAX_CANDIDATES):
+                candidates.append((delta, 0, [(k, p, gu, d, gv)]))
+
+        if transfers:
+            per_leg = _MAX_TRANSFER_CANDIDATES
+            for t in self.transfer_stations:
+                first = [self.insertions(k, p, t, load, per_leg) for k in range(len(self.vehicles))]
+                second = [self.insertions(k, t, d, load, per_leg) for k in range(len(self.vehicles))]
+                for k1, k2 in ((k1, k2) for k1 in range(len(first)) for k2 in range(len(second)) if k1 != k2):
+                    for delta1, gp, gt1 in first[k1]:
+                        for delta2, gt2, gd in second[k2]:
+                            candidates.append((delta1 + delta2, 1, [(k1, p, gp, t, gt1), (k2, t, gt2, d, gd)]))
+
+        candidates.sort(key=lambda c: (c[0], c[1]))
+        insertions, used = [], set()
+        for delta, _, legs in candidates:
+            vehicles = tuple(leg[0] for leg in legs)
+            if vehicles in used:
+                continue
+            routes = list(self.routes)
+            for k, u, gu, v, gv in legs:
+                routes[k] = self.insert(k, u, gu, v, gv)
+            new_legs = dict(self.legs)
+            new_legs[r] = [(k, u, v, load) for k, u, _, v, _ in legs]
+            if self.schedule(routes, new_legs) is not None:
+                insertions.append((delta, routes, new_legs[r]))
+                used.add(vehicles)
+                if len(insertions) == n:
+                    break
+        return insertions
+
+    def insert_request(self, r: Request, transfers: bool) -> bool:
+        """
+        Insert request r where it increases the cost the least while meeting the time windows
+        :return: False if no such insertion exists
+        """
+        insertions = self.feasible_insertions(r, transfers)
+        if not insertions:
+            return False
+        _, self.routes, self.legs[r] = insertions[0]
+        return True
+
+    def remove_request(self, r: Request) -> None:
+        """
+        Remove request r from the routes, together with the transfer stations no other request is carried to or from
+        """
+        legs = self.legs.pop(r)
+        for k in {leg[0] for leg in legs}:
+            kept = {node for request_legs in self.legs.values() for vehicle, u, v, _ in request_legs if vehicle == k
+                    for node in (u, v)}
+            removed = {node for vehicle, u, v, _ in legs if vehicle == k for node in (u, v)} - kept
+            route = self.routes[k]
+            self.routes[k] = [route[0]] + [i for i in route[1:-1] if i not in removed] + [route[-1]]
+
+    def solution(self) -> Solution:
+        arrival, departure = self.schedule(self.routes, self.legs)
+        routes, arr, dep = {}, {}, {}
+        for k, vehicle in enumerate(self.vehicles):
+            route = self.routes[k]
+            routes[vehicle] = [self.nodes[i] for i in route]
+            # the departure from o(k) is kept when the route goes back to it
+            dep[vehicle] = {self.nodes[i]: b for i, b in reversed(list(zip(route, departure[k])))}
+            arr[vehicle] = {self.nodes[i]: a for i, a in zip(route, arrival[k])}
+        legs = {r: [(self.vehicles[k], self.nodes[u], self.nodes[v]) for k, u, v, _ in request_legs]
+                for r, request_legs in self.legs.items()}
+        loads = {vehicle: self.loads(k).tolist() for k, vehicle in enumerate(self.vehicles)}
+        return Solution(routes, legs, arr, dep, self.total_cost(), loads)
+
+
+def cheapest_insertion(graph: Graph, vehicles: set[Vehicle], requests: set[Request], *,
+                       transfers: bool = True, deadline: Optional[float] = None) -> Optional[Solution]:
+    """
+    Build a solution by inserting one request at a time where it increases the cost the least, meeting capacities and
+    time windows. Requests are inserted by increasing latest pickup time, latest delivery time and decreasing load;
+    when a request cannot be inserted, the construction starts over with that request first
+    :param transfers: set to False to carry each request on a single vehicle, otherwise a request may be picked up by
+    a vehicle and delivered by another one after a transfer station
+    :param deadline: time.perf_counter() past which the construction gives up, checked before each insertion
+    :return: the solution, None if some request cannot be inserted or the deadline passed
+    """
+    order = sorted(requests, key=lambda r: (r.pickup.latest_time, r.destination.latest_time, -float(r.load), r.index))
+    for _ in range(_MAX_RESTARTS + 1):
+        plan = RoutePlan(graph, vehicles, requests)
+        failed = None
+        for r in order:
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            if not plan.insert_request(r, transfers):
+                failed = r
+                break
+        if failed is None:
+            return plan.solution()
+        if order[0] == failed:
+            return None
+        order.remove(failed)
+        order.insert(0, failed)
+    return None
+
+
+def start_values(solution: Solution, graph: Graph) -> dict[str, dict[tuple, float]]:
+    """
+    Returns the values of the variables of Rais, Sampaio, Lyu and Aggregated models encoding the solution, see
+    AbstractModel.set_start. The nodes not visited by a vehicle get a_k_i = Ei and b_k_i = Li
+    """
+    n_nodes = len(graph.nodes)
+    x, y, s, z = {}, {}, {}, {}
+    position = {}
+    for k, route in solution.routes.items():
+        if len(route) > 2 or route[0] != route[-1]:
+            for i, j in zip(route, route[1:]):
+                x[i.index, j.index, k.index] = 1
+
+        # z_k_i_j orders the nodes of the route first, then the others by index
+        order = list(dict.fromkeys(route))
+        position[k] = {n: p for p, n in enumerate(order)}
+        order += sorted(graph.nodes - set(order), key=lambda n: n.index)
+        for p, i in enumerate(order):
+            for j in order[p + 1:]:
+                z[i.index, j.index, k.index] = 1
+
+    for r, legs in solution.legs.items():
+        for k, u, v in legs:
+            route = solution.routes[k]
+            start = route.index(u)
+            end = route.index(v, start)
+            for i, j in zip(route[start:end], route[start + 1:end + 1]):
+                y[i.index, j.index, k.index, r.index] = 1
+        if len(legs) == 2:
+            (k1, _, t), (k2, _, _) = legs
+            s[t.index, r.index, k1.index, k2.index] = 1
+
+    a = {(n.index, k.index): solution.arrival[k].get(n, n.earliest_time) for n in graph.nodes for k in solution.routes}
+    b = {(n.index, k.index): solution.departure[k].get(n, n.latest_time) for n in graph.nodes for k in solution.routes}
+    values = {'x': x, 'y': y, 's': s, 'a': a, 'b': b, 'z': z}
+    # the request flow of Aggregated, without the vehicle, and the vehicle leaving or reaching a node with the request
+    values['f'] = {(i, j, r): 1 for i, j, _, r in y}
+    values['v'] = {(i, r, k): 1 for i, _, k, r in y}
+    stations = {n.index for n in graph.nodes if n.type is NodeType.TRANSFER_STATION}
+    values['w'] = {(j, r, k): 1 for _, j, k, r in y if j in stations}
+
+    # e_k_i is the position of i in the route of k plus an offset, chosen so that (22) e_k1_t ≤ e_k2_t holds for each
+    # transfer from k1 to k2 at t
+    transfers = [(legs[0][0], legs[1][0], legs[0][2]) for legs in solution.legs.values() if len(legs) == 2]
+    offset = {k: 0 for k in solution.routes}
+    for _ in range(len(offset) + 1):
+        changed = False
+        for k1, k2, t in transfers:
+            needed = offset[k1] + position[k1][t] - position[k2][t]
+            if offset[k2] < needed:
+                offset[k2], changed = needed, True
+        if not changed:
+            e = {(n.index, k.index): offset[k] + position[k].get(n, 0) for n in graph.nodes for k in solution.routes}
+            transfer_stations = [t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION]
+            # (22) also bounds e_k1_t − e_k2_t by M = |N| when s_k1_k2_t_r = 0
+            if all(max(e[t.index, k.index] for k in offset) - min(e[t.index, k.index] for k in offset) <= n_nodes
+                   for t in transfer_stations):
+                values['e'] = e
+            break
+
+    return values
+
+
+def mip_start(graph: Graph, vehicles: set[Vehicle], requests: set[Request], *,
+              transfers: bool = True) -> Optional[dict[str, dict[tuple, float]]]:
+    """
+    Returns the start values of the solution built by cheapest_insertion, None if it fails
+    """
+    solution = cheapest_insertion(graph, vehicles, requests, transfers=transfers)
+    if solution is None:
+        return None
+    return start_values(solution, graph)
@@ -1,27 +1,85 @@
 import gurobipy as gb
+import numpy as np
 
 from itertools import product
+from typing import Iterator, Mapping, Optional
 
-from abstract_model import AbstractModel
-from graph import Graph, NodeType
+from abstract_model import AbstractModel, BUILDERS
+from build_profiler import BuildProfiler
+from graph import Arc, Graph, Node, NodeType, remove_nodes
+from heuristic import RoutePlan, Solution, start_values
+from matrix_builder import build_lyu
 from request import Request
+from solution_decoder import SolutionDecoder
+from symmetry import add_symmetry_breaking
+from time_windows import TimeWindows
+from variables import SparseTupledict, may_carry
 from vehicle import Vehicle
 
 
-class Lyu(AbstractModel):
+_ROUTED_TYPES = (NodeType.PICKUP, NodeType.DELIVERY, NodeType.TRANSFER_STATION)
+_DEPOT_TYPES = (NodeType.ORIGIN_DEPOT, NodeType.DESTINATION_DEPOT)
+# constraint families added without a name
+_UNNAMED = ('(48)', '(49)', '(50)a', '(50)b', '(51)')
 
-    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request]):
 
+class Lyu(AbstractModel):
+    # constraints by family and key, e.g. _rows['(4)', r], to update the model in place, see add_request. Only kept by
+    # the expr builder, not by the matrix one nor by a model read from the cache
+    _rows: Optional[dict[tuple, gb.Constr]] = None
+    # True if the model has no y variables, whose constraints are checked on each incumbent, see _check_flow
+    benders: bool = False
+    # feasibility cuts added by _check_flow, at the incumbents and at the nodes
+    flow_cuts: Optional[dict[str, int]] = None
+    # symmetry-breaking constraints, added again when the requests change
+    _symmetry: Optional[list[gb.Constr]] = None
+    # False if the big-M of (48) and (49) and the bounds of (50) come from the time windows of the nodes,
+    # see time_windows
+    tight_big_m: bool = True
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *, builder: str = 'expr',
+                 benders: bool = False, symmetry_breaking: bool = False, tight_big_m: bool = True,
+                 profile_build: bool = False):
+        """
+        :param builder: either 'expr' or 'matrix', see BUILDERS
+        :param benders: set to True to leave the y variables and constraints (4)-(9), (16) and (21) out of the model:
+        the request flow is solved as a subproblem at each incumbent, which is cut off if no flow fits its routes and
+        transfers, see _check_flow. Experimental: it saves memory but solves much slower than the compact model, e.g.
+        8-155 s instead of 0.1-0.3 s on the PDPT R5 instances
+        :param symmetry_breaking: set to True to order the interchangeable vehicles, see symmetry.add_symmetry_breaking
+        :param tight_big_m: set to False to take the big-M of (48) and (49) and the bounds of (50) from the time windows
+        of the nodes instead of those of the vehicles, see TimeWindows
+        :param profile_build: set to True to measure the build of each constraint family, see self.build_profile
+        """
         super().__init__()
-        model = gb.Model('Lyu', env=gb.Env(params={'OutputFlag': 0}))
+        self.graph, self.vehicles, self.requests = graph, vehicles, requests
+        if builder not in BUILDERS:
+            raise ValueError(f'builder must be one of {BUILDERS}')
+        self.tight_big_m = tight_big_m
+        self.time_windows = TimeWindows(graph, vehicles, tighten=tight_big_m)
+        if benders and builder != 'expr':
+            raise ValueError("benders needs builder='expr'")
+
+        model = self.new_model('Lyu')
         model.modelSense = gb.GRB.MINIMIZE
 
-        model.setParam('OutputFlag', 0)
         model.setParam('TimeLimit', 3600)
+        profiler = BuildProfiler(model, profile_build)
+
+        if builder == 'matrix':
+            self.variables = build_lyu(model, graph, vehicles, requests, windows=self.time_windows, profiler=profiler)
+            self.model = model
+            if symmetry_breaking:
+                self._symmetry = add_symmetry_breaking(model, self.variables['x'], graph, vehicles, requests)
+                profiler.record('(S)')
+            if profile_build:
+                self.build_profile = profiler.report()
+            return
 
+        self.model = model
+        self._rows = {}
         transfer_stations = {t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION}
-        depot_nodes = {n for n in graph.nodes
-                       if n.type is NodeType.ORIGIN_DEPOT or n.type is NodeType.DESTINATION_DEPOT}
+        depot_nodes = {n for n in graph.nodes if n.type in _DEPOT_TYPES}
 
         # x_k_i_j = 1 if vehicle k travels through arc (i,j)
         x = model.addVars(
@@ -32,13 +90,14 @@ class Lyu(AbstractModel):
         )
 
         # y_r_k_i_j = 1 if request r is transported by vehicle k through arc (i,j)
-        y = model.addVars(
+        # only created where r may travel, the missing y_r_k_i_j evaluate to 0. Not created in benders mode
+        y = None if benders else SparseTupledict(model.addVars(
             [(arc.src.index, arc.dst.index, k.index, r.index)
              for arc in graph.arcs
              for k in vehicles
-             for r in requests],
+             for r in requests if may_carry(arc, r)],
             lb=0, ub=1, vtype=gb.GRB.BINARY
-        )
+        ))
 
         # s_t_r_k1_k2
         s = model.addVars(
@@ -65,261 +124,733 @@ class Lyu(AbstractModel):
              for k in vehicles],
             lb=0, ub=float('inf'), vtype=gb.GRB.CONTINUOUS
         )
+        self.variables = {'x': x, 's': s, 'a': a, 'b': b} if benders else {'x': x, 'y': y, 's': s, 'a': a, 'b': b}
 
+        profiler.record('variables')
         model.setObjective(
             gb.quicksum(
                 arc.cost * x[arc.src.index, arc.dst.index, k.index] * k.travel_unit_cost
                 for arc in graph.arcs
                 for k in vehicles)
         )
+        profiler.record('objective')
 
-        # (4) ∑∈K ∑(i,j)∈A y_k_r_i_j = 1 ∀r ∈ R, i = p(r)
-        for r in requests:
-            model.addConstr(
-                gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for k in vehicles
-                    for arc in graph.arcs if arc.src == r.pickup
-                )
-                == 1,
-                '(4)'
-            )
-
-        # (5) ∑∈K ∑(j,i)∈A y_k_r_j_i = 1 ∀r ∈ R, i = d(r)
-        for r in requests:
-            model.addConstr(
-                gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for k in vehicles
-                    for arc in graph.arcs if arc.dst == r.destination
-                )
-                == 1,
-                '(5)'
-            )
-
-        # (6) ∑k∈K ∑(i,j)∈A y_k_r_i_j − ∑k∈K ∑(j,i)∈A y_k_r_j_i = 0 ∀r ∈ R, ∀i ∈ T
-        for r, i in product(requests, transfer_stations):
-            model.addConstr(
-                gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for k in vehicles
-                    for arc in graph.arcs if arc.src == i
-                )
-                - gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for k in vehicles
-                    for arc in graph.arcs if arc.dst == i
-                )
-                == 0,
-                '(6)'
-            )
-
-        # (8) y_k_r_i_j ≤ x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K, ∀r ∈ R
-        for arc, k, r in product(graph.arcs, vehicles, requests):
-            model.addConstr(
-                y[arc.src.index, arc.dst.index, k.index, r.index]
-                <= x[arc.src.index, arc.dst.index, k.index],
-                '(8)'
-            )
-
-        # (9) ∑r∈R q_r y_k_r_i_j ≤ u_k x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K
-        for arc, k in product(graph.arcs, vehicles):
-            model.addConstr(
-                gb.quicksum(
-                    r.load * y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for r in requests
-                )
-                <= k.capacity * x[arc.src.index, arc.dst.index, k.index],
-                '(9)'
-            )
-
-        # (16) ∑(i,j)∈A y_k_r_i_j − ∑(j,i)∈A y_k_r_j_i = 0 ∀k ∈ K, ∀r ∈ R, ∀i ∈ N\{T ∪ {p(r),d(r)}}
-        for k, r, i in product(vehicles, requests, graph.nodes - transfer_stations):
-            if i == r.pickup or i == r.destination:
-                continue
-            model.addConstr(
-                gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.src == i
-                )
-                - gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.dst == i
-                )
-                == 0,
-                '(16)'
-            )
-
-        # (21) ∑(j,t)∈A y_k1_r_j_t + ∑(t,j)∈A y_k2_r_t_j ≤ s_k1_k2_t_r + 1 ∀r ∈ R, ∀t ∈ T , ∀k1 , k2 ∈ K, k1 != k2
-        for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
-            if k1 == k2:
-                continue
-            model.addConstr(
-                gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k1.index, r.index]
-                    for arc in graph.arcs if arc.dst == t
-                )
-                + gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k2.index, r.index]
-                    for arc in graph.arcs if arc.src == t
-                )
-                <= s[t.index, r.index, k1.index, k2.index] + 1,
-                '(21)'
-            )
+        # the request flow, the subproblem of _check_flow in benders mode
+        if not benders:
+            for family, keys in self._flow_rows():
+                for key in keys:
+                    self._add_row(family, *key)
+                profiler.record(family)
 
-        # (25) ∑(i,j)∈A x_k_i_j = 1 ∀k ∈ K, i = o(k)
         for k in vehicles:
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == k.origin
-                )
-                == 1,
-                '(25)'
-            )
+            self._add_row('(25)', k)
+        profiler.record('(25)')
 
-        # (27) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, ∀i ∈ P ∪ D ∪ T
         for k, i in product(vehicles, graph.nodes):
-            if i.type not in [NodeType.PICKUP, NodeType.DELIVERY, NodeType.TRANSFER_STATION]:
-                continue
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == i
-                )
-                - gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.dst == i
-                )
-                == 0,
-                '(27)'
-            )
+            if i.type in _ROUTED_TYPES:
+                self._add_row('(27)', k, i)
+        profiler.record('(27)')
 
-        # (40) ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, i = o(k)
         for k in vehicles:
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.dst == k.origin
-                )
-                == 0,
-                '(40)'
-            )
+            self._add_row('(40)', k)
+        profiler.record('(40)')
 
-        # (41) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k)
         for k, i in product(vehicles, depot_nodes):
-            if i == k.origin:
-                continue
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == i
-                )
-                == 0,
-                '(41)'
-            )
+            if i != k.origin:
+                self._add_row('(41)', k, i)
+        profiler.record('(41)')
 
-        # (42) ∑(j,i)∈A x_k_j_i = 1 ∀k ∈ K, i = o'(k)
         for k in vehicles:
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.dst == k.dest
-                )
-                == 1,
-                '(42)'
-            )
+            self._add_row('(42)', k)
+        profiler.record('(42)')
 
-        # (43) ∑(i,j)∈A x_k_j_i = 0 ∀k ∈ K, i = o'(k)
         for k in vehicles:
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == k.dest
-                )
-                == 0,
-                '(43)'
-            )
+            self._add_row('(43)', k)
+        profiler.record('(43)')
 
-        # (44) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, ∀i ∈ T
         for k, i in product(vehicles, transfer_stations):
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == i
-                )
-                <= 1,
-                '(44)'
-            )
+            self._add_row('(44)', k, i)
+        profiler.record('(44)')
 
-        # (45) ∑(i,j)∈A ∑k∈K x_k_i_j = 1 ∀i ∈ P ∪ D
         for i in graph.nodes - transfer_stations - depot_nodes:
-            model.addConstr(
-                gb.quicksum(
-                    x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == i
-                    for k in vehicles
-                )
-                == 1,
-                '(45)'
-            )
+            self._add_row('(45)', i)
+        profiler.record('(45)')
 
         # (46) ∑(i,j)∈A ∑k∈K y_k_r_i_j = 0 ∀r ∈ R, j = p(r)
-        for r in requests:
-            model.addConstr(
-                gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.dst == r.pickup
-                    for k in vehicles
-                )
-                == 0,
-                '(46)'
-            )
-
         # (47) ∑(i,j)∈A y_k_r_i_j = 0 ∀r ∈ R, ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k), i != o′ (k)
-        for r, k, i in product(requests, vehicles, depot_nodes):
-            if i == k.origin or i == k.dest:
-                continue
-            model.addConstr(
-                gb.quicksum(
-                    y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.src == i
-                )
-                == 0,
-                '(47)'
-            )
+        # hold by construction: those y_k_r_i_j are not created, see may_carry
 
-        # (48) a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, t ∈ T, k1,k2 ∈ K, k1 != k2
         for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
-            if k1 == k2:
-                continue
-            M = t.latest_time - t.earliest_time
-            model.addConstr(
-                a[t.index, k1.index] - b[t.index, k2.index]
-                <= M * (1 - s[t.index, r.index, k1.index, k2.index])
-            )
+            if k1 != k2:
+                self._add_row('(48)', r, t, k1, k2)
+        profiler.record('(48)')
 
-        # (49) b_k_i + τ_k_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
         for arc, k in product(graph.arcs, vehicles):
-            M = max(0, arc.src.latest_time + arc.cost - arc.dst.earliest_time)
-            model.addConstr(
-                b[arc.src.index, k.index] + arc.cost - a[arc.dst.index, k.index]
-                <= M * (1 - x[arc.src.index, arc.dst.index, k.index])
-            )
+            self._add_row('(49)', arc, k)
+        profiler.record('(49)')
 
-        # (50) a_k_i ≥ Ei , bk_i ≤ Li ∀i ∈ N, ∀k ∈ K
         for i, k in product(graph.nodes, vehicles):
-            model.addConstr(
-                a[i.index, k.index] >= i.earliest_time
-            )
-            model.addConstr(
-                b[i.index, k.index] <= i.latest_time
-            )
+            self._add_row('(50)a', i, k)
+            self._add_row('(50)b', i, k)
+        profiler.record('(50)')
 
-        # (51) a_k_i ≤ b_k_i ∀i ∈ N, ∀k ∈ K
         for i, k in product(graph.nodes, vehicles):
-            model.addConstr(
-                a[i.index, k.index] <= b[i.index, k.index]
+            self._add_row('(51)', i, k)
+        profiler.record('(51)')
+
+        if symmetry_breaking:
+            self._symmetry = add_symmetry_breaking(model, x, graph, vehicles, requests)
+            profiler.record('(S)')
+        if profile_build:
+            self.build_profile = profiler.report()
+        if benders:
+            self._add_flow_check()
+
+    def on_load(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *, builder: str = 'expr',
+                benders: bool = False, symmetry_breaking: bool = False, tight_big_m: bool = True,
+                profile_build: bool = False) -> None:
+        self.tight_big_m = tight_big_m
+        self.time_windows = TimeWindows(graph, vehicles, tighten=tight_big_m)
+        if benders:
+            self._add_flow_check()
+
+    def _flow_rows(self) -> Iterator[tuple[str, Iterator[tuple]]]:
+        """
+        Returns the keys of the constraints of the request flow, (4)-(9), (16) and (21), family by family
+        """
+        graph, vehicles, requests = self.graph, self.vehicles, self.requests
+        transfer_stations = {t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION}
+
+        yield '(4)', ((r,) for r in requests)
+        yield '(5)', ((r,) for r in requests)
+        yield '(6)', product(requests, transfer_stations)
+        yield '(8)', ((arc, k, r) for arc, k, r in product(graph.arcs, vehicles, requests) if may_carry(arc, r))
+        yield '(9)', product(graph.arcs, vehicles)
+        yield '(16)', ((k, r, i) for k, r, i in product(vehicles, requests, graph.nodes - transfer_stations)
+                       if i != r.pickup and i != r.destination)
+        yield '(21)', ((r, t, k1, k2) for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles)
+                       if k1 != k2)
+
+    def _add_row(self, family: str, *key) -> None:
+        """
+        Add the constraint of a family for the given key, e.g. _add_row('(4)', r), see _row
+        """
+        name = family if family not in _UNNAMED else ''
+        self._rows[(family, *key)] = self.model.addConstr(self._row(family, *key), name)
+
+    def _row(self, family: str, *key, variables: Optional[dict[str, Mapping[tuple, gb.Var]]] = None) -> gb.TempConstr:
+        """
+        Returns the constraint of a family for the given key, over the current graph, vehicles and variables
+        :param variables: variables to use instead of self.variables, e.g. those of the request flow in benders mode
+        """
+        x, y, s, a, b = ((variables or self.variables).get(name) for name in ('x', 'y', 's', 'a', 'b'))
+        graph, vehicles = self.graph, self.vehicles
+
+        if family == '(4)':
+            # (4) ∑∈K ∑(i,j)∈A y_k_r_i_j = 1 ∀r ∈ R, i = p(r)
+            r, = key
+            return gb.quicksum(
+                y[arc.src.index, arc.dst.index, k.index, r.index]
+                for k in vehicles
+                for arc in graph.out_arcs(r.pickup)
+            ) == 1
+
+        if family == '(5)':
+            # (5) ∑∈K ∑(j,i)∈A y_k_r_j_i = 1 ∀r ∈ R, i = d(r)
+            r, = key
+            return gb.quicksum(
+                y[arc.src.index, arc.dst.index, k.index, r.index]
+                for k in vehicles
+                for arc in graph.in_arcs(r.destination)
+            ) == 1
+
+        if family == '(6)':
+            # (6) ∑k∈K ∑(i,j)∈A y_k_r_i_j − ∑k∈K ∑(j,i)∈A y_k_r_j_i = 0 ∀r ∈ R, ∀i ∈ T
+            r, i = key
+            return gb.quicksum(
+                y[arc.src.index, arc.dst.index, k.index, r.index]
+                for k in vehicles
+                for arc in graph.out_arcs(i)
+            ) - gb.quicksum(
+                y[arc.src.index, arc.dst.index, k.index, r.index]
+                for k in vehicles
+                for arc in graph.in_arcs(i)
+            ) == 0
+
+        if family == '(8)':
+            # (8) y_k_r_i_j ≤ x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K, ∀r ∈ R
+            arc, k, r = key
+            return y[arc.src.index, arc.dst.index, k.index, r.index] <= x[arc.src.index, arc.dst.index, k.index]
+
+        if family == '(9)':
+            # (9) ∑r∈R q_r y_k_r_i_j ≤ u_k x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K
+            arc, k = key
+            return gb.quicksum(
+                r.load * y[arc.src.index, arc.dst.index, k.index, r.index]
+                for r in self.requests
+            ) <= k.capacity * x[arc.src.index, arc.dst.index, k.index]
+
+        if family == '(16)':
+            # (16) ∑(i,j)∈A y_k_r_i_j − ∑(j,i)∈A y_k_r_j_i = 0
+            #      ∀k ∈ K, ∀r ∈ R, ∀i ∈ N\{T ∪ {p(r),d(r)}}
+            k, r, i = key
+            return gb.quicksum(
+                y[arc.src.index, arc.dst.index, k.index, r.index]
+                for arc in graph.out_arcs(i)
+            ) - gb.quicksum(
+                y[arc.src.index, arc.dst.index, k.index, r.index]
+                for arc in graph.in_arcs(i)
+            ) == 0
+
+        if family == '(21)':
+            # (21) ∑(j,t)∈A y_k1_r_j_t + ∑(t,j)∈A y_k2_r_t_j ≤ s_k1_k2_t_r + 1
+            #      ∀r ∈ R, ∀t ∈ T , ∀k1 , k2 ∈ K, k1 != k2
+            r, t, k1, k2 = key
+            return gb.quicksum(
+                y[arc.src.index, arc.dst.index, k1.index, r.index]
+                for arc in graph.in_arcs(t)
+            ) + gb.quicksum(
+                y[arc.src.index, arc.dst.index, k2.index, r.index]
+                for arc in graph.out_arcs(t)
+            ) <= s[t.index, r.index, k1.index, k2.index] + 1
+
+        if family == '(25)':
+            # (25) ∑(i,j)∈A x_k_i_j = 1 ∀k ∈ K, i = o(k)
+            k, = key
+            return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.out_arcs(k.origin)) == 1
+
+        if family == '(27)':
+            # (27) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, ∀i ∈ P ∪ D ∪ T
+            k, i = key
+            return gb.quicksum(
+                x[arc.src.index, arc.dst.index, k.index]
+                for arc in graph.out_arcs(i)
+            ) - gb.quicksum(
+                x[arc.src.index, arc.dst.index, k.index]
+                for arc in graph.in_arcs(i)
+            ) == 0
+
+        if family == '(40)':
+            # (40) ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, i = o(k)
+            k, = key
+            return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.in_arcs(k.origin)) == 0
+
+        if family == '(41)':
+            # (41) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k)
+            k, i = key
+            return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.out_arcs(i)) == 0
+
+        if family == '(42)':
+            # (42) ∑(j,i)∈A x_k_j_i = 1 ∀k ∈ K, i = o'(k)
+            k, = key
+            return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.in_arcs(k.dest)) == 1
+
+        if family == '(43)':
+            # (43) ∑(i,j)∈A x_k_j_i = 0 ∀k ∈ K, i = o'(k)
+            k, = key
+            return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.out_arcs(k.dest)) == 0
+
+        if family == '(44)':
+            # (44) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, ∀i ∈ T
+            k, i = key
+            return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.out_arcs(i)) <= 1
+
+        if family == '(45)':
+            # (45) ∑(i,j)∈A ∑k∈K x_k_i_j = 1 ∀i ∈ P ∪ D
+            i, = key
+            return gb.quicksum(
+                x[arc.src.index, arc.dst.index, k.index]
+                for arc in graph.out_arcs(i)
+                for k in vehicles
+            ) == 1
+
+        if family == '(48)':
+            # (48) a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, t ∈ T, k1,k2 ∈ K, k1 != k2
+            r, t, k1, k2 = key
+            M = self.time_windows.transfer_big_m(t, k1, k2)
+            return a[t.index, k1.index] - b[t.index, k2.index] <= M * (1 - s[t.index, r.index, k1.index, k2.index])
+
+        if family == '(49)':
+            # (49) b_k_i + τ_k_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
+            arc, k = key
+            M = self.time_windows.arc_big_m(arc, k)
+            return (b[arc.src.index, k.index] + arc.cost - a[arc.dst.index, k.index]
+                    <= M * (1 - x[arc.src.index, arc.dst.index, k.index]))
+
+        if family == '(50)a':
+            # (50) a_k_i ≥ Ei , bk_i ≤ Li ∀i ∈ N, ∀k ∈ K, with the time windows of the vehicles
+            i, k = key
+            return a[i.index, k.index] >= self.time_windows.earliest[i.index, k.index]
+
+        if family == '(50)b':
+            i, k = key
+            return b[i.index, k.index] <= self.time_windows.latest[i.index, k.index]
+
+        if family == '(51)':
+            # (51) a_k_i ≤ b_k_i ∀i ∈ N, ∀k ∈ K
+            i, k = key
+            return a[i.index, k.index] <= b[i.index, k.index]
+
+        raise ValueError(f'unknown constraint family {family}')
+
+    def _request_rows(self, request: Request, nodes: set[Node], arcs: set[Arc]) -> Iterator[tuple]:
+        """
+        Returns the keys of the constraints that involve a request, its nodes or their arcs, i.e. those added with the
+        request and removed with it, in the order they are built
+        :param request: the request, in self.requests
+        :param nodes: p(r) and d(r), in self.graph
+        :param arcs: the arcs of self.graph leaving or entering nodes
+        """
+        graph, vehicles, requests = self.graph, self.vehicles, self.requests
+        transfer_stations = [t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION]
+        others = requests - {request}
+
+        yield '(4)', request
+        yield '(5)', request
+        for t in transfer_stations:
+            yield '(6)', request, t
+        for arc, k in product(graph.arcs, vehicles):
+            if arc in arcs:
+                yield from (('(8)', arc, k, r) for r in requests if may_carry(arc, r))
+            elif may_carry(arc, request):
+                yield '(8)', arc, k, request
+        for arc, k in product(arcs, vehicles):
+            yield '(9)', arc, k
+        for k in vehicles:
+            for i in graph.nodes:
+                if i.type is not NodeType.TRANSFER_STATION and i not in (request.pickup, request.destination):
+                    yield '(16)', k, request, i
+            for r, i in product(others, nodes):
+                yield '(16)', k, r, i
+        for t, k1, k2 in product(transfer_stations, vehicles, vehicles):
+            if k1 != k2:
+                yield '(21)', request, t, k1, k2
+        for k, i in product(vehicles, nodes):
+            yield '(27)', k, i
+        for i in nodes:
+            yield '(45)', i
+        for t, k1, k2 in product(transfer_stations, vehicles, vehicles):
+            if k1 != k2:
+                yield '(48)', request, t, k1, k2
+        for arc, k in product(arcs, vehicles):
+            yield '(49)', arc, k
+        for i, k in product(nodes, vehicles):
+            yield '(50)a', i, k
+            yield '(50)b', i, k
+            yield '(51)', i, k
+
+    def _x_column(self, arc: Arc, k: Vehicle) -> gb.Column:
+        """
+        Returns the coefficients of x_k_i_j in the constraints of the model that do not involve the arc
+        """
+        i, j = arc.src, arc.dst
+        rows = [
+            ('(25)', k) if i == k.origin else None,
+            ('(27)', k, i), ('(27)', k, j),
+            ('(40)', k) if j == k.origin else None,
+            ('(41)', k, i),
+            ('(42)', k) if j == k.dest else None,
+            ('(43)', k) if i == k.dest else None,
+            ('(44)', k, i),
+            ('(45)', i),
+        ]
+        coefficients = [1, 1, -1, 1, 1, 1, 1, 1, 1]
+        return self._column(rows, coefficients)
+
+    def _y_column(self, arc: Arc, k: Vehicle, r: Request) -> gb.Column:
+        """
+        Returns the coefficients of y_k_r_i_j in the constraints of the model that involve neither the arc nor r
+        """
+        i, j = arc.src, arc.dst
+        rows = [
+            ('(4)', r) if i == r.pickup else None,
+            ('(5)', r) if j == r.destination else None,
+            ('(6)', r, i), ('(6)', r, j),
+            ('(9)', arc, k),
+            ('(16)', k, r, i), ('(16)', k, r, j),
+        ]
+        coefficients = [1, 1, 1, -1, r.load, 1, -1]
+        for other in self.vehicles - {k}:
+            rows += [('(21)', r, j, k, other), ('(21)', r, i, other, k)]
+            coefficients += [1, 1]
+        return self._column(rows, coefficients)
+
+    def _column(self, rows: list[Optional[tuple]], coefficients: list[float]) -> gb.Column:
+        found = [(c, self._rows[row]) for row, c in zip(rows, coefficients) if row is not None and row in self._rows]
+        return gb.Column([c for c, _ in found], [constr for _, constr in found])
+
+    def add_request(self, request: Request, graph: Graph) -> None:
+        """
+        Add a request to the model instead of building it again: only the variables and constraints involving the
+        request, its nodes and their arcs are added, and the new variables are added to the constraints already in the
+        model. The current solution, if any, with the request inserted where it costs the least becomes the MIP start
+        :param request: the new request, whose index is not used by the other requests
+        :param graph: the graph of the model plus the nodes of the request and their arcs
+        :return: nothing
+        """
+        if self._rows is None:
+            raise ValueError("add_request needs a model built with builder='expr'")
+        if self.benders:
+            raise ValueError('add_request needs a model built without benders')
+        if any(r.index == request.index for r in self.requests):
+            raise ValueError(f'request index {request.index} is already used')
+        previous = self.get_solution() if self.model.SolCount > 0 else None
+
+        nodes = graph.nodes - self.graph.nodes
+        arcs = graph.arcs - self.graph.arcs
+        self.graph, self.requests = graph, self.requests | {request}
+        self._decoder = None
+        x, y, s, a, b = (self.variables[name] for name in ('x', 'y', 's', 'a', 'b'))
+        model, vehicles = self.model, self.vehicles
+
+        for arc, k in product(sorted(arcs, key=_arc_order), vehicles):
+            x[arc.src.index, arc.dst.index, k.index] = model.addVar(
+                lb=0, ub=1, obj=arc.cost * k.travel_unit_cost, vtype=gb.GRB.BINARY, column=self._x_column(arc, k)
             )
+        for arc, k, r in product(sorted(graph.arcs, key=_arc_order), vehicles, self.requests):
+            if (arc in arcs or r == request) and may_carry(arc, r):
+                y[arc.src.index, arc.dst.index, k.index, r.index] = model.addVar(
+                    lb=0, ub=1, vtype=gb.GRB.BINARY, column=self._y_column(arc, k, r)
+                )
+        for t, k1, k2 in product(graph.nodes, vehicles, vehicles):
+            if t.type is NodeType.TRANSFER_STATION and k1 != k2:
+                s[t.index, request.index, k1.index, k2.index] = model.addVar(lb=0, ub=1, vtype=gb.GRB.BINARY)
+        for n, k in product(nodes, vehicles):
+            a[n.index, k.index] = model.addVar(lb=0, ub=float('inf'), vtype=gb.GRB.CONTINUOUS)
+            b[n.index, k.index] = model.addVar(lb=0, ub=float('inf'), vtype=gb.GRB.CONTINUOUS)
+
+        previous_windows = self._update_windows()
+        for family, *key in self._request_rows(request, nodes, arcs):
+            self._add_row(family, *key)
+        self._replace_time_rows(previous_windows)
+        self._break_symmetry()
+
+        if previous is not None:
+            plan = RoutePlan.from_solution(graph, vehicles, self.requests, previous)
+            if plan.insert_request(request, transfers=True):
+                self.set_start(start_values(plan.solution(), graph))
+
+    def remove_request(self, request: Request) -> None:
+        """
+        Remove a request from the model, together with its nodes and their arcs, instead of building it again. The
+        current solution, if any, without the request becomes the MIP start
+        :param request: the request to remove
+        :return: nothing
+        """
+        if self._rows is None:
+            raise ValueError("remove_request needs a model built with builder='expr'")
+        if self.benders:
+            raise ValueError('remove_request needs a model built without benders')
+        plan = None
+        if self.model.SolCount > 0:
+            plan = RoutePlan.from_solution(self.graph, self.vehicles, self.requests, self.get_solution())
+
+        nodes = {request.pickup, request.destination}
+        arcs = {arc for n in nodes for arc in self.graph.out_arcs(n) + self.graph.in_arcs(n)}
+        self.model.remove([self._rows.pop(key) for key in self._request_rows(request, nodes, arcs)])
+
+        x, y, s, a, b = (self.variables[name] for name in ('x', 'y', 's', 'a', 'b'))
+        removed = []
+        for arc, k in product(self.graph.arcs, self.vehicles):
+            if arc in arcs:
+                removed.append(x.pop((arc.src.index, arc.dst.index, k.index)))
+            for r in self.requests if arc in arcs else [request]:
+                removed.append(y.pop((arc.src.index, arc.dst.index, k.index, r.index), None))
+        for t, k1, k2 in product(self.graph.nodes, self.vehicles, self.vehicles):
+            removed.append(s.pop((t.index, request.index, k1.index, k2.index), None))
+        for n, k in product(nodes, self.vehicles):
+            removed += [a.pop((n.index, k.index)), b.pop((n.index, k.index))]
+        self.model.remove([var for var in removed if var is not None])
+
+        graph = remove_nodes(self.graph, nodes)
+        self.graph, self.requests = graph, self.requests - {request}
+        self._decoder = None
+        self._replace_time_rows(self._update_windows())
+        self._break_symmetry()
+
+        if plan is not None:
+            plan.remove_request(request)
+            self.set_start(start_values(plan.solution(), graph))
+
+    def _update_windows(self) -> TimeWindows:
+        """
+        Compute the time windows of the vehicles over the current graph, see TimeWindows
+        :return: the previous time windows
+        """
+        previous = self.time_windows
+        self.time_windows = TimeWindows(self.graph, self.vehicles, tighten=self.tight_big_m)
+        return previous
+
+    def _replace_time_rows(self, previous: TimeWindows) -> None:
+        """
+        Replace the constraints (48), (49) and (50) that involve a time window that changed since the previous ones,
+        the new paths of an added request possibly widening them, the removed ones possibly narrowing them
+        """
+        windows = self.time_windows
+        changed = {key for key in windows.earliest
+                   if (windows.earliest[key], windows.latest[key])
+                   != (previous.earliest.get(key), previous.latest.get(key))}
+
+        def involved(family: str, key: tuple) -> set[tuple[int, int]]:
+            if family == '(48)':
+                _, t, k1, k2 = key
+                return {(t.index, k1.index), (t.index, k2.index)}
+            if family == '(49)':
+                arc, k = key
+                return {(arc.src.index, k.index), (arc.dst.index, k.index)}
+            i, k = key
+            return {(i.index, k.index)}
+
+        rows = [(family, *key) for family, *key in self._rows
+                if family in ('(48)', '(49)', '(50)a', '(50)b') and involved(family, tuple(key)) & changed]
+        self.model.remove([self._rows[row] for row in rows])
+        for family, *key in rows:
+            self._add_row(family, *key)
+
+    def _break_symmetry(self) -> None:
+        """
+        Replace the symmetry-breaking constraints, if any, with those of the current requests
+        """
+        if self._symmetry is not None:
+            self.model.remove(self._symmetry)
+            self._symmetry = add_symmetry_breaking(self.model, self.variables['x'], self.graph, self.vehicles,
+                                                   self.requests)
+
+    def get_solution(self, callback: bool = False) -> Solution:
+        """
+        See AbstractModel.get_solution. In benders mode the legs and loads come from the request flow of the routes
+        and transfers of the solution, see _request_flow
+        """
+        if not self.benders:
+            return super().get_solution(callback)
+        if self._decoder is None:
+            self._decoder = SolutionDecoder(self.variables, self.graph, self.vehicles, self.requests)
+        flow = self._request_flow(*self._routes_and_transfers(self.model, callback))
+        return self._decoder.decode(self.model, callback, flow=flow or [])
+
+    def _add_flow_check(self) -> None:
+        """
+        Enable the check of the request flow of each incumbent, see _check_flow. Nothing of the flow is kept between
+        the checks: its subproblem and linear relaxation are built over the arcs travelled by each incumbent or node
+        """
+        self.benders = True
+        self.flow_cuts = {'MIPSOL': 0, 'MIPNODE': 0}
+        self._arcs = {(arc.src.index, arc.dst.index): arc for arc in self.graph.arcs}
+        self._master = list(self.variables['x'].values()) + list(self.variables['s'].values())
+
+        self.model.setParam('LazyConstraints', 1)
+        self.callbacks.append(self._check_flow)
+
+    def _check_flow(self, model: gb.Model, where: int) -> None:
+        """
+        Cut off the incumbent if the requests cannot travel along its routes with its transfers, i.e. if the request
+        flow subproblem, constraints (4)-(9), (16) and (21) with x and s fixed, is infeasible. The cut is the Farkas
+        certificate of the linear relaxation of the subproblem if the relaxation is infeasible too, otherwise the
+        no-good ∑x̄_k_i_j=1 (1 − x_k_i_j) + ∑x̄_k_i_j=0 x_k_i_j + ∑s̄_k1_k2_t_r=0 s_k1_k2_t_r ≥ 1,
+        the latter over the stations t visited by both k1 and k2. The relaxation of each node is cut off by its Farkas
+        certificate as well, without which the master is too weak. y has no cost, so there are no optimality cuts
+        """
+        if where == gb.GRB.Callback.MIPNODE and model.cbGet(gb.GRB.Callback.MIPNODE_STATUS) == gb.GRB.OPTIMAL:
+            cut = self._farkas_cut(np.array(model.cbGetNodeRel(self._master)))
+            if cut is not None:
+                model.cbLazy(cut)
+                self.flow_cuts['MIPNODE'] += 1
+            return
+        if where != gb.GRB.Callback.MIPSOL:
+            return
+        arcs, transfers = self._routes_and_transfers(model, callback=True)
+        if self._request_flow(arcs, transfers) is not None:
+            return
+
+        cut = self._farkas_cut(np.round(model.cbGetSolution(self._master)))
+        if cut is None:
+            # with the same routes, only the transfers at the stations visited by both vehicles matter
+            used, stops = set(arcs), {(i, k) for i, _, k in arcs}
+            x, s = self.variables['x'], self.variables['s']
+            cut = gb.quicksum(1 - var if key in used else var for key, var in x.items()) + gb.quicksum(
+                var for (t, r, k1, k2), var in s.items()
+                if (t, k1) in stops and (t, k2) in stops and (t, r, k1, k2) not in transfers
+            ) >= 1
+        model.cbLazy(cut)
+        self.flow_cuts['MIPSOL'] += 1
+
+    def _farkas_cut(self, values: np.ndarray) -> Optional[gb.TempConstr]:
+        """
+        Returns the feasibility cut of the linear relaxation of the request flow, None if the relaxation is feasible.
+        The relaxation only has the y of the arcs with x_k_i_j > 0, the others being 0 by (8): in the cut, each missing
+        y_k_r_i_j with a positive coefficient is bounded by x_k_i_j rather than by 1, see _lifting
+        :param values: the values of x and s, in the order of self._master
+        """
+        x_master, s_master = self.variables['x'], self.variables['s']
+        x_values = dict(zip(x_master.keys(), values[:len(x_master)].tolist()))
+        s_values = dict(zip(s_master.keys(), values[len(x_master):].tolist()))
+        used = [(arc, k) for arc, k in product(self.graph.arcs, self.vehicles)
+                if x_values[arc.src.index, arc.dst.index, k.index] > 1e-6]
+        touched = {(n.index, k.index) for arc, k in used for n in (arc.src, arc.dst)}
+        graph, vehicles, requests = self.graph, self.vehicles, self.requests
+        transfer_stations = {t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION}
 
-        self.model = model
+        relaxation = self.new_model('LyuFlowRelaxation')
+        relaxation.setParam('InfUnbdInfo', 1)
+        # the flow rows without any y of the arcs used are left out, as if their multiplier in the cut were 0
+        keys = {
+            '(4)': [(r,) for r in requests],
+            '(5)': [(r,) for r in requests],
+            '(6)': list(product(requests, transfer_stations)),
+            '(8)': [(arc, k, r) for arc, k in used for r in requests if may_carry(arc, r)],
+            '(9)': used,
+            '(16)': [(k, r, i) for k, r, i in product(vehicles, requests, graph.nodes - transfer_stations)
+                     if i != r.pickup and i != r.destination and (i.index, k.index) in touched],
+            '(21)': [(r, t, k1, k2) for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles)
+                     if k1 != k2 and ((t.index, k1.index) in touched or (t.index, k2.index) in touched)],
+        }
+        # the columns of x and s come first, fixed to their values
+        x_keys = [(arc.src.index, arc.dst.index, k.index) for arc, k in used]
+        s_keys = [(t.index, r.index, k1.index, k2.index) for r, t, k1, k2 in keys['(21)']]
+        z_values = np.array([x_values[key] for key in x_keys] + [s_values[key] for key in s_keys])
+        variables = {
+            'x': relaxation.addVars(x_keys, lb=z_values[:len(x_keys)].tolist(), ub=z_values[:len(x_keys)].tolist()),
+            's': relaxation.addVars(s_keys, lb=z_values[len(x_keys):].tolist(), ub=z_values[len(x_keys):].tolist()),
+            'y': SparseTupledict(relaxation.addVars(
+                [(arc.src.index, arc.dst.index, k.index, r.index) for arc, k, r in keys['(8)']], lb=0, ub=1
+            )),
+        }
+        rows = {(family, *key): relaxation.addConstr(self._row(family, *key, variables=variables))
+                for family, family_keys in keys.items() for key in family_keys}
+        relaxation.optimize()
+        if relaxation.Status != gb.GRB.INFEASIBLE:
+            relaxation.dispose()
+            return None
+
+        constraints = list(rows.values())
+        farkas = np.array(relaxation.getAttr('FarkasDual', constraints))
+        coefficients = relaxation.getA().T @ farkas
+        rhs = float(farkas @ np.array(relaxation.getAttr('RHS', constraints)))
+        relaxation.dispose()
+        n = len(z_values)
+        # the certificate is either coefficients z ≥ rhs or coefficients z ≤ rhs, violated within the bounds of z
+        if coefficients[:n] @ z_values + np.maximum(coefficients[n:], 0).sum() >= rhs:
+            coefficients, rhs, farkas = -coefficients, -rhs, -farkas
+        # at best, every y with a positive coefficient is 1, or x_k_i_j for the missing ones
+        rhs -= float(np.maximum(coefficients[n:], 0).sum())
+        multipliers = {row: value for row, value in zip(rows, farkas.tolist()) if abs(value) > 1e-9}
+        lifted = self._lifting(multipliers, set(x_keys))
+        master = [x_master[key] for key in x_keys] + [s_master[key] for key in s_keys]
+        return gb.quicksum(
+            c * var for c, var in zip(coefficients[:n].tolist(), master) if abs(c) > 1e-9
+        ) + gb.quicksum(c * x_master[key] for key, c in lifted.items()) >= rhs
+
+    def _lifting(self, multipliers: dict[tuple, float], used: set[tuple]) -> dict[tuple, float]:
+        """
+        Returns the coefficient of x_k_i_j in a feasibility cut for each arc missing from the relaxation: the sum of the
+        positive coefficients in the cut of its y_k_r_i_j, as y_k_r_i_j ≤ x_k_i_j by (8)
+        :param multipliers: the multiplier of each row of the relaxation in the cut, by family and key
+        :param used: the keys (i, j, k) of the arcs in the relaxation
+        """
+        # coefficient of y_k_r_i_j in the cut, as that of leaving i plus that of entering j, from (4)-(6), (16), (21)
+        leaving, entering = {}, {}
+        for (family, *key), value in multipliers.items():
+            if family == '(4)':
+                r, = key
+                terms = [(leaving, r.pickup, k, r, value) for k in self.vehicles]
+            elif family == '(5)':
+                r, = key
+                terms = [(entering, r.destination, k, r, value) for k in self.vehicles]
+            elif family == '(6)':
+                r, i = key
+                terms = [(side, i, k, r, sign * value)
+                         for k in self.vehicles for side, sign in ((leaving, 1), (entering, -1))]
+            elif family == '(16)':
+                k, r, i = key
+                terms = [(leaving, i, k, r, value), (entering, i, k, r, -value)]
+            elif family == '(21)':
+                r, t, k1, k2 = key
+                terms = [(entering, t, k1, r, value), (leaving, t, k2, r, value)]
+            else:
+                continue
+            for side, i, k, r, coefficient in terms:
+                side[i, k, r] = side.get((i, k, r), 0.0) + coefficient
+
+        candidates = {(arc, k, r) for i, k, r in leaving for arc in self.graph.out_arcs(i)}
+        candidates |= {(arc, k, r) for i, k, r in entering for arc in self.graph.in_arcs(i)}
+        lifted = {}
+        for arc, k, r in candidates:
+            key = (arc.src.index, arc.dst.index, k.index)
+            if key in used or not may_carry(arc, r):
+                continue
+            c = leaving.get((arc.src, k, r), 0.0) + entering.get((arc.dst, k, r), 0.0)
+            if c > 1e-9:
+                lifted[key] = lifted.get(key, 0.0) + c
+        return lifted
+
+    def _routes_and_transfers(self, model: gb.Model, callback: bool) -> tuple[list[tuple], set[tuple]]:
+        """
+        Returns the keys of the x and of the s variables equal to 1 in the current solution
+        :param callback: set to True in a MIPSOL callback to read the new incumbent instead
+        """
+        x, s = self.variables['x'], self.variables['s']
+        read = model.cbGetSolution if callback else (lambda variables: model.getAttr('X', variables))
+        x_values, s_values = read(list(x.values())), read(list(s.values()))
+        return ([key for key, value in zip(x.keys(), x_values) if value > 0.5],
+                {key for key, value in zip(s.keys(), s_values) if value > 0.5})
+
+    def _request_flow(self, arcs: list[tuple], transfers: set[tuple]) -> Optional[list[tuple]]:
+        """
+        Solve the request flow subproblem of benders mode, constraints (4)-(9), (16) and (21) with x and s fixed, over
+        the arcs travelled only
+        :param arcs: the keys (i, j, k) of the arcs travelled by the vehicles, x_k_i_j = 1
+        :param transfers: the keys (t, r, k1, k2) of the transfers allowed, s_k1_k2_t_r = 1
+        :return: the keys (i, j, k, r) of the y variables equal to 1, None if the requests cannot travel
+        """
+        vehicles = {k.index: k for k in self.vehicles}
+        requests = sorted(self.requests, key=lambda r: r.index)
+        stations = [t.index for t in self.graph.nodes if t.type is NodeType.TRANSFER_STATION]
+        stops = {(i, k) for i, _, k in arcs}
+        flow = self.new_model('LyuFlow')
+
+        # (8) y_k_r_i_j ≤ x_k_i_j holds by construction: y only exists on the arcs travelled
+        y = flow.addVars(
+            [(i, j, k, r.index)
+             for i, j, k in arcs
+             for r in requests if may_carry(self._arcs[i, j], r)],
+            lb=0, ub=1, vtype=gb.GRB.BINARY
+        )
+
+        for r in requests:
+            # (4) ∑∈K ∑(i,j)∈A y_k_r_i_j = 1 ∀r ∈ R, i = p(r)
+            flow.addConstr(y.sum(r.pickup.index, '*', '*', r.index) == 1)
+            # (5) ∑∈K ∑(j,i)∈A y_k_r_j_i = 1 ∀r ∈ R, i = d(r)
+            flow.addConstr(y.sum('*', r.destination.index, '*', r.index) == 1)
+            # (6) ∑k∈K ∑(i,j)∈A y_k_r_i_j − ∑k∈K ∑(j,i)∈A y_k_r_j_i = 0 ∀r ∈ R, ∀i ∈ T
+            for t in stations:
+                flow.addConstr(y.sum(t, '*', '*', r.index) - y.sum('*', t, '*', r.index) == 0)
+
+        # (9) ∑r∈R q_r y_k_r_i_j ≤ u_k x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K
+        for i, j, k in arcs:
+            flow.addConstr(
+                gb.quicksum(r.load * y[i, j, k, r.index] for r in requests if (i, j, k, r.index) in y)
+                <= vehicles[k].capacity
+            )
+
+        # (16) ∑(i,j)∈A y_k_r_i_j − ∑(j,i)∈A y_k_r_j_i = 0
+        #      ∀k ∈ K, ∀r ∈ R, ∀i ∈ N\{T ∪ {p(r),d(r)}}
+        for (i, k), r in product(sorted(stops), requests):
+            if i not in stations and i != r.pickup.index and i != r.destination.index:
+                flow.addConstr(y.sum(i, '*', k, r.index) - y.sum('*', i, k, r.index) == 0)
+
+        # (21) ∑(j,t)∈A y_k1_r_j_t + ∑(t,j)∈A y_k2_r_t_j ≤ s_k1_k2_t_r + 1
+        #      ∀r ∈ R, ∀t ∈ T , ∀k1 , k2 ∈ K, k1 != k2
+        for t, r, k1, k2 in product(stations, requests, vehicles, vehicles):
+            if k1 != k2 and (t, k1) in stops and (t, k2) in stops and (t, r.index, k1, k2) not in transfers:
+                flow.addConstr(y.sum('*', t, k1, r.index) + y.sum(t, '*', k2, r.index) <= 1)
+
+        flow.optimize()
+        carried = None
+        if flow.Status == gb.GRB.OPTIMAL:
+            carried = [key for key, var in y.items() if var.X > 0.5]
+        flow.dispose()
+        return carried
+
+
+def _arc_order(arc: Arc) -> tuple[int, int]:
+    return arc.src.index, arc.dst.index
@@ -0,0 +1,654 @@
+import gurobipy as gb
+import numpy as np
+import scipy.sparse as sp
+
+from typing import Optional
+
+from build_profiler import BuildProfiler
+from graph import Graph, NodeType
+from request import Request
+from time_windows import TimeWindows
+from vehicle import Vehicle
+
+
+def _grid(*sizes: int) -> list[np.ndarray]:
+    """
+    Returns the flattened indices of the cartesian product range(sizes[0]) x range(sizes[1]) x ...
+    """
+    return [g.ravel() for g in np.indices(sizes)]
+
+
+def _keyed(variables: gb.MVar, *keys: np.ndarray) -> dict[tuple, gb.Var]:
+    """
+    Returns the variables keyed by the tuples (keys[0][p], keys[1][p], ...), p being the position in variables
+    """
+    return dict(zip(zip(*(key.tolist() for key in keys)), variables.tolist()))
+
+
+class _Network:
+    """
+    Integer-indexed view of the instance: nodes, arcs, vehicles and requests are numbered from 0 and their attributes
+    are stored in NumPy arrays
+    """
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request],
+                 windows: Optional[TimeWindows] = None):
+        nodes = sorted(graph.nodes, key=lambda n: n.index)
+        arcs = sorted(graph.arcs, key=lambda arc: (arc.src.index, arc.dst.index))
+        vehicles = sorted(vehicles, key=lambda k: k.index)
+        requests = sorted(requests, key=lambda r: r.index)
+        pos = {n: i for i, n in enumerate(nodes)}
+
+        self.N, self.A, self.K, self.R = len(nodes), len(arcs), len(vehicles), len(requests)
+
+        types = [n.type for n in nodes]
+        self.transfer = np.array([i for i, t in enumerate(types) if t is NodeType.TRANSFER_STATION], dtype=int)
+        self.depots = np.array([i for i, t in enumerate(types)
+                                if t is NodeType.ORIGIN_DEPOT or t is NodeType.DESTINATION_DEPOT], dtype=int)
+        self.pickup_delivery = np.array([i for i, t in enumerate(types)
+                                         if t is NodeType.PICKUP or t is NodeType.DELIVERY], dtype=int)
+        self.T = len(self.transfer)
+        self.is_transfer = np.isin(np.arange(self.N), self.transfer)
+        self.is_depot = np.isin(np.arange(self.N), self.depots)
+        self.earliest = np.array([n.earliest_time for n in nodes], dtype=float)
+        self.latest = np.array([n.latest_time for n in nodes], dtype=float)
+
+        self.src = np.array([pos[arc.src] for arc in arcs], dtype=int)
+        self.dst = np.array([pos[arc.dst] for arc in arcs], dtype=int)
+        self.cost = np.array([arc.cost for arc in arcs], dtype=float)
+
+        self.origin = np.array([pos[k.origin] for k in vehicles], dtype=int)
+        self.dest = np.array([pos[k.dest] for k in vehicles], dtype=int)
+        self.capacity = np.array([float(k.capacity) for k in vehicles], dtype=float)
+        self.unit_cost = np.array([float(k.travel_unit_cost) for k in vehicles], dtype=float)
+
+        self.pickup = np.array([pos[r.pickup] for r in requests], dtype=int)
+        self.delivery = np.array([pos[r.destination] for r in requests], dtype=int)
+        self.load = np.array([float(r.load) for r in requests], dtype=float)
+
+        # earliest_k[i, k] ≤ a_k_i ≤ b_k_i ≤ latest_k[i, k], the time windows of the nodes if no windows are given
+        if windows is None:
+            self.earliest_k = np.repeat(self.earliest[:, None], self.K, axis=1)
+            self.latest_k = np.repeat(self.latest[:, None], self.K, axis=1)
+        else:
+            self.earliest_k = np.array([[windows.earliest[n.index, k.index] for k in vehicles] for n in nodes],
+                                       dtype=float).reshape(self.N, self.K)
+            self.latest_k = np.array([[windows.latest[n.index, k.index] for k in vehicles] for n in nodes],
+                                     dtype=float).reshape(self.N, self.K)
+
+        # Node.index, Vehicle.index and Request.index of each position
+        self.node_index = np.array([n.index for n in nodes], dtype=int)
+        self.vehicle_index = np.array([k.index for k in vehicles], dtype=int)
+        self.request_index = np.array([r.index for r in requests], dtype=int)
+
+        # carries[a, r] is False where y_k_r_i_j = 0 ∀k ∈ K, see variables.may_carry
+        touches_depot = self.is_depot[self.src] | self.is_depot[self.dst]
+        self.carries = ~touches_depot[:, None] \
+            & (self.dst[:, None] != self.pickup[None, :]) & (self.src[:, None] != self.delivery[None, :])
+
+        self._out_order = np.argsort(self.src, kind='stable')
+        self._out_ptr = np.searchsorted(self.src[self._out_order], np.arange(self.N + 1))
+        self._in_order = np.argsort(self.dst, kind='stable')
+        self._in_ptr = np.searchsorted(self.dst[self._in_order], np.arange(self.N + 1))
+
+    def out_arcs(self, nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        For each position p of nodes, lists the arcs leaving nodes[p]
+        :return: a tuple (positions, arcs) of equal length
+        """
+        return self._incident(nodes, self._out_order, self._out_ptr)
+
+    def in_arcs(self, nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        For each position p of nodes, lists the arcs entering nodes[p]
+        :return: a tuple (positions, arcs) of equal length
+        """
+        return self._incident(nodes, self._in_order, self._in_ptr)
+
+    @staticmethod
+    def _incident(nodes: np.ndarray, order: np.ndarray, ptr: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        nodes = np.asarray(nodes, dtype=int)
+        starts = ptr[nodes]
+        counts = ptr[nodes + 1] - starts
+        positions = np.repeat(np.arange(len(nodes)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return positions, order[starts[positions] + offsets]
+
+
+class _MatrixModel:
+    """
+    Collects the variables of a model as a single MVar and adds each constraint family with one addMConstr call
+    """
+
+    def __init__(self, model: gb.Model, profiler: Optional[BuildProfiler] = None):
+        """
+        :param profiler: if given, each constraint family is recorded under its name once added
+        """
+        self.model = model
+        self.profiler = profiler
+        self.n_cols = 0
+        self._lb, self._ub, self._obj, self._vtype = [], [], [], []
+        self.vars = None
+
+    def add_vars(self, n: int, vtype: str, *, ub: float = 1, obj: np.ndarray = None) -> int:
+        """
+        Reserve n columns
+        :return: the index of the first reserved column
+        """
+        offset = self.n_cols
+        self.n_cols += n
+        self._lb.append(np.zeros(n))
+        self._ub.append(np.full(n, ub, dtype=float))
+        self._obj.append(np.zeros(n) if obj is None else obj)
+        self._vtype.append(np.full(n, vtype))
+        return offset
+
+    def create_vars(self) -> None:
+        self.vars = self.model.addMVar(
+            self.n_cols,
+            lb=np.concatenate(self._lb),
+            ub=np.concatenate(self._ub),
+            obj=np.concatenate(self._obj),
+            vtype=np.concatenate(self._vtype)
+        )
+        if self.profiler is not None:
+            self.profiler.record('variables')
+
+    def add_constrs(self, n_rows: int, entries: list[tuple], sense: str, rhs, name: str = '',
+                    keep: np.ndarray = None) -> None:
+        """
+        Add the constraint family A x (sense) rhs
+        :param n_rows: number of rows of A
+        :param entries: list of (rows, cols, vals) triplets of A
+        :param sense: one of '<', '=', '>'
+        :param rhs: right-hand side, either a scalar or an array of length n_rows
+        :param name: name of the constraint family
+        :param keep: boolean mask of the rows to add, all rows are added if None
+
+        Entries whose column is negative refer to variables that were not created and are dropped
+        """
+        rows = np.concatenate([np.broadcast_to(r, np.broadcast(r, c, v).shape) for r, c, v in entries])
+        cols = np.concatenate([np.broadcast_to(c, np.broadcast(r, c, v).shape) for r, c, v in entries])
+        vals = np.concatenate([np.broadcast_to(np.asarray(v, dtype=float), np.broadcast(r, c, v).shape)
+                               for r, c, v in entries])
+        rhs = np.broadcast_to(np.asarray(rhs, dtype=float), (n_rows,))
+
+        created = cols >= 0
+        rows, cols, vals = rows[created], cols[created], vals[created]
+
+        if keep is not None:
+            new_row = np.cumsum(keep) - 1
+            selected = keep[rows]
+            rows, cols, vals = new_row[rows[selected]], cols[selected], vals[selected]
+            rhs = rhs[keep]
+            n_rows = int(keep.sum())
+
+        if n_rows > 0:
+            matrix = sp.csr_matrix((vals, (rows, cols)), shape=(n_rows, self.n_cols))
+            self.model.addMConstr(matrix, self.vars, sense, np.ascontiguousarray(rhs), name=name)
+        if self.profiler is not None:
+            # parts of a family, e.g. (35.1.2), are recorded with the family
+            self.profiler.record(name.split('.')[0] + ')' if '.' in name else name)
+
+
+class _Formulation:
+    """
+    Variable layout and constraint families shared by the three formulations
+    """
+
+    def __init__(self, model: gb.Model, net: _Network, profiler: Optional[BuildProfiler] = None):
+        self.m = _MatrixModel(model, profiler)
+        self.net = net
+        K = net.K
+
+        # transfers (k1, k2), k1 != k2, indexing the s variables
+        k1, k2 = _grid(K, K)
+        self.k1, self.k2 = k1[k1 != k2], k2[k1 != k2]
+        self.P = len(self.k1)
+
+        self.x0 = self.m.add_vars(net.A * K, gb.GRB.BINARY,
+                                  obj=(net.cost[:, None] * net.unit_cost[None, :]).ravel())
+
+        # y_k_r_i_j is only created where net.carries, the others map to column -1
+        self.y_mask = np.broadcast_to(net.carries[:, None, :], (net.A, K, net.R)).ravel()
+        self.n_y = int(self.y_mask.sum())
+        self.y0 = self.m.add_vars(self.n_y, gb.GRB.BINARY)
+        self._y_col = np.full(net.A * K * net.R, -1, dtype=int)
+        self._y_col[self.y_mask] = self.y0 + np.arange(self.n_y)
+        self.s0 = self.a0 = self.b0 = None
+
+    def variables(self) -> dict[str, dict[tuple, gb.Var]]:
+        """
+        Returns the variables of the model by name, with the same keys as the expression builder,
+        e.g. variables['x'][i, j, k]
+        """
+        net, v = self.net, self.m.vars
+        node, vehicle, request = net.node_index, net.vehicle_index, net.request_index
+        a, k = _grid(net.A, net.K)
+        variables = {'x': _keyed(v[self.x0:self.x0 + net.A * net.K], node[net.src[a]], node[net.dst[a]], vehicle[k])}
+        a, k, r = (g[self.y_mask] for g in _grid(net.A, net.K, net.R))
+        variables['y'] = _keyed(v[self.y0:self.y0 + self.n_y],
+                                node[net.src[a]], node[net.dst[a]], vehicle[k], request[r])
+        if self.s0 is not None:
+            t, r, p = _grid(net.T, net.R, self.P)
+            variables['s'] = _keyed(v[self.s0:self.s0 + net.T * net.R * self.P],
+                                    node[net.transfer[t]], request[r], vehicle[self.k1[p]], vehicle[self.k2[p]])
+        if self.a0 is not None:
+            i, k = _grid(net.N, net.K)
+            variables['a'] = _keyed(v[self.a0:self.a0 + net.N * net.K], node[i], vehicle[k])
+            variables['b'] = _keyed(v[self.b0:self.b0 + net.N * net.K], node[i], vehicle[k])
+        return variables
+
+    def x(self, a, k):
+        return self.x0 + a * self.net.K + k
+
+    def y(self, a, k, r):
+        return self._y_col[(a * self.net.K + k) * self.net.R + r]
+
+    def s(self, t, r, p):
+        return self.s0 + (t * self.net.R + r) * self.P + p
+
+    def add_s(self) -> None:
+        self.s0 = self.m.add_vars(self.net.T * self.net.R * self.P, gb.GRB.BINARY)
+
+    def add_times(self) -> None:
+        self.a0 = self.m.add_vars(self.net.N * self.net.K, gb.GRB.CONTINUOUS, ub=float('inf'))
+        self.b0 = self.m.add_vars(self.net.N * self.net.K, gb.GRB.CONTINUOUS, ub=float('inf'))
+
+    def a(self, i, k):
+        return self.a0 + i * self.net.K + k
+
+    def b(self, i, k):
+        return self.b0 + i * self.net.K + k
+
+    def _request_sums(self, nodes_of_r: np.ndarray, outgoing: bool) -> tuple:
+        """
+        Entries of ∑k∈K ∑(i,j)∈A y_k_r_i_j for each r, with i = nodes_of_r[r] (or j if not outgoing)
+        """
+        net = self.net
+        r, arcs = net.out_arcs(nodes_of_r) if outgoing else net.in_arcs(nodes_of_r)
+        e, k = _grid(len(r), net.K)
+        return r[e], self.y(arcs[e], k, r[e]), 1
+
+    def add_request_constraints(self) -> None:
+        """
+        Constraints (4), (5), (6), (8) and (16)
+        """
+        net, m = self.net, self.m
+        K, R, T, N, A = net.K, net.R, net.T, net.N, net.A
+
+        # (4) ∑∈K ∑(i,j)∈A y_k_r_i_j = 1 ∀r ∈ R, i = p(r)
+        m.add_constrs(R, [self._request_sums(net.pickup, True)], '=', 1, '(4)')
+
+        # (5) ∑∈K ∑(j,i)∈A y_k_r_j_i = 1 ∀r ∈ R, i = d(r)
+        m.add_constrs(R, [self._request_sums(net.delivery, False)], '=', 1, '(5)')
+
+        # (6) ∑k∈K ∑(i,j)∈A y_k_r_i_j − ∑k∈K ∑(j,i)∈A y_k_r_j_i = 0 ∀r ∈ R, ∀i ∈ T
+        t_out, a_out = net.out_arcs(net.transfer)
+        t_in, a_in = net.in_arcs(net.transfer)
+        eo, ro, ko = _grid(len(t_out), R, K)
+        ei, ri, ki = _grid(len(t_in), R, K)
+        m.add_constrs(R * T, [
+            (ro * T + t_out[eo], self.y(a_out[eo], ko, ro), 1),
+            (ri * T + t_in[ei], self.y(a_in[ei], ki, ri), -1)
+        ], '=', 0, '(6)')
+
+        # (8) y_k_r_i_j ≤ x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K, ∀r ∈ R
+        a, k, r = _grid(A, K, R)
+        row = (a * K + k) * R + r
+        m.add_constrs(A * K * R, [(row, self.y(a, k, r), 1), (row, self.x(a, k), -1)], '<', 0, '(8)',
+                      keep=self.y_mask)
+
+        # (16) ∑(i,j)∈A y_k_r_i_j − ∑(j,i)∈A y_k_r_j_i = 0
+        #      ∀k ∈ K, ∀r ∈ R, ∀i ∈ N\{T ∪ {p(r),d(r)}}
+        kk, rr, ii = _grid(K, R, N)
+        keep = ~net.is_transfer[ii] & (ii != net.pickup[rr]) & (ii != net.delivery[rr])
+        k, r, a = _grid(K, R, A)
+        m.add_constrs(K * R * N, [
+            ((k * R + r) * N + net.src[a], self.y(a, k, r), 1),
+            ((k * R + r) * N + net.dst[a], self.y(a, k, r), -1)
+        ], '=', 0, '(16)', keep=keep)
+
+    def add_capacity_constraints(self) -> None:
+        # (9) ∑r∈R q_r y_k_r_i_j ≤ u_k x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K
+        net = self.net
+        a, k, r = _grid(net.A, net.K, net.R)
+        ak, kk = _grid(net.A, net.K)
+        self.m.add_constrs(net.A * net.K, [
+            (a * net.K + k, self.y(a, k, r), net.load[r]),
+            (ak * net.K + kk, self.x(ak, kk), -net.capacity[kk])
+        ], '<', 0, '(9)')
+
+    def add_transfer_constraints(self, name: str) -> None:
+        # (21)/(30) ∑(j,t)∈A y_k1_r_j_t + ∑(t,j)∈A y_k2_r_t_j ≤ s_k1_k2_t_r + 1
+        #           ∀r ∈ R, ∀t ∈ T , ∀k1 , k2 ∈ K
+        net, P = self.net, self.P
+        R, T = net.R, net.T
+        t_in, a_in = net.in_arcs(net.transfer)
+        t_out, a_out = net.out_arcs(net.transfer)
+        ri, ei, pi = _grid(R, len(t_in), P)
+        ro, eo, po = _grid(R, len(t_out), P)
+        r, t, p = _grid(R, T, P)
+        self.m.add_constrs(R * T * P, [
+            ((ri * T + t_in[ei]) * P + pi, self.y(a_in[ei], self.k1[pi], ri), 1),
+            ((ro * T + t_out[eo]) * P + po, self.y(a_out[eo], self.k2[po], ro), 1),
+            ((r * T + t) * P + p, self.s(t, r, p), -1)
+        ], '<', 1, name)
+
+    def add_transfer_time_constraints(self, M, name: str = '') -> None:
+        # a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, t ∈ T, k1,k2 ∈ K,
+        # with M[t, p] for k1, k2 = k1[p], k2[p]
+        net, P = self.net, self.P
+        r, t, p = _grid(net.R, net.T, P)
+        row = (r * net.T + t) * P + p
+        M = np.broadcast_to(np.asarray(M, dtype=float), (net.T, P))[t, p]
+        self.m.add_constrs(net.R * net.T * P, [
+            (row, self.a(net.transfer[t], self.k1[p]), 1),
+            (row, self.b(net.transfer[t], self.k2[p]), -1),
+            (row, self.s(t, r, p), M)
+        ], '<', M, name)
+
+    def transfer_big_m(self) -> np.ndarray:
+        """
+        Returns the M of a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) for each t and pair p,
+        see TimeWindows.transfer_big_m
+        """
+        latest, earliest = self.net.latest_k[self.net.transfer], self.net.earliest_k[self.net.transfer]
+        return np.maximum(0, latest[:, self.k1] - earliest[:, self.k2])
+
+    def add_arc_time_constraints(self, name: str = '') -> None:
+        # b_k_i + τ_k_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
+        net = self.net
+        a, k = _grid(net.A, net.K)
+        M = np.maximum(0, net.latest_k[net.src[a], k] + net.cost[a] - net.earliest_k[net.dst[a], k])
+        row = a * net.K + k
+        self.m.add_constrs(net.A * net.K, [
+            (row, self.b(net.src[a], k), 1),
+            (row, self.a(net.dst[a], k), -1),
+            (row, self.x(a, k), M)
+        ], '<', M - net.cost[a], name)
+
+    def add_valid_inequalities(self, *, with_times: bool, with_routing: bool = True) -> None:
+        """
+        Valid inequalities (40) to (47) if with_routing, and (48) to (51) if with_times
+        """
+        net, m = self.net, self.m
+        K = net.K
+
+        if with_routing:
+            # (40), (42) and (43) only hold for the vehicles whose routes end at a destination depot, not back at o(k)
+            # like those of the instances read for Sampaio, see separation._rows
+            with_dest = net.dest != net.origin
+
+            # (40) ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, i = o(k)
+            k, arcs = net.in_arcs(net.origin)
+            m.add_constrs(K, [(k, self.x(arcs, k), 1)], '=', 0, '(40)', keep=with_dest)
+
+            # (41) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k)
+            D = len(net.depots)
+            k, d = _grid(K, D)
+            keep = net.depots[d] != net.origin[k]
+            d_out, a_out = net.out_arcs(net.depots)
+            k, e = _grid(K, len(d_out))
+            m.add_constrs(K * D, [(k * D + d_out[e], self.x(a_out[e], k), 1)], '=', 0, '(41)', keep=keep)
+
+            # (42) ∑(j,i)∈A x_k_j_i = 1 ∀k ∈ K, i = o'(k)
+            k, arcs = net.in_arcs(net.dest)
+            m.add_constrs(K, [(k, self.x(arcs, k), 1)], '=', 1, '(42)', keep=with_dest)
+
+            # (43) ∑(i,j)∈A x_k_j_i = 0 ∀k ∈ K, i = o'(k)
+            k, arcs = net.out_arcs(net.dest)
+            m.add_constrs(K, [(k, self.x(arcs, k), 1)], '=', 0, '(43)', keep=with_dest)
+
+            # (44) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, ∀i ∈ T
+            t_out, a_out = net.out_arcs(net.transfer)
+            k, e = _grid(K, len(t_out))
+            m.add_constrs(K * net.T, [(k * net.T + t_out[e], self.x(a_out[e], k), 1)], '<', 1, '(44)')
+
+            # (45) ∑(i,j)∈A ∑k∈K x_k_i_j = 1 ∀i ∈ P ∪ D
+            i_out, a_out = net.out_arcs(net.pickup_delivery)
+            e, k = _grid(len(i_out), K)
+            m.add_constrs(len(net.pickup_delivery), [(i_out[e], self.x(a_out[e], k), 1)], '=', 1, '(45)')
+
+            # (46) ∑(i,j)∈A ∑k∈K y_k_r_i_j = 0 ∀r ∈ R, j = p(r)
+            # (47) ∑(i,j)∈A y_k_r_i_j = 0 ∀r ∈ R, ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k), i != o′ (k)
+            # hold by construction: those y_k_r_i_j are not created, see net.carries
+
+        if not with_times:
+            return
+
+        # (48) a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, t ∈ T, k1,k2 ∈ K, k1 != k2
+        self.add_transfer_time_constraints(self.transfer_big_m(), '(48)')
+
+        # (49) b_k_i + τ_k_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
+        self.add_arc_time_constraints('(49)')
+
+        # (50) a_k_i ≥ Ei , bk_i ≤ Li ∀i ∈ N, ∀k ∈ K
+        i, k = _grid(net.N, K)
+        row = i * K + k
+        m.add_constrs(net.N * K, [(row, self.a(i, k), 1)], '>', net.earliest_k[i, k], '(50)')
+        m.add_constrs(net.N * K, [(row, self.b(i, k), 1)], '<', net.latest_k[i, k], '(50)')
+
+        # (51) a_k_i ≤ b_k_i ∀i ∈ N, ∀k ∈ K
+        m.add_constrs(net.N * K, [(row, self.a(i, k), 1), (row, self.b(i, k), -1)], '<', 0, '(51)')
+
+
+def build_lyu(model: gb.Model, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *,
+              windows: Optional[TimeWindows] = None,
+              profiler: Optional[BuildProfiler] = None) -> dict[str, dict[tuple, gb.Var]]:
+    """
+    Add the variables and constraints of the Lyu model to an empty Gurobi model, one matrix per constraint family
+    :param windows: time windows of the vehicles giving the big-M of (48) and (49) and the bounds of (50), those of the
+    nodes if None
+    :param profiler: if given, records the build of each constraint family
+    :return: the variables of the model, see _Formulation.variables
+    """
+    net = _Network(graph, vehicles, requests, windows)
+    f = _Formulation(model, net, profiler)
+    f.add_s()
+    f.add_times()
+    f.m.create_vars()
+    m, K = f.m, net.K
+
+    f.add_request_constraints()
+    f.add_capacity_constraints()
+    f.add_transfer_constraints('(21)')
+
+    # (25) ∑(i,j)∈A x_k_i_j = 1 ∀k ∈ K, i = o(k)
+    k, arcs = net.out_arcs(net.origin)
+    m.add_constrs(K, [(k, f.x(arcs, k), 1)], '=', 1, '(25)')
+
+    # (27) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, ∀i ∈ P ∪ D ∪ T
+    keep = np.zeros(net.N, dtype=bool)
+    keep[net.pickup_delivery] = True
+    keep[net.transfer] = True
+    a, k = _grid(net.A, K)
+    m.add_constrs(K * net.N, [
+        (k * net.N + net.src[a], f.x(a, k), 1),
+        (k * net.N + net.dst[a], f.x(a, k), -1)
+    ], '=', 0, '(27)', keep=np.tile(keep, K))
+
+    f.add_valid_inequalities(with_times=True)
+
+    return f.variables()
+
+
+def build_rais(model: gb.Model, graph: Graph, vehicles: set[Vehicle], requests: set[Request], vi: bool, *,
+               subtours: bool = True, separate_vi: bool = False, windows: Optional[TimeWindows] = None,
+               profiler: Optional[BuildProfiler] = None) -> dict[str, dict[tuple, gb.Var]]:
+    """
+    Add the variables and constraints of the Rais model to an empty Gurobi model, one matrix per constraint family
+    :param subtours: set to False to leave constraints (19) out of the model
+    :param separate_vi: set to True to leave the valid inequalities (40) to (45) out of the model
+    :param windows: time windows of the vehicles giving the big-M of (48) and (49) and the bounds of (50) if vi, those
+    of the nodes if None
+    :param profiler: if given, records the build of each constraint family
+    :return: the variables of the model, see _Formulation.variables
+    """
+    net = _Network(graph, vehicles, requests, windows)
+    f = _Formulation(model, net, profiler)
+    m, N, K = f.m, net.N, net.K
+    M = N
+
+    # z_k_i_j = 1 if node i precedes node j for vehicle k
+    z0 = m.add_vars(N * N * K, gb.GRB.BINARY)
+    e0 = m.add_vars(N * K, gb.GRB.CONTINUOUS, ub=float('inf'))
+    f.add_s()
+    if vi:
+        f.add_times()
+    m.create_vars()
+
+    def z(i, j, k):
+        return z0 + (i * N + j) * K + k
+
+    def e(i, k):
+        return e0 + i * K + k
+
+    # (2) ∑(i,j)∈A x_k_i_j = ∑(j,l)∈A x_k_j_l ∀k ∈ K, i = o(k), l = o′ (k)
+    k_out, a_out = net.out_arcs(net.origin)
+    k_in, a_in = net.in_arcs(net.dest)
+    m.add_constrs(K, [(k_out, f.x(a_out, k_out), 1), (k_in, f.x(a_in, k_in), -1)], '=', 0, '(2)')
+
+    # (3) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ N\{o(k), o′(k)}
+    kk, ii = _grid(K, N)
+    keep = (ii != net.origin[kk]) & (ii != net.dest[kk])
+    a, k = _grid(net.A, K)
+    m.add_constrs(K * N, [
+        (k * N + net.src[a], f.x(a, k), 1),
+        (k * N + net.dst[a], f.x(a, k), -1)
+    ], '=', 0, '(3)', keep=keep)
+
+    f.add_request_constraints()
+    f.add_capacity_constraints()
+
+    # (17) x_k_i_j ≤ z_k_i_j ∀(i,j) ∈ A, ∀k ∈ K
+    row = a * K + k
+    m.add_constrs(net.A * K, [(row, f.x(a, k), 1), (row, z(net.src[a], net.dst[a], k), -1)], '<', 0, '(17)')
+
+    # (18) z_k_i_j + z_k_j_i = 1 ∀(i,j) ∈ A, ∀k ∈ K
+    m.add_constrs(net.A * K, [
+        (row, z(net.src[a], net.dst[a], k), 1),
+        (row, z(net.dst[a], net.src[a], k), 1)
+    ], '=', 1, '(18)')
+
+    # (19) z_k_i_j + z_k_j_l + z_k_l_i ≤ 2 ∀i,j,l ∈ N, ∀k ∈ K, (i,j), (j,l), (l,i) ∈ A
+    if subtours:
+        i, j, l = _grid(N, N, N)
+        distinct = (i != j) & (i != l) & (j != l)
+        i, j, l = i[distinct], j[distinct], l[distinct]
+        c, k = _grid(len(i), K)
+        row = c * K + k
+        m.add_constrs(len(i) * K, [
+            (row, z(i[c], j[c], k), 1),
+            (row, z(j[c], l[c], k), 1),
+            (row, z(l[c], i[c], k), 1)
+        ], '<', 2, '(19)')
+
+    # (20) e_k_i + 1 − e_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
+    a, k = _grid(net.A, K)
+    row = a * K + k
+    m.add_constrs(net.A * K, [
+        (row, e(net.src[a], k), 1),
+        (row, e(net.dst[a], k), -1),
+        (row, f.x(a, k), M)
+    ], '<', M - 1, '(20)')
+
+    f.add_transfer_constraints('(21)')
+
+    # (22) e_k1_t − e_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, ∀t ∈ T , ∀k1 , k2 ∈ K, k1 != k2
+    r, t, p = _grid(net.R, net.T, f.P)
+    row = (r * net.T + t) * f.P + p
+    m.add_constrs(net.R * net.T * f.P, [
+        (row, e(net.transfer[t], f.k1[p]), 1),
+        (row, e(net.transfer[t], f.k2[p]), -1),
+        (row, f.s(t, r, p), M)
+    ], '<', M, '(22)')
+
+    # (25) ∑(i,j)∈A x_k_i_j = 1 ∀k ∈ K, i = o(k)
+    m.add_constrs(K, [(k_out, f.x(a_out, k_out), 1)], '=', 1, '(25)')
+
+    if vi:
+        f.add_valid_inequalities(with_times=True, with_routing=not separate_vi)
+
+    variables = f.variables()
+    node, vehicle = net.node_index, net.vehicle_index
+    i, j, k = _grid(N, N, K)
+    variables['z'] = _keyed(m.vars[z0:z0 + N * N * K], node[i], node[j], vehicle[k])
+    i, k = _grid(N, K)
+    variables['e'] = _keyed(m.vars[e0:e0 + N * K], node[i], vehicle[k])
+    return variables
+
+
+def build_sampaio(model: gb.Model, graph: Graph, vehicles: set[Vehicle], requests: set[Request],
+                  vi: bool, *, separate_vi: bool = False, windows: Optional[TimeWindows] = None,
+                  profiler: Optional[BuildProfiler] = None) -> dict[str, dict[tuple, gb.Var]]:
+    """
+    Add the variables and constraints of the Sampaio model to an empty Gurobi model, one matrix per constraint family
+    :param separate_vi: set to True to leave the valid inequalities (40) to (45) out of the model
+    :param windows: time windows of the vehicles giving the big-M of (28) and (31) and the bounds of (35). If None,
+    those of the nodes, and (31) takes the M of the last arc of (28) like the expression builder does
+    :param profiler: if given, records the build of each constraint family
+    :return: the variables of the model, see _Formulation.variables
+    """
+    net = _Network(graph, vehicles, requests, windows)
+    f = _Formulation(model, net, profiler)
+    f.add_s()
+    f.add_times()
+    f.m.create_vars()
+    m, N, K = f.m, net.N, net.K
+
+    # Without windows the expression builder reassigns M while adding (28), so (31) uses the M of the last arc it
+    # visited
+    M = N
+    if windows is not None:
+        M = f.transfer_big_m()
+    elif vehicles:
+        for arc in graph.arcs:
+            M = max(0, arc.src.latest_time + arc.cost - arc.dst.earliest_time)
+
+    # (1) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, i = o(k)
+    k, arcs = net.out_arcs(net.origin)
+    m.add_constrs(K, [(k, f.x(arcs, k), 1)], '<', 1, '(1)')
+
+    f.add_request_constraints()
+
+    # (28) b_k_i + τ_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
+    f.add_arc_time_constraints('(28)')
+
+    # (30) ∑(j,t)∈A y_k1_r_j_t + ∑(t,j)∈A y_k2_r_t_j ≤ s_k1_k2_t_r + 1 ∀r ∈ R, t ∈ T, k1,k2 ∈ K
+    f.add_transfer_constraints('(30)')
+
+    # (31) a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, t ∈ T, k1,k2 ∈ K
+    f.add_transfer_time_constraints(M, '(31)')
+
+    # (34) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, ∀i ∈ N
+    kk, ii = _grid(K, N)
+    keep = (ii != net.origin[kk]) & (ii != net.dest[kk]) if vi else None
+    a, k = _grid(net.A, K)
+    m.add_constrs(K * N, [
+        (k * N + net.src[a], f.x(a, k), 1),
+        (k * N + net.dst[a], f.x(a, k), -1)
+    ], '=', 0, '(34)', keep=keep)
+
+    # (35.1) Ei ≤ b_k_i ≤ Li ∀k ∈ K, ∀i ∈ N
+    # (35.2) Ei ≤ a_k_i ≤ Li ∀k ∈ K, ∀i ∈ N
+    k, i = _grid(K, N)
+    row = k * N + i
+    m.add_constrs(K * N, [(row, f.b(i, k), 1)], '>', net.earliest_k[i, k], '(35.1.1)')
+    m.add_constrs(K * N, [(row, f.b(i, k), 1)], '<', net.latest_k[i, k], '(35.1.2)')
+    m.add_constrs(K * N, [(row, f.a(i, k), 1)], '>', net.earliest_k[i, k], '(35.2.1)')
+    m.add_constrs(K * N, [(row, f.a(i, k), 1)], '<', net.latest_k[i, k], '(35.2.2)')
+
+    # (36) b_k_i ≥ a_k_i ∀i ∈ N, ∀k ∈ K, i != o(k)
+    m.add_constrs(K * N, [(row, f.b(i, k), 1), (row, f.a(i, k), -1)], '>', 0, '(36)',
+                  keep=i != net.origin[k])
+
+    # (37) y_k_r_i_j = 0 ∀k ∈ K, ∀r ∈ R, ∀(i,j) ∈ A, i ∈ O
+    # (38) y_k_r_i_j = 0 ∀k ∈ K, ∀r ∈ R, ∀(i,j) ∈ A, j ∈ O
+    # (39) y_k_r_i_j = 0 ∀k ∈ K, ∀r ∈ R, ∀(i,j) ∈ A, j = p(r)
+    # hold by construction: those y_k_r_i_j are not created, see net.carries
+
+    if vi and not separate_vi:
+        f.add_valid_inequalities(with_times=False)
+
+    return f.variables()
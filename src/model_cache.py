@@ -0,0 +1,145 @@
+from abstract_model import AbstractModel
+from gurobi_env import read_model
+from sampaio import Sampaio
+from utils import get_instance_data
+from variables import SparseTupledict
+
+from pathlib import Path
+from typing import Any, Optional, Type
+
+import hashlib
+import json
+import os
+import sys
+
+import gurobipy as gb
+
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent.parent / 'cache' / 'models'
+DEFAULT_MAX_BYTES = 5 * 2**30
+# modules whose code determines the model built from an instance, besides the module of the model class
+_BUILDER_MODULES = ('abstract_model', 'matrix_builder', 'variables', 'utils', 'compact_graph', 'graph', 'request',
+                    'vehicle', 'symmetry', 'time_windows')
+_BUILD_OPTIONS = ('builder', 'profile_build')
+
+
+def builder_version(model_class: Type[AbstractModel]) -> str:
+    """
+    Returns a hash of the code that builds the models of model_class, so that cached models are rebuilt whenever it
+    changes
+    """
+    digest = hashlib.sha256()
+    for module in sorted({model_class.__module__, *_BUILDER_MODULES}):
+        digest.update(Path(sys.modules[module].__file__).read_bytes())
+    return digest.hexdigest()
+
+
+def cache_key(model_class: Type[AbstractModel], path: Path, options: dict[str, Any]) -> str:
+    """
+    Returns the name of the cached model of an instance
+    :param model_class: either Rais, Lyu or Sampaio
+    :param path: file containing the instance data
+    :param options: keyword arguments of the model, e.g. {'vi': True, 'builder': 'matrix'}
+    """
+    digest = hashlib.sha256()
+    digest.update(Path(path).read_bytes())
+    digest.update(model_class.__name__.encode())
+    # these only change how the model is built, not the model itself
+    digest.update(json.dumps({k: v for k, v in options.items() if k not in _BUILD_OPTIONS}, sort_keys=True).encode())
+    digest.update(builder_version(model_class).encode())
+    return f'{model_class.__name__}-{Path(path).stem}-{digest.hexdigest()[:16]}'
+
+
+def build_model(model_class: Type[AbstractModel], path: Path, *, cache_dir: Path = DEFAULT_CACHE_DIR,
+                max_bytes: Optional[int] = DEFAULT_MAX_BYTES, **options) -> AbstractModel:
+    """
+    Returns the model of the instance found at path, read from the cache if it was built before, otherwise built and
+    added to the cache. A model read from the cache has the same variables, constraints and self.variables as a built
+    one, but the Gurobi parameters set after __init__ must be set again
+    :param model_class: either Rais, Lyu or Sampaio
+    :param path: file containing the instance data
+    :param cache_dir: directory of the cached models, one .mps.bz2 file and one .json file of variable keys each
+    :param max_bytes: size of the cache after which the least recently used models are deleted, unlimited if None
+    :param options: keyword arguments of the model, e.g. vi=True
+    :return: the model
+    """
+    graph, vehicles, requests = get_instance_data(path, sampaio=model_class is Sampaio)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key = cache_key(model_class, path, options)
+    mps_file, keys_file = cache_dir / f'{key}.mps.bz2', cache_dir / f'{key}.json'
+
+    if mps_file.exists() and keys_file.exists():
+        model = model_class.__new__(model_class)
+        AbstractModel.__init__(model)
+        model.model = read_model(str(mps_file))
+        model.model.setParam('TimeLimit', 3600)
+        model.variables = _read_keys(keys_file, model.model.getVars())
+        model.graph, model.vehicles, model.requests = graph, vehicles, requests
+        model.on_load(graph, vehicles, requests, **options)
+        for file in (mps_file, keys_file):
+            os.utime(file)  # most recently used
+        return model
+
+    model = model_class(graph, vehicles, requests, **options)
+    model.model.update()
+    # write to temporary files first, so that other processes never read a partially written model
+    suffix = f'.{os.getpid()}.tmp'
+    model.model.write(str(cache_dir / f'{key}{suffix}.mps.bz2'))
+    _write_keys(cache_dir / f'{key}{suffix}.json', model.variables)
+    os.replace(cache_dir / f'{key}{suffix}.mps.bz2', mps_file)
+    os.replace(cache_dir / f'{key}{suffix}.json', keys_file)
+
+    if max_bytes is not None:
+        evict(cache_dir, max_bytes)
+    return model
+
+
+def _write_keys(file: Path, variables: dict[str, Any]) -> None:
+    """
+    Write the keys of the variables of each name with the position of the variables in the model
+    """
+    data = {}
+    for name, named_variables in variables.items():
+        data[name] = {
+            'keys': [list(key) for key in named_variables.keys()],
+            'positions': [var.index for var in named_variables.values()],
+            'sparse': isinstance(named_variables, SparseTupledict)
+        }
+    file.write_text(json.dumps(data))
+
+
+def _read_keys(file: Path, model_vars: list[gb.Var]) -> dict[str, Any]:
+    """
+    Returns the variables of the model by name and key, see _write_keys
+    """
+    variables = {}
+    for name, data in json.loads(file.read_text()).items():
+        keyed = gb.tupledict(zip(map(tuple, data['keys']), (model_vars[p] for p in data['positions'])))
+        variables[name] = SparseTupledict(keyed) if data['sparse'] else keyed
+    return variables
+
+
+def evict(cache_dir: Path, max_bytes: int) -> None:
+    """
+    Delete the least recently used models until the cache takes at most max_bytes
+    """
+    entries = []
+    for mps_file in Path(cache_dir).glob('*.mps.bz2'):
+        if mps_file.name.endswith('.tmp.mps.bz2'):
+            continue
+        keys_file = mps_file.with_name(mps_file.name[:-len('.mps.bz2')] + '.json')
+        try:
+            stat = mps_file.stat()
+            size = stat.st_size + (keys_file.stat().st_size if keys_file.exists() else 0)
+        except FileNotFoundError:  # evicted by another process
+            continue
+        entries.append((stat.st_mtime, size, mps_file, keys_file))
+
+    total = sum(size for _, size, _, _ in entries)
+    for _, size, mps_file, keys_file in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        for file in (mps_file, keys_file):
+            file.unlink(missing_ok=True)
+        total -= size
@@ -0,0 +1,226 @@
+from abstract_model import AbstractModel
+from batch import Job, available_cores, can_solve, instance_path, solve
+
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Any, Optional
+
+import argparse
+import gurobipy as gb
+import math
+import multiprocessing
+import time
+
+
+# MILP models raced by default, those that cannot solve the instance being left out, see batch.can_solve
+PORTFOLIO = ('Rais', 'Sampaio', 'Lyu')
+# models that can take part in the race: the incumbents and bounds are shared from their Gurobi callback
+_RACING = ('Rais', 'Sampaio', 'Lyu', 'Aggregated')
+# statuses that end the race: the instance is solved, no other model can do better
+_SETTLED = ('OPTIMAL', 'INFEASIBLE')
+# seconds a model may run past its time limit, e.g. to finish building the model, before it is killed
+_GRACE = 60
+
+
+class Portfolio:
+    """
+    Races several models on the same instance, each in its own process with its share of the cores, and returns the
+    result of the first one that proves optimality or infeasibility, the others being killed. The models share the
+    objective of the best incumbent found by any of them: a model built after it is found takes it as Cutoff, and a
+    model stops as soon as its bound shows it cannot improve on it, which proves that incumbent optimal
+    """
+
+    def __init__(self, path: Path, models: tuple[str, ...] = PORTFOLIO, *, cores: Optional[int] = None,
+                 time_limit: float = 3600, options: Optional[dict[str, dict[str, Any]]] = None,
+                 heuristic_start: bool = False):
+        """
+        :param path: file containing the instance data
+        :param models: models to race, among 'Rais', 'Sampaio', 'Lyu' and 'Aggregated'
+        :param cores: cores split among the models as Gurobi threads, by default those this process may run on
+        :param time_limit: seconds given to each model, building time included
+        :param options: keyword arguments of each model, e.g. {'Rais': {'vi': True}}
+        :param heuristic_start: set to True to start each model from the solution of the construction heuristic
+        """
+        unknown = [model for model in models if model not in _RACING]
+        if unknown:
+            raise ValueError(f'models must be among {_RACING}, not {unknown}')
+        options = options or {}
+        self.jobs = [Job(model, path, '', options=options.get(model, {}), heuristic_start=heuristic_start)
+                     for model in models if can_solve(model, path)]
+        if not self.jobs:
+            raise ValueError(f'none of {models} can solve {path.name}')
+        self.cores = cores or available_cores()
+        self.time_limit = time_limit
+        # events of each model as (seconds since the start of the race, event, value): 'built' with the Cutoff taken
+        # from the race if any, 'incumbent' with its objective, 'bound' with the objective of the best incumbent and
+        # the bound that proved it optimal, 'finished' with its result, and 'failed' or 'killed'
+        self.timeline: dict[str, list[tuple[float, str, Any]]] = {job.model: [] for job in self.jobs}
+
+    def run(self) -> tuple[str, tuple[str, float, float, float]]:
+        """
+        Run the race, see self.timeline for the events of each model
+        :return: the winning model and its result, see AbstractModel.get_result. If no model proves optimality or
+        infeasibility within the time limit, the winner is the one with the best objective
+        """
+        threads = max(1, self.cores // len(self.jobs))
+        # spawn rather than fork: Gurobi environments must not be inherited by the workers
+        context = multiprocessing.get_context('spawn')
+        best = context.Value('d', math.inf)
+        running: dict[Connection, tuple[Job, Any]] = {}
+        finished = []
+        results: dict[str, tuple[str, float, float, float]] = {}
+        start = time.perf_counter()
+
+        for job in self.jobs:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_worker, args=(job, threads, self.time_limit, best, sender), daemon=True)
+            process.start()
+            sender.close()
+            running[receiver] = (job, process)
+
+        # model holding the best incumbent, the objective proven optimal and the bound proving it
+        incumbent, objective, proven, proof = None, math.inf, None, None
+        cutoffs: dict[str, Optional[float]] = {}
+
+        def receive(conn: Connection) -> None:
+            nonlocal incumbent, objective, proven, proof
+            job, process = running[conn]
+            try:
+                event, value = conn.recv()
+            except EOFError:  # the worker died without a result, e.g. out of memory
+                event, value = 'failed', f'worker exited with code {process.exitcode}'
+            self.timeline[job.model].append((time.perf_counter() - start, event, value))
+            if event == 'built':
+                cutoffs[job.model] = value
+            elif event == 'incumbent' and value < objective:
+                incumbent, objective = job.model, value
+            elif event == 'bound':
+                proven, proof = value
+            elif event == 'finished':
+                results[job.model] = value
+                if value[0] == 'CUTOFF' and cutoffs.get(job.model) is not None:
+                    # no solution of the model beats its Cutoff, the best incumbent when it was built
+                    proven = proof = cutoffs[job.model]
+            if event in ('finished', 'failed'):
+                finished.append(process)
+                running.pop(conn)
+                conn.close()
+
+        deadline = start + self.time_limit + _GRACE
+        while running and proof is None and not any(result[0] in _SETTLED for result in results.values()):
+            for conn in wait(list(running), timeout=max(0.0, deadline - time.perf_counter())):
+                receive(conn)
+            if time.perf_counter() > deadline:
+                break
+        # the events already sent, e.g. the incumbent a bound was proven against, are read before deciding the winner
+        ready = wait(list(running), timeout=0)
+        while ready:
+            for conn in ready:
+                receive(conn)
+            ready = wait(list(running), timeout=0)
+
+        for conn, (job, process) in running.items():
+            process.kill()
+            conn.close()
+            self.timeline[job.model].append((time.perf_counter() - start, 'killed', None))
+        # the finished workers are left to exit once the others are killed
+        for process in finished:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+
+        elapsed = time.perf_counter() - start
+        settled = [model for model, result in results.items() if result[0] in _SETTLED]
+        if settled:
+            return settled[0], results[settled[0]]
+        if proof is not None and incumbent is not None:
+            gap = abs(proven - proof) / abs(proven) if proven else 0.0
+            return incumbent, ('OPTIMAL', round(proven, 7), gap, elapsed)
+        # no optimum within the time limit: the best objective wins, also that of a model killed at the time limit
+        if incumbent is not None and incumbent not in results:
+            results[incumbent] = ('TIME_LIMIT', round(objective, 7), math.inf, elapsed)
+        if not results:
+            return self.jobs[0].model, ('ERROR', math.inf, math.inf, elapsed)
+        winner = min(results, key=lambda model: (results[model][1], results[model][3]))
+        return winner, results[winner]
+
+
+class _Racer:
+    """
+    Shares the incumbents of a model with the others of the race, and stops it once the best incumbent of the race is
+    proven optimal by its bound
+    """
+
+    def __init__(self, best, conn: Connection):
+        """
+        :param best: objective of the best incumbent of the race, a multiprocessing.Value shared by the workers
+        :param conn: connection the events are sent to the parent through
+        """
+        self.best = best
+        self.conn = conn
+        self.gap = 0.0
+
+    def prepare(self, model: AbstractModel) -> None:
+        self.gap = model.model.Params.MIPGap
+        cutoff = self.best.value
+        if cutoff < math.inf:
+            model.model.setParam('Cutoff', cutoff)
+        model.callbacks.append(self.callback)
+        self.conn.send(('built', cutoff if cutoff < math.inf else None))
+
+    def callback(self, model: gb.Model, where: int) -> None:
+        # the incumbents are read here rather than at MIPSOL, where a lazy constraint may still reject the solution
+        if where != gb.GRB.Callback.MIP:
+            return
+        incumbent, bound = model.cbGet(gb.GRB.Callback.MIP_OBJBST), model.cbGet(gb.GRB.Callback.MIP_OBJBND)
+        if incumbent >= gb.GRB.INFINITY:  # no incumbent yet
+            incumbent = math.inf
+        with self.best.get_lock():
+            improved = incumbent < self.best.value
+            if improved:
+                self.best.value = incumbent
+                # sent before another model can read it, and prove it optimal, so that the parent knows who holds it
+                self.conn.send(('incumbent', incumbent))
+            best = self.best.value
+        if not improved and best < incumbent and bound >= best - self.gap * abs(best):
+            # the incumbent of another model is optimal within the MIPGap of this one, which cannot improve on it
+            self.conn.send(('bound', (best, bound)))
+            model.terminate()
+
+
+def _worker(job: Job, threads: int, time_limit: float, best, conn: Connection) -> None:
+    """
+    Entry point of the worker processes: send the events of the model, then its result or the error that stopped it,
+    to the parent
+    """
+    try:
+        conn.send(('finished', solve(job, threads, time_limit, _Racer(best, conn).prepare)))
+    except Exception as e:
+        conn.send(('failed', repr(e)))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Race the models on an instance, stopping at the first optimum')
+    parser.add_argument('instance', type=str, help='Instance to run, e.g. PDPT-R5-K2-T1-Q100-6')
+    parser.add_argument('--models', type=str, nargs='+', default=list(PORTFOLIO), choices=_RACING,
+                        help='models to race, those that cannot solve the instance being left out')
+    parser.add_argument('--cores', type=int, help='cores split among the models, by default all')
+    parser.add_argument('--time-limit', type=float, default=3600, help='seconds given to each model')
+    parser.add_argument('--mip-start', action='store_true',
+                        help='start from the solution of the cheapest insertion heuristic')
+    args = parser.parse_args()
+
+    path = instance_path(args.instance)
+    if path is None:
+        print('Instance does not exist')
+        exit(1)
+
+    portfolio = Portfolio(path, tuple(args.models), cores=args.cores, time_limit=args.time_limit,
+                          heuristic_start=args.mip_start)
+    winner, result = portfolio.run()
+    print(path.name, f'\t{winner}\t', result)
+    for model, events in portfolio.timeline.items():
+        for seconds, event, value in events:
+            print(f'{seconds:9.2f}s\t{model}\t{event}\t{value if value is not None else ""}')
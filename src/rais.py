@@ -1,23 +1,97 @@
 import gurobipy as gb
+import numpy as np
 
 from itertools import product
 
-from abstract_model import AbstractModel
+from abstract_model import AbstractModel, BUILDERS
+from build_profiler import BuildProfiler
 from graph import Graph, NodeType
+from matrix_builder import build_rais
 from request import Request
+from separation import CutSeparator, add_valid_inequalities
+from symmetry import add_symmetry_breaking
+from time_windows import TimeWindows
+from variables import SparseTupledict, may_carry
 from vehicle import Vehicle
 
 
+# maximum number of subtour constraints (19) separated at each node of the branch-and-bound tree
+_MAX_NODE_SUBTOUR_CUTS = 100
+
+
+def _violated_triangles(z: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Find the triples of distinct nodes violating (19) z_k_i_j + z_k_j_l + z_k_l_i ≤ 2. Each cycle is reported once,
+    starting from its node with the smallest position
+    :param z: values of the z variables, with shape (|N|, |N|, |K|)
+    :param tolerance: minimum violation to report
+    :return: an array of rows (i, j, l, k), sorted by decreasing violation
+    """
+    n = z.shape[0]
+    lhs = z[:, :, None, :] + z[None, :, :, :] + z.transpose(1, 0, 2)[:, None, :, :]
+    i, j, l = np.ogrid[:n, :n, :n]
+    cycles = (i < j) & (i < l) & (j != l)
+    violated = (lhs > 2 + tolerance) & cycles[..., None]
+    return np.argwhere(violated)[np.argsort(-lhs[violated], kind='stable')]
+
+
 class Rais(AbstractModel):
 
-    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], vi: bool = False):
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], vi: bool = False, *,
+                 builder: str = 'expr', lazy_subtours: bool = False, lazy_at_nodes: bool = False,
+                 separate_vi: bool = False, symmetry_breaking: bool = False, tight_big_m: bool = True,
+                 profile_build: bool = False):
+        """
+        :param vi: set to True to add the valid inequalities (40) to (51)
+        :param builder: either 'expr' or 'matrix', see BUILDERS
+        :param lazy_subtours: set to True to leave constraints (19) out of the model and add the violated ones from a
+        callback on each new incumbent
+        :param lazy_at_nodes: with lazy_subtours, also separate (19) on the LP relaxation of the branch-and-bound nodes
+        :param separate_vi: set to True to add the valid inequalities (40) to (45), the transfer precedences and the
+        capacity covers from a callback when violated, see separation.CutSeparator, instead of (40) to (45) up front
+        :param symmetry_breaking: set to True to order the interchangeable vehicles, see symmetry.add_symmetry_breaking
+        :param tight_big_m: with vi, set to False to take the big-M of (48) and (49) and the bounds of (50) from the
+        time windows of the nodes instead of those of the vehicles, see TimeWindows
+        :param profile_build: set to True to measure the build of each constraint family, see self.build_profile
+        """
         super().__init__()
-        model = gb.Model('Rais', env=gb.Env(params={'OutputFlag': 0}))
+        self.graph, self.vehicles, self.requests = graph, vehicles, requests
+        if builder not in BUILDERS:
+            raise ValueError(f'builder must be one of {BUILDERS}')
+        # the times a_k_i and b_k_i only exist with vi
+        self.time_windows = TimeWindows(graph, vehicles, tighten=tight_big_m) if vi else None
+
+        # number of constraints (19) added by the callback, on incumbents and on node relaxations
+        self.subtour_cuts = {'MIPSOL': 0, 'MIPNODE': 0}
+        self._lazy_at_nodes = lazy_at_nodes
+        self._z = None
+        self._z_shape = None
+        # number of rows added by the callback of separate_vi, by family
+        self.vi_cuts = {}
+
+        model = self.new_model('Rais')
         model.modelSense = gb.GRB.MINIMIZE
 
-        model.setParam('OutputFlag', 0)
         model.setParam('TimeLimit', 3600)
-
+        profiler = BuildProfiler(model, profile_build)
+
+        if builder == 'matrix':
+            self.variables = build_rais(model, graph, vehicles, requests, vi, subtours=not lazy_subtours,
+                                        separate_vi=separate_vi, windows=self.time_windows, profiler=profiler)
+            self.model = model
+            if symmetry_breaking:
+                add_symmetry_breaking(model, self.variables['x'], graph, vehicles, requests)
+                profiler.record('(S)')
+            if profile_build:
+                self.build_profile = profiler.report()
+            if lazy_subtours:
+                self._add_lazy_subtours(graph, vehicles)
+            if separate_vi:
+                self._add_separation(graph, vehicles, requests)
+            return
+
+        # e_k_i are not times but orders, which (22) compares between vehicles: their range has no time window to
+        # tighten, and a smaller M than |N| could leave no order to a feasible solution
         M = len(graph.nodes)
         transfer_stations = {t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION}
 
@@ -30,13 +104,14 @@ class Rais(AbstractModel):
         )
 
         # y_r_k_i_j = 1 if request r is transported by vehicle k through arc (i,j)
-        y = model.addVars(
+        # only created where r may travel, the missing y_r_k_i_j evaluate to 0
+        y = SparseTupledict(model.addVars(
             [(arc.src.index, arc.dst.index, k.index, r.index)
              for arc in graph.arcs
              for k in vehicles
-             for r in requests],
+             for r in requests if may_carry(arc, r)],
             lb=0, ub=1, vtype=gb.GRB.BINARY
-        )
+        ))
 
         # z_k_i_j = 1 if node i precedes node j for vehicle k
         z = model.addVars(
@@ -65,12 +140,14 @@ class Rais(AbstractModel):
             lb=0, ub=1, vtype=gb.GRB.BINARY
         )
 
+        profiler.record('variables')
         model.setObjective(
             gb.quicksum(
                 arc.cost * x[arc.src.index, arc.dst.index, k.index] * k.travel_unit_cost
                 for arc in graph.arcs
                 for k in vehicles)
         )
+        profiler.record('objective')
 
         # revised as (25)
         # (1) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, i = o(k)
@@ -78,7 +155,7 @@ class Rais(AbstractModel):
         #     model.addConstr(
         #         gb.quicksum(
         #             x[arc.src.index, arc.dst.index, k.index]
-        #             for arc in graph.arcs if arc.src == k.origin
+        #             for arc in graph.out_arcs(k.origin)
         #         )
         #         <= 1,
         #         '(1)'
@@ -89,14 +166,15 @@ class Rais(AbstractModel):
             model.addConstr(
                 gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == k.origin
+                    for arc in graph.out_arcs(k.origin)
                 )
                 == gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.dst == k.dest
+                    for arc in graph.in_arcs(k.dest)
                 ),
                 '(2)'
             )
+        profiler.record('(2)')
 
         # (3) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ N\{o(k), o′(k)}
         for k, i in product(vehicles, graph.nodes):
@@ -106,16 +184,17 @@ class Rais(AbstractModel):
                 #  ∑(i,j)∈A x_k_i_j
                 gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == i
+                    for arc in graph.out_arcs(i)
                 )
                 #  ∑(j,i)∈A x_k_i_j
                 - gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.dst == i
+                    for arc in graph.in_arcs(i)
                 )
                 == 0,
                 '(3)'
             )
+        profiler.record('(3)')
 
         # (4) ∑∈K ∑(i,j)∈A y_k_r_i_j = 1 ∀r ∈ R, i = p(r)
         for r in requests:
@@ -123,11 +202,12 @@ class Rais(AbstractModel):
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.src == r.pickup
+                    for arc in graph.out_arcs(r.pickup)
                 )
                 == 1,
                 '(4)'
             )
+        profiler.record('(4)')
 
         # (5) ∑∈K ∑(j,i)∈A y_k_r_j_i = 1 ∀r ∈ R, i = d(r)
         for r in requests:
@@ -135,11 +215,12 @@ class Rais(AbstractModel):
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.dst == r.destination
+                    for arc in graph.in_arcs(r.destination)
                 )
                 == 1,
                 '(5)'
             )
+        profiler.record('(5)')
 
         # (6) ∑k∈K ∑(i,j)∈A y_k_r_i_j − ∑k∈K ∑(j,i)∈A y_k_r_j_i = 0 ∀r ∈ R, ∀i ∈ T
         for r, i in product(requests, transfer_stations):
@@ -147,16 +228,17 @@ class Rais(AbstractModel):
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.src == i
+                    for arc in graph.out_arcs(i)
                 )
                 - gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.dst == i
+                    for arc in graph.in_arcs(i)
                 )
                 == 0,
                 '(6)'
             )
+        profiler.record('(6)')
 
         # Revised as (16)
         # (7) ∑(i,j)∈A y_k_r_i_j − ∑(j,i)∈A y_k_r_j_i = 0 ∀k ∈ K, ∀r ∈ R, ∀i ∈ N\T
@@ -164,11 +246,11 @@ class Rais(AbstractModel):
         #     model.addConstr(
         #         gb.quicksum(
         #             y[arc.src.index, arc.dst.index, k.index, r.index]
-        #             for arc in graph.arcs if arc.src == i
+        #             for arc in graph.out_arcs(i)
         #         )
         #         - gb.quicksum(
         #             y[arc.src.index, arc.dst.index, k.index, r.index]
-        #             for arc in graph.arcs if arc.dst == i
+        #             for arc in graph.in_arcs(i)
         #         )
         #         == 0,
         #         '(7)'
@@ -176,11 +258,14 @@ class Rais(AbstractModel):
 
         # (8) y_k_r_i_j ≤ x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K, ∀r ∈ R
         for arc, k, r in product(graph.arcs, vehicles, requests):
+            if not may_carry(arc, r):
+                continue
             model.addConstr(
                 y[arc.src.index, arc.dst.index, k.index, r.index]
                 <= x[arc.src.index, arc.dst.index, k.index],
                 '(8)'
             )
+        profiler.record('(8)')
 
         # (9) ∑r∈R q_r y_k_r_i_j ≤ u_k x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K
         for arc, k in product(graph.arcs, vehicles):
@@ -192,6 +277,7 @@ class Rais(AbstractModel):
                 <= k.capacity * x[arc.src.index, arc.dst.index, k.index],
                 '(9)'
             )
+        profiler.record('(9)')
 
         # Revised as (17)
         # (10) x_k_i_j ≤ z_k_i_j ∀i,j ∈ N, ∀k ∈ K, i != o(k), j != o′(k)
@@ -237,15 +323,16 @@ class Rais(AbstractModel):
             model.addConstr(
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.src == i
+                    for arc in graph.out_arcs(i)
                 )
                 - gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.dst == i
+                    for arc in graph.in_arcs(i)
                 )
                 == 0,
                 '(16)'
             )
+        profiler.record('(16)')
 
         # (17) x_k_i_j ≤ z_k_i_j ∀(i,j) ∈ A, ∀k ∈ K
         for arc, k in product(graph.arcs, vehicles):
@@ -253,6 +340,7 @@ class Rais(AbstractModel):
                 x[arc.src.index, arc.dst.index, k.index] <= z[arc.src.index, arc.dst.index, k.index],
                 '(17)'
             )
+        profiler.record('(17)')
 
         # (18) z_k_i_j + z_k_j_i = 1 ∀(i,j) ∈ A, ∀k ∈ K
         for arc, k in product(graph.arcs, vehicles):
@@ -262,11 +350,13 @@ class Rais(AbstractModel):
                 == 1,
                 '(18)'
             )
+        profiler.record('(18)')
 
         # (19) z_k_i_j + z_k_j_l + z_k_l_i ≤ 2 ∀i,j,l ∈ N, ∀k ∈ K, (i,j), (j,l), (l,i) ∈ A
+        # with lazy_subtours, (19) is separated by _separate_subtours
         for i, j, l, k in product(graph.nodes, graph.nodes, graph.nodes, vehicles):
             # continue if (i,j), (j,l), (l,i) NOT IN graph.arcs
-            if i == j or i == l or j == l:
+            if lazy_subtours or i == j or i == l or j == l:
                 continue
 
             model.addConstr(
@@ -276,6 +366,7 @@ class Rais(AbstractModel):
                 <= 2,
                 '(19)'
             )
+        profiler.record('(19)')
 
         # (20) e_k_i + 1 − e_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
         for arc, k in product(graph.arcs, vehicles):
@@ -284,6 +375,7 @@ class Rais(AbstractModel):
                 <= M * (1 - x[arc.src.index, arc.dst.index, k.index]),
                 '(20)'
             )
+        profiler.record('(20)')
 
         # (21) ∑(j,t)∈A y_k1_r_j_t + ∑(t,j)∈A y_k2_r_t_j ≤ s_k1_k2_t_r + 1 ∀r ∈ R, ∀t ∈ T , ∀k1 , k2 ∈ K, k1 != k2
         for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
@@ -293,15 +385,16 @@ class Rais(AbstractModel):
             model.addConstr(
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k1.index, r.index]
-                    for arc in graph.arcs if arc.dst == t
+                    for arc in graph.in_arcs(t)
                 )
                 + gb.quicksum(
                     y[arc.src.index, arc.dst.index, k2.index, r.index]
-                    for arc in graph.arcs if arc.src == t
+                    for arc in graph.out_arcs(t)
                 )
                 <= s[t.index, r.index, k1.index, k2.index] + 1,
                 '(21)'
             )
+        profiler.record('(21)')
 
         # (22) e_k1_t − e_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, ∀t ∈ T , ∀k1 , k2 ∈ K, k1 != k2
         for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
@@ -313,22 +406,22 @@ class Rais(AbstractModel):
                 <= M * (1 - s[t.index, r.index, k1.index, k2.index]),
                 '(22)'
             )
+        profiler.record('(22)')
 
         # (25) ∑(i,j)∈A x_k_i_j = 1 ∀k ∈ K, i = o(k)
         for k in vehicles:
             model.addConstr(
                 gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == k.origin
+                    for arc in graph.out_arcs(k.origin)
                 )
                 == 1,
                 '(25)'
             )
+        profiler.record('(25)')
 
         if vi:
             # If vi is True, add valid inequalities (40) to (51)
-            depot_nodes = {n for n in graph.nodes
-                           if n.type is NodeType.ORIGIN_DEPOT or n.type is NodeType.DESTINATION_DEPOT}
 
             # a_k_i represent the arrival time for vehicle k at location i
             a = model.addVars(
@@ -345,132 +438,121 @@ class Rais(AbstractModel):
                  for k in vehicles],
                 lb=0, ub=float('inf'), vtype=gb.GRB.CONTINUOUS
             )
+            profiler.record('variables')
 
-            # (40) ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, i = o(k)
-            for k in vehicles:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.dst == k.origin
-                    )
-                    == 0,
-                    '(40)'
-                )
-
-            # (41) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k)
-            for k, i in product(vehicles, depot_nodes):
-                if i == k.origin:
-                    continue
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == i
-                    )
-                    == 0,
-                    '(41)'
-                )
-
-            # (42) ∑(j,i)∈A x_k_j_i = 1 ∀k ∈ K, i = o'(k)
-            for k in vehicles:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.dst == k.dest
-                    )
-                    == 1,
-                    '(42)'
-                )
-
-            # (43) ∑(i,j)∈A x_k_j_i = 0 ∀k ∈ K, i = o'(k)
-            for k in vehicles:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == k.dest
-                    )
-                    == 0,
-                    '(43)'
-                )
-
-            # (44) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, ∀i ∈ T
-            for k, i in product(vehicles, transfer_stations):
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == i
-                    )
-                    <= 1,
-                    '(44)'
-                )
-
-            # (45) ∑(i,j)∈A ∑k∈K x_k_i_j = 1 ∀i ∈ P ∪ D
-            for i in graph.nodes - transfer_stations - depot_nodes:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == i
-                        for k in vehicles
-                    )
-                    == 1,
-                    '(45)'
-                )
+            # with separate_vi, (40) to (45) are added by the callback of _add_separation
+            if not separate_vi:
+                add_valid_inequalities(model, {'x': x, 'y': y, 's': s}, graph, vehicles, requests, profiler)
 
             # (46) ∑(i,j)∈A ∑k∈K y_k_r_i_j = 0 ∀r ∈ R, j = p(r)
-            for r in requests:
-                model.addConstr(
-                    gb.quicksum(
-                        y[arc.src.index, arc.dst.index, k.index, r.index]
-                        for arc in graph.arcs if arc.dst == r.pickup
-                        for k in vehicles
-                    )
-                    == 0,
-                    '(46)'
-                )
-
             # (47) ∑(i,j)∈A y_k_r_i_j = 0 ∀r ∈ R, ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k), i != o′ (k)
-            for r, k, i in product(requests, vehicles, depot_nodes):
-                if i == k.origin or i == k.dest:
-                    continue
-                model.addConstr(
-                    gb.quicksum(
-                        y[arc.src.index, arc.dst.index, k.index, r.index]
-                        for arc in graph.arcs if arc.src == i
-                    )
-                    == 0,
-                    '(47)'
-                )
+            # hold by construction: those y_k_r_i_j are not created, see may_carry
 
             # (48) a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, t ∈ T, k1,k2 ∈ K, k1 != k2
             for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
                 if k1 == k2:
                     continue
-                M = t.latest_time - t.earliest_time
+                M = self.time_windows.transfer_big_m(t, k1, k2)
                 model.addConstr(
                     a[t.index, k1.index] - b[t.index, k2.index]
                     <= M * (1 - s[t.index, r.index, k1.index, k2.index])
                 )
+            profiler.record('(48)')
 
             # (49) b_k_i + τ_k_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
             for arc, k in product(graph.arcs, vehicles):
-                M = max(0, arc.src.latest_time + arc.cost - arc.dst.earliest_time)
+                M = self.time_windows.arc_big_m(arc, k)
                 model.addConstr(
                     b[arc.src.index, k.index] + arc.cost - a[arc.dst.index, k.index]
                     <= M * (1 - x[arc.src.index, arc.dst.index, k.index])
                 )
+            profiler.record('(49)')
 
-            # (50) a_k_i ≥ Ei , bk_i ≤ Li ∀i ∈ N, ∀k ∈ K
+            # (50) a_k_i ≥ Ei , bk_i ≤ Li ∀i ∈ N, ∀k ∈ K, with the time windows of the vehicles
             for i, k in product(graph.nodes, vehicles):
                 model.addConstr(
-                    a[i.index, k.index] >= i.earliest_time
+                    a[i.index, k.index] >= self.time_windows.earliest[i.index, k.index]
                 )
                 model.addConstr(
-                    b[i.index, k.index] <= i.latest_time
+                    b[i.index, k.index] <= self.time_windows.latest[i.index, k.index]
                 )
+            profiler.record('(50)')
 
             # (51) a_k_i ≤ b_k_i ∀i ∈ N, ∀k ∈ K
             for i, k in product(graph.nodes, vehicles):
                 model.addConstr(
                     a[i.index, k.index] <= b[i.index, k.index]
                 )
+            profiler.record('(51)')
 
         self.model = model
+        self.variables = {'x': x, 'y': y, 'z': z, 'e': e, 's': s}
+        if vi:
+            self.variables.update(a=a, b=b)
+        if symmetry_breaking:
+            add_symmetry_breaking(model, x, graph, vehicles, requests)
+            profiler.record('(S)')
+        if profile_build:
+            self.build_profile = profiler.report()
+
+        if lazy_subtours:
+            self._add_lazy_subtours(graph, vehicles)
+        if separate_vi:
+            self._add_separation(graph, vehicles, requests)
+
+    def on_load(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], vi: bool = False, *,
+                builder: str = 'expr', lazy_subtours: bool = False, lazy_at_nodes: bool = False,
+                separate_vi: bool = False, symmetry_breaking: bool = False, tight_big_m: bool = True,
+                profile_build: bool = False) -> None:
+        self.time_windows = TimeWindows(graph, vehicles, tighten=tight_big_m) if vi else None
+        self.subtour_cuts = {'MIPSOL': 0, 'MIPNODE': 0}
+        self._lazy_at_nodes = lazy_at_nodes
+        self._z = None
+        self._z_shape = None
+        self.vi_cuts = {}
+        if lazy_subtours:
+            self._add_lazy_subtours(graph, vehicles)
+        if separate_vi:
+            self._add_separation(graph, vehicles, requests)
+
+    def _add_separation(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request]) -> None:
+        """
+        Enable the separation of the valid inequalities on the x, y and s variables of self.variables
+        """
+        separator = CutSeparator(self.model, self.variables, graph, vehicles, requests)
+        self.vi_cuts = separator.cuts
+        self.callbacks.append(separator.separate)
+
+    def _add_lazy_subtours(self, graph: Graph, vehicles: set[Vehicle]) -> None:
+        """
+        Enable the separation of constraints (19) on the z variables of self.variables
+        """
+        self.model.setParam('LazyConstraints', 1)
+        z = self.variables['z']
+        nodes = sorted(graph.nodes, key=lambda n: n.index)
+        vehicles = sorted(vehicles, key=lambda k: k.index)
+        # ordered by position of i, j (nodes sorted by index) and k (vehicles sorted by index)
+        self._z = [z[i.index, j.index, k.index] for i in nodes for j in nodes for k in vehicles]
+        self._z_shape = (len(nodes), len(nodes), len(vehicles))
+        self.callbacks.append(self._separate_subtours)
+
+    def _separate_subtours(self, model: gb.Model, where: int) -> None:
+        if where == gb.GRB.Callback.MIPSOL:
+            event, values = 'MIPSOL', model.cbGetSolution(self._z)
+        elif (where == gb.GRB.Callback.MIPNODE and self._lazy_at_nodes
+              and model.cbGet(gb.GRB.Callback.MIPNODE_STATUS) == gb.GRB.OPTIMAL):
+            event, values = 'MIPNODE', model.cbGetNodeRel(self._z)
+        else:
+            return
+
+        n_nodes, _, n_vehicles = self._z_shape
+        triangles = _violated_triangles(np.reshape(values, self._z_shape), 1e-6)
+        if event == 'MIPNODE':
+            triangles = triangles[:_MAX_NODE_SUBTOUR_CUTS]
+
+        def z(i, j, k):
+            return self._z[(i * n_nodes + j) * n_vehicles + k]
+
+        for i, j, l, k in triangles:
+            model.cbLazy(z(i, j, k) + z(j, l, k) + z(l, i, k) <= 2)
+        self.subtour_cuts[event] += len(triangles)
@@ -0,0 +1,212 @@
+from pathlib import Path
+from typing import Any, Optional
+
+import argparse
+import contextlib
+import json
+import sqlite3
+
+import pandas as pd
+
+
+_RESULTS_PATH = Path(__file__).resolve().parent.parent / 'results'
+DEFAULT_STORE_PATH = _RESULTS_PATH / 'results.sqlite'
+# statuses of runs that did not complete, and are run again when a campaign is resumed
+RETRY_STATUSES = ('ERROR',)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    problem TEXT NOT NULL,
+    instance TEXT NOT NULL,
+    model TEXT NOT NULL,
+    name TEXT NOT NULL,
+    vi INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    objective REAL NOT NULL,
+    gap REAL NOT NULL,
+    time REAL NOT NULL,
+    UNIQUE (problem, instance, model, name, vi, params)
+)
+"""
+
+
+_INSERT = 'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+
+def _row(problem: str, model: str, name: Optional[str], instance_name: str, result: tuple[str, float, float, float],
+         vi: bool, params: Optional[dict[str, Any]]) -> tuple:
+    status, objective, gap, runtime = result
+    return (problem.upper(), instance_name, model, _name(model, name, vi), int(vi), _params_key(params),
+            status, float(objective), float(gap), float(runtime))
+
+
+def _params_key(params: Optional[dict[str, Any]]) -> str:
+    """
+    Returns the canonical form of the parameters of a run, so that equal parameters give equal keys
+    """
+    return json.dumps(params or {}, sort_keys=True)
+
+
+def _name(model: str, name: Optional[str], vi: bool) -> str:
+    """
+    Returns the name of a run, by default its model suffixed with '_vi' if it had the valid inequalities
+    """
+    return name or (model + '_vi' if vi else model)
+
+
+def _split_name(name: str) -> tuple[str, bool]:
+    """
+    Returns the model and whether it had the valid inequalities from the name of a run, e.g. ('Rais', True) for
+    'Rais_vi_cuts'
+    """
+    model, *suffixes = name.split('[')[0].split('_')
+    return model, 'vi' in suffixes
+
+
+def _label(name: str, params: str, others: list[str]) -> str:
+    """
+    Returns the name of a run as exported: its name, followed by the parameters that set it apart from the other runs
+    with that name, if any, e.g. 'Lyu[time_limit=600]'. A parameter missing from a run, e.g. one imported from a CSV
+    file, sets nothing apart
+    :param params: parameters of the run, see _params_key
+    :param others: parameters of all the runs with that name
+    """
+    mine, theirs = json.loads(params), [json.loads(other) for other in set(others)]
+    differing = [key for key in sorted(mine) if len({json.dumps(run[key]) for run in theirs if key in run}) > 1]
+    if not differing:
+        return name
+    return name + '[' + ', '.join(f'{key}={mine[key]}' for key in differing) + ']'
+
+
+class ResultsStore:
+    """
+    Results of the computations in a SQLite database, one row per (problem, instance, model, name, vi, params). Any
+    number of processes can add results at the same time, adding a result again replaces the previous one.
+    The results of a problem can be exported to the CSV format of utils.log_result, see export_csv
+    """
+
+    def __init__(self, path: Path = DEFAULT_STORE_PATH):
+        """
+        :param path: database file, created if missing
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            # write-ahead logging lets readers and one writer work at the same time
+            connection.execute('PRAGMA journal_mode=WAL')
+            columns = [column for _, column, *_ in connection.execute('PRAGMA table_info(results)')]
+            if columns and 'name' not in columns:
+                # a store written before runs had a name: their name is their model, suffixed with '_vi' if vi
+                connection.execute('ALTER TABLE results RENAME TO results_unnamed')
+                connection.execute(_SCHEMA)
+                connection.execute(
+                    "INSERT INTO results SELECT problem, instance, model, "
+                    "model || CASE WHEN vi THEN '_vi' ELSE '' END, vi, params, status, objective, gap, time "
+                    "FROM results_unnamed ORDER BY rowid"
+                )
+                connection.execute('DROP TABLE results_unnamed')
+            connection.execute(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # wait for the other writers rather than failing with 'database is locked'
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            with connection:  # commits, or rolls back on error
+                yield connection
+        finally:
+            connection.close()
+
+    def add(self, problem: str, model: str, instance_name: str, result: tuple[str, float, float, float], *,
+            name: Optional[str] = None, vi: bool = False, params: Optional[dict[str, Any]] = None) -> None:
+        """
+        Add the result of a run, replacing the one with the same key if any
+        :param problem: problem solved, e.g. 'PDPT' or 'PDPTWT'. It names the exported CSV
+        :param model: model used: either 'Rais', 'Lyu', 'Sampaio' or 'Alns'
+        :param instance_name: name of solved instance, e.g. PDPT-R5-K2-T1-Q100-0.txt
+        :param result: a tuple of status, objective, gap and time
+        :param name: name of the configuration of the model, exported as Model, e.g. 'Rais_cuts' or 'Lyu_benders'.
+        Defaults to model, suffixed with '_vi' if vi
+        :param vi: True if the model had the valid inequalities
+        :param params: any other parameter that identifies the run, e.g. {'time_limit': 3600}
+        :return: nothing
+        """
+        with self._connect() as connection:
+            connection.execute(_INSERT, _row(problem, model, name, instance_name, result, vi, params))
+
+    def done(self, problem: str, model: str, *, name: Optional[str] = None, vi: bool = False,
+             params: Optional[dict[str, Any]] = None) -> set[str]:
+        """
+        Returns the instances already solved with the given key, to skip them when a campaign is resumed. Runs whose
+        status is in RETRY_STATUSES are not done
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                f'SELECT instance FROM results WHERE problem = ? AND model = ? AND name = ? AND vi = ? AND params = ? '
+                f'AND status NOT IN ({", ".join("?" * len(RETRY_STATUSES))})',
+                (problem.upper(), model, _name(model, name, vi), int(vi), _params_key(params), *RETRY_STATUSES)
+            ).fetchall()
+        return {instance for instance, in rows}
+
+    def to_dataframe(self, problem: str) -> pd.DataFrame:
+        """
+        Returns the results of a problem in the format of utils.log_result, in the order they were added.
+        The Model of a run is its name, e.g. 'Rais_vi', followed by the parameters that set it apart from the other runs
+        of that name if any, e.g. 'Lyu[time_limit=600]' and 'Lyu[time_limit=3600]', see _label
+        """
+        with self._connect() as connection:
+            df = pd.read_sql_query(
+                "SELECT instance AS Instance, status AS Status, objective AS Objective, gap AS Gap, time AS Time, "
+                "name, params FROM results WHERE problem = ? ORDER BY rowid",
+                connection, params=(problem.upper(),)
+            )
+        others = df.groupby('name')['params'].agg(list)
+        df['Model'] = [_label(name, params, others[name]) for name, params in zip(df['name'], df['params'])]
+        return df.drop(columns=['name', 'params'])
+
+    def export_csv(self, problem: str, path: Optional[Path] = None) -> Path:
+        """
+        Write the results of a problem to a CSV file, in the format read by analyses_utils.get_results_stats
+        :param problem: problem to export
+        :param path: file to write, results/{problem}.csv by default
+        :return: the path of the file written
+        """
+        path = Path(path) if path is not None else _RESULTS_PATH / f'{problem.upper()}.csv'
+        self.to_dataframe(problem).to_csv(path, index=False)
+        return path
+
+    def import_csv(self, path: Path, problem: Optional[str] = None) -> int:
+        """
+        Add the results of a CSV file written by utils.log_result, e.g. to move a past campaign into the store
+        :param path: file to read
+        :param problem: problem of the results, by default the name of the file, e.g. 'PDPT' for results/PDPT.csv
+        :return: number of results read
+        """
+        df = pd.read_csv(path, float_precision='round_trip')
+        problem = problem or Path(path).stem
+        rows = []
+        for row in df.itertuples(index=False):
+            model, vi = _split_name(row.Model)
+            rows.append(_row(problem, model, row.Model, row.Instance, (row.Status, row.Objective, row.Gap, row.Time),
+                             vi, None))
+        with self._connect() as connection:
+            connection.executemany(_INSERT, rows)
+        return len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move results between the results store and the CSV files')
+    parser.add_argument('action', choices=['import', 'export'],
+                        help='import: add CSV files to the store, export: write the CSV files of the store')
+    parser.add_argument('problems', type=str, nargs='+', help='problems, e.g. PDPT, i.e. files results/PDPT.csv')
+    parser.add_argument('--store', type=Path, default=DEFAULT_STORE_PATH, help='database file')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    for problem in args.problems:
+        if args.action == 'import':
+            n = store.import_csv(_RESULTS_PATH / f'{problem.upper()}.csv', problem)
+            print(f'{problem.upper()}: {n} results imported')
+        else:
+            print(f'{problem.upper()}: exported to {store.export_csv(problem)}')
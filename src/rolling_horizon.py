@@ -0,0 +1,342 @@
+from abstract_model import AbstractModel
+from compact_graph import CompactGraph, CompactInstance, distance_matrix, removable_arcs, to_instance_data
+from graph import Graph, Node, NodeType
+from heuristic import Solution
+from lyu import Lyu
+from request import Request
+from sampaio import Sampaio
+from utils import get_instance_data
+from vehicle import Vehicle
+
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, Optional
+
+import argparse
+import gurobipy as gb
+import math
+import time
+
+import numpy as np
+
+
+class RollingHorizon(AbstractModel):
+    """
+    Rolling-horizon decomposition: the requests are sliced into windows by latest pickup time and each window is solved
+    by a MILP model, e.g. Lyu or Sampaio, the later windows starting from the decisions taken in the earlier ones.
+    After a window is solved, each vehicle keeps its route up to the last node it reaches empty within the window; the
+    next window starts the vehicle from that node and time, and a request left at a transfer station by a kept route
+    becomes a request from that transfer station. The requests of a window not served by the kept routes, e.g. those of
+    the overlap, are solved again in the next window
+    """
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *,
+                 model: type[AbstractModel] = Lyu, window: float = 60, overlap: float = 0,
+                 time_limit: float = 3600, **options):
+        """
+        :param model: model solving each window, with the instance data it takes: Sampaio needs the data of
+        get_instance_data(..., sampaio=True)
+        :param window: length of the windows, in the unit of the time windows
+        :param overlap: the requests whose latest pickup time is within overlap from the end of the window are also
+        solved with the window, to anticipate them, but are only kept if served within the window
+        :param time_limit: seconds given to the model of each window
+        :param options: keyword arguments of the model, e.g. builder='matrix'
+        """
+        super().__init__()
+        if window <= 0 or overlap < 0:
+            raise ValueError('window must be positive and overlap non-negative')
+        self.graph, self.vehicles, self.requests = graph, vehicles, requests
+        self.model_class = model
+        self.window = window
+        self.overlap = overlap
+        self.time_limit = time_limit
+        self.options = options
+
+        # start, end, number of requests and of requests served, status, objective and runtime of each window solved
+        self.windows: list[dict[str, Any]] = []
+        self.solution: Optional[Solution] = None
+        self._status = 'LOADED'
+        self._objective = float('inf')
+        self._runtime = 0.0
+
+    def optimize(self) -> None:
+        start_time = time.perf_counter()
+        self.windows = []
+        vehicles = sorted(self.vehicles, key=lambda k: k.index)
+        state = _State(vehicles)
+        pending = sorted(self.requests, key=lambda r: (r.pickup.latest_time, r.index))
+        # requests left at a transfer station, with the time they are left there
+        in_transit: dict[Request, tuple[Node, float]] = {}
+
+        start = pending[0].pickup.latest_time if pending else 0
+        while pending or in_transit:
+            end = start + self.window
+            selected = [r for r in pending if r.pickup.latest_time < end + self.overlap]
+            last = len(selected) == len(pending)
+            if not selected and not in_transit:
+                start = pending[0].pickup.latest_time
+                continue
+
+            window = _Window(self.graph, vehicles, state, selected, in_transit)
+            model = self.model_class(window.graph, window.vehicles, window.requests, **self.options)
+            model.model.setParam('TimeLimit', self.time_limit)
+            window.restrict(model)
+            model.optimize()
+            record = {'start': start, 'end': end, 'requests': len(selected) + len(in_transit),
+                      'status': model.get_status(), 'runtime': model.model.Runtime}
+            self.windows.append(record)
+            if model.model.SolCount == 0:
+                # e.g. INFEASIBLE, or TIME_LIMIT without a solution: the rolling horizon stops there
+                record.update(served=0, objective=float('inf'))
+                self.solution, self._objective, self._status = None, float('inf'), model.get_status()
+                self._runtime = time.perf_counter() - start_time
+                return
+
+            served, in_transit = window.commit(model.get_solution(), state, math.inf if last else end)
+            record.update(served=len(served), objective=model.model.ObjVal)
+            pending = [r for r in pending if r not in served and r not in in_transit]
+            start = end
+
+        self.solution = state.solution()
+        self._objective = self.solution.cost
+        self._status = 'SUBOPTIMAL'
+        self._runtime = time.perf_counter() - start_time
+
+    def get_result(self) -> tuple[str, float, float, float]:
+        # no lower bound is known, hence the gap is infinite
+        return self.get_status(), round(self._objective, 7), float('inf'), self._runtime
+
+    def get_status(self):
+        return self._status
+
+    def get_solution(self, callback: bool = False) -> Solution:
+        return self.solution
+
+
+class _State:
+    """
+    Routes kept so far: where and when each vehicle is free again, and the legs of the requests
+    """
+
+    def __init__(self, vehicles: list[Vehicle]):
+        self.position = {k: k.origin for k in vehicles}
+        self.ready = {k: float(k.origin.earliest_time) for k in vehicles}
+        self.routes = {k: [k.origin] for k in vehicles}
+        self.loads: dict[Vehicle, list[float]] = {k: [] for k in vehicles}
+        self.arrival: dict[Vehicle, dict[Node, float]] = {k: {} for k in vehicles}
+        self.departure: dict[Vehicle, dict[Node, float]] = {k: {} for k in vehicles}
+        self.legs: dict[Request, list[tuple[Vehicle, Node, Node]]] = {}
+        self.cost = 0.0
+
+    def solution(self) -> Solution:
+        return Solution(self.routes, self.legs, self.arrival, self.departure, self.cost, self.loads)
+
+
+class _Window:
+    """
+    Instance solved by the model of a window: the origin depot of each vehicle is moved where the vehicle is free
+    again, with the time it is free as earliest time, and each request in transit gets a pickup node at its transfer
+    station. The nodes keep their index, the new pickup nodes are numbered after the nodes of the instance
+    """
+
+    def __init__(self, graph: Graph, vehicles: list[Vehicle], state: _State, requests: list[Request],
+                 in_transit: dict[Request, tuple[Node, float]]):
+        sampaio = all(k.origin == k.dest for k in vehicles)
+        transit = list(in_transit.items())
+        first_index = max(n.index for n in graph.nodes) + 1
+        stations = sorted((n for n in graph.nodes if n.type is NodeType.TRANSFER_STATION), key=lambda n: n.index)
+        depots = [k.origin for k in vehicles] + ([] if sampaio else [k.dest for k in vehicles])
+
+        nodes = (depots + stations + [r.pickup for r in requests] + [r.destination for r in requests]
+                 + [r.destination for r, _ in transit])
+        nodes = list(dict.fromkeys(nodes))
+        index = [n.index for n in nodes] + [first_index + p for p in range(len(transit))]
+        types = [n.type.value for n in nodes] + [NodeType.PICKUP.value] * len(transit)
+        coordinates = [n.coordinates for n in nodes] + [t.coordinates for _, (t, _) in transit]
+        # times are integer in the instances: the ready times are rounded up, which may only delay the vehicles
+        earliest = [n.earliest_time for n in nodes] + [math.ceil(ready - 1e-9) for _, (_, ready) in transit]
+        latest = [n.latest_time for n in nodes] + [r.destination.latest_time for r, _ in transit]
+        for p, k in enumerate(vehicles):
+            earliest[p] = math.ceil(state.ready[k] - 1e-9)
+
+        coordinates = np.array(coordinates, dtype=float)
+        cost = distance_matrix(coordinates)
+        # the vehicles leave their origin depot from where they are, Sampaio ones go back to the depot itself
+        cost[:len(vehicles)] = distance_matrix(np.concatenate([
+            np.array([state.position[k].coordinates for k in vehicles], dtype=float), coordinates
+        ]))[:len(vehicles), len(vehicles):]
+        np.fill_diagonal(cost, 0)
+
+        node_id = {n: i for i, n in enumerate(nodes)}
+        transit_id = np.arange(len(nodes), len(nodes) + len(transit), dtype=int)
+        request_pickup = np.array([node_id[r.pickup] for r in requests] + transit_id.tolist(), dtype=int)
+        request_delivery = np.array([node_id[r.destination] for r in requests + [r for r, _ in transit]], dtype=int)
+        compact = CompactGraph(
+            index=np.array(index), types=np.array(types, dtype='<U1'), coordinates=coordinates,
+            earliest_time=np.array(earliest, dtype=float), latest_time=np.array(latest, dtype=float), cost=cost,
+            adjacency=~np.eye(len(index), dtype=bool)
+        )
+        compact = replace(compact, adjacency=compact.adjacency & ~removable_arcs(compact, request_pickup,
+                                                                                 request_delivery, sampaio=sampaio))
+        vehicle_origin = np.arange(len(vehicles))
+        vehicle_dest = vehicle_origin if sampaio else np.array([node_id[k.dest] for k in vehicles], dtype=int)
+        instance = CompactInstance(compact, vehicle_origin, vehicle_dest, np.array([k.capacity for k in vehicles]),
+                                   request_pickup, request_delivery,
+                                   np.array([r.load for r in requests + [r for r, _ in transit]]),
+                                   np.array([k.travel_unit_cost for k in vehicles]))
+        self.graph, window_vehicles, window_requests = to_instance_data(instance)
+
+        # vehicles and requests of the window by index, with the vehicle or request of the instance they stand for
+        self.vehicle_of = {k.index: vehicles[k.index] for k in window_vehicles}
+        original = requests + [r for r, _ in transit]
+        self.request_of = {r.index: original[r.index] for r in window_requests}
+        self.vehicles = sorted(window_vehicles, key=lambda k: k.index)
+        self.requests = window_requests
+        self.node_of = {n.index: n for n in graph.nodes}
+        for p, (_, (t, _)) in enumerate(transit):
+            self.node_of[first_index + p] = t
+        self.cost = {(arc.src.index, arc.dst.index): arc.cost for arc in self.graph.arcs}
+        # Sampaio vehicles away from their depot, which must go back to it
+        self.away = {k for k in self.vehicles if sampaio and state.position[self.vehicle_of[k.index]] != k.origin}
+
+    def restrict(self, model: AbstractModel) -> None:
+        """
+        Fix to 0 the x_k_i_j of the arcs touching the depot of another vehicle: a moved origin depot is left from a
+        place other than the one it is reached at, which no other vehicle must go through. The Sampaio vehicles away
+        from their depot must leave it, i.e. go back
+        """
+        depots = {k.index: {k.origin.index, k.dest.index} for k in self.vehicles}
+        others = set().union(*depots.values())
+        x = model.variables['x']
+        model.model.update()
+        for (i, j, k), var in x.items():
+            if (i in others and i not in depots[k]) or (j in others and j not in depots[k]):
+                var.UB = 0
+        for k in self.away:
+            model.model.addConstr(
+                gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in self.graph.out_arcs(k.origin)) == 1
+            )
+
+    def commit(self, solution: Solution, state: _State,
+               until: float) -> tuple[set[Request], dict[Request, tuple[Node, float]]]:
+        """
+        Keep the routes of solution up to the last node each vehicle reaches empty by time until, all of them if until
+        is infinite, and update state accordingly
+        :return: the requests served by the routes kept, and those left at a transfer station with the time
+        """
+        routes = {k: solution.routes[k] for k in self.vehicles}
+        cut = {}
+        for k, route in routes.items():
+            if math.isinf(until):
+                cut[k] = len(route) - 1
+                continue
+            loads = solution.loads[k]
+            cut[k] = max(p for p in range(len(route) - 1)
+                         if p == 0 or (loads[p] == 0 and solution.arrival[k][route[p]] <= until))
+
+        # a request picked up at a transfer station by a route kept must have been left there by a route kept
+        changed = True
+        while changed:
+            changed = False
+            for legs in solution.legs.values():
+                for (k1, _, v1), (k2, u2, _) in zip(legs, legs[1:]):
+                    if not _kept(routes[k1], cut[k1], v1) and _kept(routes[k2], cut[k2], u2):
+                        position = routes[k2].index(u2)
+                        cut[k2] = max(p for p in range(position) if p == 0 or solution.loads[k2][p] == 0)
+                        changed = True
+
+        for k, route in routes.items():
+            vehicle = self.vehicle_of[k.index]
+            kept = route[:cut[k] + 1]
+            nodes = [state.position[vehicle]] + [self._original(n, vehicle) for n in kept[1:]]
+            loads = solution.loads[k][:cut[k]]
+            self.keep_route(state, vehicle, nodes, loads, kept, solution.arrival[k], solution.departure[k])
+
+        served, in_transit = set(), {}
+        for r, legs in solution.legs.items():
+            request = self.request_of[r.index]
+            done = [leg for leg in legs if _kept(routes[leg[0]], cut[leg[0]], leg[2])]
+            if done:
+                state.legs.setdefault(request, []).extend(
+                    (self.vehicle_of[k.index], self.node_of[u.index], self.node_of[v.index]) for k, u, v in done
+                )
+            if len(done) == len(legs):
+                served.add(request)
+            elif done:
+                k, _, t = done[-1]
+                in_transit[request] = (self.node_of[t.index], solution.arrival[k][t])
+        return served, in_transit
+
+    def keep_route(self, state: _State, vehicle: Vehicle, nodes: list[Node], loads: list[float], kept: list[Node],
+                   arrival: dict[Node, float], departure: dict[Node, float]) -> None:
+        """
+        Append the nodes of the instance visited by a vehicle, and the loads on their arcs, to the route kept so far
+        :param kept: the nodes of the window visited, whose costs and times are those of the solution
+        """
+        route, route_loads = state.routes[vehicle], state.loads[vehicle]
+        if len(kept) > 1:
+            # an unused Sampaio vehicle has route [o(k), o(k)], which is not an arc
+            cost = sum(self.cost.get((i.index, j.index), 0.0) for i, j in zip(kept, kept[1:]))
+            state.cost += cost * vehicle.travel_unit_cost
+        for p in range(1, len(nodes)):
+            state.arrival[vehicle][nodes[p]] = arrival[kept[p]]
+            state.departure[vehicle].setdefault(nodes[p - 1], departure.get(kept[p - 1], arrival[kept[p - 1]]))
+            if nodes[p] == route[-1] and nodes[p].type is NodeType.TRANSFER_STATION:
+                # the pickup of a request in transit is its transfer station
+                continue
+            route.append(nodes[p])
+            route_loads.append(loads[p - 1])
+        state.position[vehicle] = route[-1]
+        if len(kept) > 1:
+            state.ready[vehicle] = arrival[kept[-1]]
+
+    def _original(self, node: Node, vehicle: Vehicle) -> Node:
+        if node.type is NodeType.ORIGIN_DEPOT:  # only reached by Sampaio routes, back to the depot
+            return vehicle.origin
+        return self.node_of[node.index]
+
+
+def _kept(route: list[Node], cut: int, node: Node) -> bool:
+    """
+    Returns True if the route reaches node at or before position cut
+    """
+    return node in route[1:cut + 1]
+
+
+def compare(path: Path, model: type[AbstractModel], window: float, overlap: float, time_limit: float) -> None:
+    """
+    Solve an instance with the rolling horizon and with the model alone, print both results and their gap
+    """
+    g, v, r = get_instance_data(path, sampaio=model is Sampaio)
+
+    rolling = RollingHorizon(g, v, r, model=model, window=window, overlap=overlap, time_limit=time_limit)
+    rolling.optimize()
+    for w in rolling.windows:
+        print(f"  window [{w['start']:g}, {w['end']:g})\t{w['requests']} requests, {w['served']} served\t"
+              f"{w['status']}\t{w['objective']:.3f}\t{w['runtime']:.2f}s")
+    print(path.name, '\trolling horizon\t', rolling.get_result())
+
+    monolithic = model(g, v, r)
+    monolithic.model.setParam('TimeLimit', time_limit)
+    monolithic.optimize()
+    result = monolithic.get_result() if monolithic.model.SolCount else (monolithic.get_status(), float('inf'))
+    print(path.name, f'\t{model.__name__}\t', result)
+
+    best = result[1]
+    if math.isfinite(best) and math.isfinite(rolling.get_result()[1]) and best > 0:
+        print(f'gap {100 * (rolling.get_result()[1] - best) / best:.2f}%, '
+              f'time {rolling.get_result()[3]:.2f}s against {monolithic.model.Runtime:.2f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve an instance by rolling horizon and compare it with the '
+                                                 'monolithic model')
+    parser.add_argument('instance', type=Path, help='instance file, e.g. ../data/PDPTWT/5R4K4T/5R-4K-4T-180L-0.txt')
+    parser.add_argument('model', type=str, choices=['lyu', 'sampaio'], help='model solving each window')
+    parser.add_argument('--window', type=float, default=60, help='length of the windows')
+    parser.add_argument('--overlap', type=float, default=0, help='look-ahead of each window')
+    parser.add_argument('--time-limit', type=float, default=3600,
+                        help='seconds given to each window and to the monolithic model')
+    args = parser.parse_args()
+
+    compare(args.instance, Lyu if args.model == 'lyu' else Sampaio, args.window, args.overlap, args.time_limit)
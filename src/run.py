@@ -1,3 +1,9 @@
+from abstract_model import AbstractModel
+from aggregated import Aggregated
+from alns import Alns
+from branch_and_price import BranchAndPrice
+from build_profiler import format_report
+from heuristic import mip_start
 from rais import Rais
 from lyu import Lyu
 from sampaio import Sampaio
@@ -11,46 +17,138 @@ import os
 import re
 
 
-def lyu(path: Path) -> None:
+def _set_heuristic_start(model: AbstractModel, g, v, r) -> None:
+    """
+    Give the model the solution of the construction heuristic as MIP start, if it finds one
+    """
+    start = mip_start(g, v, r)
+    if start is None:
+        print('The heuristic found no MIP start')
+    else:
+        model.set_start(start)
+
+
+def lyu(path: Path, heuristic_start: bool = False, profile_build: bool = False, benders: bool = False) -> None:
     """
     Solve the instance found at path with Lyu model, print the result
     :param path: file containing the instance data
+    :param heuristic_start: set to True to start from the solution of the construction heuristic
+    :param profile_build: set to True to print the build time and size of each constraint family
+    :param benders: set to True to solve the request flow as a subproblem instead of within the model
     :return: Nothing
     """
     g, v, r = get_instance_data(path)
 
-    model = Lyu(g, v, r)
+    model = Lyu(g, v, r, benders=benders, profile_build=profile_build)
+    if profile_build:
+        print(format_report(model.build_profile))
+    if heuristic_start:
+        _set_heuristic_start(model, g, v, r)
     model.optimize()
 
     print(path.name, '\tLyu \t', model.get_result())
+    if benders:
+        print('Flow cuts:', model.flow_cuts)
 
 
-def sampaio(path: Path) -> None:
+def sampaio(path: Path, heuristic_start: bool = False, profile_build: bool = False, separate_vi: bool = False) -> None:
     """
     Solve the instance found at path with Sampaio model, print the result
     :param path: file containing the instance data
+    :param heuristic_start: set to True to start from the solution of the construction heuristic
+    :param profile_build: set to True to print the build time and size of each constraint family
+    :param separate_vi: set to True to add the violated valid inequalities and cuts from a callback
     :return: Nothing
     """
     g, v, r = get_instance_data(path, sampaio=True)
 
-    model = Sampaio(g, v, r)
+    model = Sampaio(g, v, r, separate_vi=separate_vi, profile_build=profile_build)
+    if profile_build:
+        print(format_report(model.build_profile))
+    if heuristic_start:
+        _set_heuristic_start(model, g, v, r)
     model.optimize()
 
     print(path.name, '\tSampaio\t', model.get_result())
+    if separate_vi:
+        print('Valid inequality cuts:', model.vi_cuts)
 
 
-def rais(path: Path) -> None:
+def rais(path: Path, lazy_subtours: bool = False, heuristic_start: bool = False, profile_build: bool = False,
+         separate_vi: bool = False) -> None:
     """
     Solve the instance found at path with Rais model, print the result
     :param path: file containing the instance data
+    :param lazy_subtours: set to True to separate constraints (19) in a callback instead of adding them up front
+    :param heuristic_start: set to True to start from the solution of the construction heuristic
+    :param profile_build: set to True to print the build time and size of each constraint family
+    :param separate_vi: set to True to add the violated valid inequalities and cuts from a callback
     :return: Nothing
     """
     g, v, r = get_instance_data(path)
 
-    model = Rais(g, v, r)
+    model = Rais(g, v, r, lazy_subtours=lazy_subtours, separate_vi=separate_vi, profile_build=profile_build)
+    if profile_build:
+        print(format_report(model.build_profile))
+    if heuristic_start:
+        _set_heuristic_start(model, g, v, r)
     model.optimize()
 
     print(path.name, '\tRais\t', model.get_result())
+    if lazy_subtours:
+        print('Subtour cuts:', model.subtour_cuts)
+    if separate_vi:
+        print('Valid inequality cuts:', model.vi_cuts)
+
+
+def alns(path: Path, time_limit: float = 10) -> None:
+    """
+    Solve the instance found at path with the ALNS metaheuristic, print the result
+    :param path: file containing the instance data
+    :param time_limit: seconds given to the search
+    :return: Nothing
+    """
+    g, v, r = get_instance_data(path)
+
+    model = Alns(g, v, r, time_limit=time_limit)
+    model.optimize()
+
+    print(path.name, '\tAlns\t', model.get_result())
+
+
+def bnp(path: Path, time_limit: float = 10) -> None:
+    """
+    Solve the instance found at path by branch and price, print the result
+    :param path: file containing the instance data
+    :param time_limit: seconds given to the search
+    :return: Nothing
+    """
+    g, v, r = get_instance_data(path)
+
+    model = BranchAndPrice(g, v, r, time_limit=time_limit)
+    model.optimize()
+
+    print(path.name, '\tBnp \t', model.get_result())
+
+
+def aggregated(path: Path, heuristic_start: bool = False, profile_build: bool = False) -> None:
+    """
+    Solve the instance found at path with the vehicle-aggregated model, print the result
+    :param path: file containing the instance data
+    :param heuristic_start: set to True to start from the solution of the construction heuristic
+    :param profile_build: set to True to print the build time and size of each constraint family
+    :return: Nothing
+    """
+    g, v, r = get_instance_data(path)
+
+    model = Aggregated(g, v, r, profile_build=profile_build)
+    if profile_build:
+        print(format_report(model.build_profile))
+    if heuristic_start:
+        _set_heuristic_start(model, g, v, r)
+    model.optimize()
+
+    print(path.name, '\tAggregated\t', model.get_result())
 
 
 def _get_path_prefix():
@@ -83,12 +181,25 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Quickly test an instance with the specified model')
     parser.add_argument('instance', type=str, help='Instance to run, e.g. PDPT-R5-K2-T1-Q100-6')
     parser.add_argument('model', type=str, help='Model to use')
+    parser.add_argument('--lazy-subtours', action='store_true',
+                        help='Rais only: add constraints (19) lazily from a callback')
+    parser.add_argument('--separate-vi', action='store_true',
+                        help='Rais and Sampaio only: add the violated valid inequalities and cuts from a callback')
+    parser.add_argument('--benders', action='store_true',
+                        help='Lyu only, experimental: check the request flow of each incumbent in a callback instead '
+                             'of modelling it, saving memory but solving much slower')
+    parser.add_argument('--mip-start', action='store_true',
+                        help='start from the solution of the cheapest insertion heuristic')
+    parser.add_argument('--profile-build', action='store_true',
+                        help='print the build time, size and presolved size of each constraint family')
+    parser.add_argument('--time-limit', type=float, default=10,
+                        help='Alns and Bnp only: seconds given to the search')
 
     args = parser.parse_args()
 
     model = args.model
-    if model.lower() not in ['lyu', 'sampaio', 'rais']:
-        print('Model must be either Rais, Lyu or Sampaio')
+    if model.lower() not in ['lyu', 'sampaio', 'rais', 'aggregated', 'alns', 'bnp']:
+        print('Model must be either Rais, Lyu, Sampaio, Aggregated, Alns or Bnp')
         exit(1)
 
     pdpt_instance = r'PDPT-R(\d+)-K(\d+)-T(\d+)-Q100-(\d+)'
@@ -113,12 +224,21 @@ if __name__ == '__main__':
 
     if model.lower() == 'rais' and 'PDPTWT' not in path.parts:
         print('Running...')
-        rais(path)
+        rais(path, args.lazy_subtours, args.mip_start, args.profile_build, args.separate_vi)
     elif model.lower() == 'sampaio' and 'PDPTWT' in path.parts:
         print('Running...')
-        sampaio(path)
+        sampaio(path, args.mip_start, args.profile_build, args.separate_vi)
     elif model.lower() == 'lyu':
         print('Running...')
-        lyu(path)
+        lyu(path, args.mip_start, args.profile_build, args.benders)
+    elif model.lower() == 'aggregated':
+        print('Running...')
+        aggregated(path, args.mip_start, args.profile_build)
+    elif model.lower() == 'alns':
+        print('Running...')
+        alns(path, args.time_limit)
+    elif model.lower() == 'bnp':
+        print('Running...')
+        bnp(path, args.time_limit)
     else:
         print(f'{model.title()} model cannot solve {instance}')
@@ -2,21 +2,59 @@ import gurobipy as gb
 
 from itertools import product
 
-from abstract_model import AbstractModel
+from abstract_model import AbstractModel, BUILDERS
+from build_profiler import BuildProfiler
 from graph import Graph, NodeType
+from matrix_builder import build_sampaio
 from request import Request
+from separation import CutSeparator, add_valid_inequalities
+from symmetry import add_symmetry_breaking
+from time_windows import TimeWindows
+from variables import SparseTupledict, may_carry
 from vehicle import Vehicle
 
 
 class Sampaio(AbstractModel):
 
-    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *, vi: bool = False):
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *, vi: bool = False,
+                 builder: str = 'expr', separate_vi: bool = False, symmetry_breaking: bool = False,
+                 tight_big_m: bool = True, profile_build: bool = False):
+        """
+        :param vi: set to True to add the valid inequalities (40) to (45)
+        :param builder: either 'expr' or 'matrix', see BUILDERS
+        :param separate_vi: set to True to add the valid inequalities (40) to (45), the transfer precedences and the
+        capacity covers from a callback when violated, see separation.CutSeparator, instead of (40) to (45) up front
+        :param symmetry_breaking: set to True to order the interchangeable vehicles, see symmetry.add_symmetry_breaking
+        :param tight_big_m: set to False to take the big-M of (28) and the bounds of (35) from the time windows of the
+        nodes instead of those of the vehicles, see TimeWindows, and the M of (31) from the last arc of (28)
+        :param profile_build: set to True to measure the build of each constraint family, see self.build_profile
+        """
         super().__init__()
-        model = gb.Model('Sampaio', env=gb.Env(params={'OutputFlag': 0}))
+        self.graph, self.vehicles, self.requests = graph, vehicles, requests
+        if builder not in BUILDERS:
+            raise ValueError(f'builder must be one of {BUILDERS}')
+        self.time_windows = TimeWindows(graph, vehicles, tighten=tight_big_m)
+        # number of rows added by the callback of separate_vi, by family
+        self.vi_cuts = {}
+
+        model = self.new_model('Sampaio')
         model.modelSense = gb.GRB.MINIMIZE
 
-        model.setParam('OutputFlag', 0)
         model.setParam('TimeLimit', 3600)
+        profiler = BuildProfiler(model, profile_build)
+
+        if builder == 'matrix':
+            self.variables = build_sampaio(model, graph, vehicles, requests, vi, separate_vi=separate_vi,
+                                           windows=self.time_windows if tight_big_m else None, profiler=profiler)
+            self.model = model
+            if symmetry_breaking:
+                add_symmetry_breaking(model, self.variables['x'], graph, vehicles, requests)
+                profiler.record('(S)')
+            if profile_build:
+                self.build_profile = profiler.report()
+            if separate_vi:
+                self._add_separation(graph, vehicles, requests)
+            return
 
         M = len(graph.nodes)
         transfer_stations = {t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION}
@@ -30,13 +68,14 @@ class Sampaio(AbstractModel):
         )
 
         # y_r_k_i_j = 1 if request r is transported by vehicle k through arc (i,j)
-        y = model.addVars(
+        # only created where r may travel, the missing y_r_k_i_j evaluate to 0
+        y = SparseTupledict(model.addVars(
             [(arc.src.index, arc.dst.index, k.index, r.index)
              for arc in graph.arcs
              for k in vehicles
-             for r in requests],
+             for r in requests if may_carry(arc, r)],
             lb=0, ub=1, vtype=gb.GRB.BINARY
-        )
+        ))
 
         # s_t_r_k1_k2
         s = model.addVars(
@@ -44,7 +83,7 @@ class Sampaio(AbstractModel):
              for t in transfer_stations
              for r in requests
              for k1 in vehicles
-             for k2 in vehicles],  # why not `if k2 != k1`
+             for k2 in vehicles if k2 != k1],  # s_k_k_t_r would only appear in redundant rows of (30) and (31)
             lb=0, ub=1, vtype=gb.GRB.BINARY
         )
 
@@ -64,23 +103,26 @@ class Sampaio(AbstractModel):
             lb=0, ub=float('inf'), vtype=gb.GRB.CONTINUOUS
         )
 
+        profiler.record('variables')
         model.setObjective(
             gb.quicksum(
                 arc.cost * x[arc.src.index, arc.dst.index, k.index] * k.travel_unit_cost
                 for arc in graph.arcs
                 for k in vehicles)
         )
+        profiler.record('objective')
 
         # (1) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, i = o(k)
         for k in vehicles:
             model.addConstr(
                 gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == k.origin
+                    for arc in graph.out_arcs(k.origin)
                 )
                 <= 1,
                 '(1)'
             )
+        profiler.record('(1)')
 
         # (4) ∑∈K ∑(i,j)∈A y_k_r_i_j = 1 ∀r ∈ R, i = p(r)
         for r in requests:
@@ -88,11 +130,12 @@ class Sampaio(AbstractModel):
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.src == r.pickup
+                    for arc in graph.out_arcs(r.pickup)
                 )
                 == 1,
                 '(4)'
             )
+        profiler.record('(4)')
 
         # (5) ∑∈K ∑(j,i)∈A y_k_r_j_i = 1 ∀r ∈ R, i = d(r)
         for r in requests:
@@ -100,11 +143,12 @@ class Sampaio(AbstractModel):
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.dst == r.destination
+                    for arc in graph.in_arcs(r.destination)
                 )
                 == 1,
                 '(5)'
             )
+        profiler.record('(5)')
 
         # (6) ∑k∈K ∑(i,j)∈A y_k_r_i_j − ∑k∈K ∑(j,i)∈A y_k_r_j_i = 0 ∀r ∈ R, ∀i ∈ T
         for r, i in product(requests, transfer_stations):
@@ -112,24 +156,28 @@ class Sampaio(AbstractModel):
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.src == i
+                    for arc in graph.out_arcs(i)
                 )
                 - gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
                     for k in vehicles
-                    for arc in graph.arcs if arc.dst == i
+                    for arc in graph.in_arcs(i)
                 )
                 == 0,
                 '(6)'
             )
+        profiler.record('(6)')
 
         # (8) y_k_r_i_j ≤ x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K, ∀r ∈ R
         for arc, k, r in product(graph.arcs, vehicles, requests):
+            if not may_carry(arc, r):
+                continue
             model.addConstr(
                 y[arc.src.index, arc.dst.index, k.index, r.index]
                 <= x[arc.src.index, arc.dst.index, k.index],
                 '(8)'
             )
+        profiler.record('(8)')
 
         # (16) ∑(i,j)∈A y_k_r_i_j − ∑(j,i)∈A y_k_r_j_i = 0 ∀k ∈ K, ∀r ∈ R, ∀i ∈ N\{T ∪ {p(r),d(r)}}
         for k, r, i in product(vehicles, requests, graph.nodes - transfer_stations):
@@ -138,15 +186,16 @@ class Sampaio(AbstractModel):
             model.addConstr(
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.src == i
+                    for arc in graph.out_arcs(i)
                 )
                 - gb.quicksum(
                     y[arc.src.index, arc.dst.index, k.index, r.index]
-                    for arc in graph.arcs if arc.dst == i
+                    for arc in graph.in_arcs(i)
                 )
                 == 0,
                 '(16)'
             )
+        profiler.record('(16)')
 
         # replaced with (34)
         # (26) ∑(i,j)∈A x_k_i_j = ∑(j,i)∈A x_k_j_i ∀k ∈ K, i = o(k)
@@ -154,11 +203,11 @@ class Sampaio(AbstractModel):
         #     model.addConstr(
         #         gb.quicksum(
         #             x[arc.src.index, arc.dst.index, k.index]
-        #             for arc in graph.arcs if arc.src == k.origin
+        #             for arc in graph.out_arcs(k.origin)
         #         )
         #         == gb.quicksum(
         #             x[arc.src.index, arc.dst.index, k.index]
-        #             for arc in graph.arcs if arc.dst == k.origin
+        #             for arc in graph.in_arcs(k.origin)
         #         ),
         #         '(26)'
         #     )
@@ -171,11 +220,11 @@ class Sampaio(AbstractModel):
         #     model.addConstr(
         #         gb.quicksum(
         #             x[arc.src.index, arc.dst.index, k.index]
-        #             for arc in graph.arcs if arc.src == i
+        #             for arc in graph.out_arcs(i)
         #         )
         #         - gb.quicksum(
         #             x[arc.src.index, arc.dst.index, k.index]
-        #             for arc in graph.arcs if arc.dst == i
+        #             for arc in graph.in_arcs(i)
         #         )
         #         == 0,
         #         '(27)'
@@ -183,12 +232,13 @@ class Sampaio(AbstractModel):
 
         # (28) b_k_i + τ_i_j − a_k_j ≤ M(1 − x_k_i_j) ∀(i,j) ∈ A, ∀k ∈ K
         for arc, k in product(graph.arcs, vehicles):
-            M = max(0, arc.src.latest_time + arc.cost - arc.dst.earliest_time)
+            M = self.time_windows.arc_big_m(arc, k)
             model.addConstr(
                 b[arc.src.index, k.index] + arc.cost - a[arc.dst.index, k.index]
                 <= M * (1 - x[arc.src.index, arc.dst.index, k.index]),
                 '(28)'
             )
+        profiler.record('(28)')
         # Sampaio about τ_i_j: "We consider a squared geographical area of 120 × 120 units of distance
         # and assume that one unit of distance can be traveled in one time unit (e.g., 60 km/h)"
 
@@ -207,34 +257,38 @@ class Sampaio(AbstractModel):
 
         # (30) ∑(j,t)∈A y_k1_r_j_t + ∑(t,j)∈A y_k2_r_t_j ≤ s_k1_k2_t_r + 1 ∀r ∈ R, t ∈ T, k1,k2 ∈ K
         for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
-            # if k1 == k2:
-            #     continue
-            # k1 = k2 is allowed in constraints (30). Although it does not have
-            # a significant effect on the solution quality, it is thought better to
-            # prohibit it just like in constraints (21)
+            # k1 = k2 is allowed in constraints (30), but setting s_k_k_t_r = 1 satisfies both (30) and (31)
+            # (a_k_t ≤ b_k_t by (36)), so those rows are dropped along with s_k_k_t_r, just like in constraints (21)
+            if k1 == k2:
+                continue
             model.addConstr(
                 gb.quicksum(
                     y[arc.src.index, arc.dst.index, k1.index, r.index]
-                    for arc in graph.arcs if arc.dst == t
+                    for arc in graph.in_arcs(t)
                 )
                 + gb.quicksum(
                     y[arc.src.index, arc.dst.index, k2.index, r.index]
-                    for arc in graph.arcs if arc.src == t
+                    for arc in graph.out_arcs(t)
                 )
                 <= s[t.index, r.index, k1.index, k2.index] + 1,
                 '(30)'
             )
+        profiler.record('(30)')
 
         # (31) a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) ∀r ∈ R, t ∈ T, k1,k2 ∈ K
+        # without tight_big_m, M is the one of the last arc of (28)
         for r, t, k1, k2 in product(requests, transfer_stations, vehicles, vehicles):
-            # if k1 == k2:
-            #     continue
+            if k1 == k2:
+                continue
+            if tight_big_m:
+                M = self.time_windows.transfer_big_m(t, k1, k2)
             model.addConstr(
                 a[t.index, k1.index]
                 - b[t.index, k2.index]
                 <= M * (1 - s[t.index, r.index, k1.index, k2.index]),
                 '(31)'
             )
+        profiler.record('(31)')
 
         # (34) ∑(i,j)∈A x_k_i_j − ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, ∀i ∈ N
         for k, i in product(vehicles, graph.nodes):
@@ -243,35 +297,39 @@ class Sampaio(AbstractModel):
             model.addConstr(
                 gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.src == i
+                    for arc in graph.out_arcs(i)
                 )
                 - gb.quicksum(
                     x[arc.src.index, arc.dst.index, k.index]
-                    for arc in graph.arcs if arc.dst == i
+                    for arc in graph.in_arcs(i)
                 )
                 == 0,
                 '(34)'
             )
+        profiler.record('(34)')
 
         # (35.1) Ei ≤ b_k_i ≤ Li ∀k ∈ K, ∀i ∈ N
         # (35.2) Ei ≤ a_k_i ≤ Li ∀k ∈ K, ∀i ∈ N
+        # with the time windows of the vehicles
         for k, i in product(vehicles, graph.nodes):
+            earliest, latest = self.time_windows.earliest[i.index, k.index], self.time_windows.latest[i.index, k.index]
             model.addConstr(
-                i.earliest_time <= b[i.index, k.index],
+                earliest <= b[i.index, k.index],
                 '(35.1.1)'
             )
             model.addConstr(
-                b[i.index, k.index] <= i.latest_time,
+                b[i.index, k.index] <= latest,
                 '(35.1.2)'
             )
             model.addConstr(
-                i.earliest_time <= a[i.index, k.index],
+                earliest <= a[i.index, k.index],
                 '(35.2.1)'
             )
             model.addConstr(
-                a[i.index, k.index] <= i.latest_time,
+                a[i.index, k.index] <= latest,
                 '(35.2.2)'
             )
+        profiler.record('(35)')
 
         # (36) b_k_i ≥ a_k_i ∀i ∈ N, ∀k ∈ K, i != o(k)
         for i, k in product(graph.nodes, vehicles):
@@ -281,126 +339,44 @@ class Sampaio(AbstractModel):
                 b[i.index, k.index] >= a[i.index, k.index],
                 '(36)'
             )
+        profiler.record('(36)')
 
         # (37) y_k_r_i_j = 0 ∀k ∈ K, ∀r ∈ R, ∀(i,j) ∈ A, i ∈ O
         # (38) y_k_r_i_j = 0 ∀k ∈ K, ∀r ∈ R, ∀(i,j) ∈ A, j ∈ O
-        for k, r, arc in product(vehicles, requests, graph.arcs):
-            if arc.src.type == NodeType.ORIGIN_DEPOT:
-                model.addConstr(
-                    y[arc.src.index, arc.dst.index, k.index, r.index] == 0,
-                    '(37)'
-                )
-            elif arc.dst.type == NodeType.ORIGIN_DEPOT:
-                model.addConstr(
-                    y[arc.src.index, arc.dst.index, k.index, r.index] == 0,
-                    '(38)'
-                )
-
         # (39) y_k_r_i_j = 0 ∀k ∈ K, ∀r ∈ R, ∀(i,j) ∈ A, j = p(r)
-        for k, r, arc in product(vehicles, requests, graph.arcs):
-            if arc.dst != r.pickup:
-                continue
-            model.addConstr(
-                y[arc.src.index, arc.dst.index, k.index, r.index] == 0,
-                '(39)'
-            )
+        # hold by construction: those y_k_r_i_j are not created, see may_carry
 
         self.model = model
+        self.variables = {'x': x, 'y': y, 's': s, 'a': a, 'b': b}
 
-        if vi:
-            depot_nodes = {n for n in graph.nodes
-                           if n.type is NodeType.ORIGIN_DEPOT or n.type is NodeType.DESTINATION_DEPOT}
-
-            # (40) ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, i = o(k)
-            for k in vehicles:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.dst == k.origin
-                    )
-                    == 0,
-                    '(40)'
-                )
-
-            # (41) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k)
-            for k, i in product(vehicles, depot_nodes):
-                if i == k.origin:
-                    continue
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == i
-                    )
-                    == 0,
-                    '(41)'
-                )
-
-            # (42) ∑(j,i)∈A x_k_j_i = 1 ∀k ∈ K, i = o'(k)
-            for k in vehicles:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.dst == k.dest
-                    )
-                    == 1,
-                    '(42)'
-                )
-
-            # (43) ∑(i,j)∈A x_k_j_i = 0 ∀k ∈ K, i = o'(k)
-            for k in vehicles:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == k.dest
-                    )
-                    == 0,
-                    '(43)'
-                )
-
-            # (44) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, ∀i ∈ T
-            for k, i in product(vehicles, transfer_stations):
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == i
-                    )
-                    <= 1,
-                    '(44)'
-                )
-
-            # (45) ∑(i,j)∈A ∑k∈K x_k_i_j = 1 ∀i ∈ P ∪ D
-            for i in graph.nodes - transfer_stations - depot_nodes:
-                model.addConstr(
-                    gb.quicksum(
-                        x[arc.src.index, arc.dst.index, k.index]
-                        for arc in graph.arcs if arc.src == i
-                        for k in vehicles
-                    )
-                    == 1,
-                    '(45)'
-                )
+        # with separate_vi, (40) to (45) are added by the callback of _add_separation
+        if vi and not separate_vi:
+            add_valid_inequalities(model, self.variables, graph, vehicles, requests, profiler)
 
             # (46) ∑(i,j)∈A ∑k∈K y_k_r_i_j = 0 ∀r ∈ R, j = p(r)
-            for r in requests:
-                model.addConstr(
-                    gb.quicksum(
-                        y[arc.src.index, arc.dst.index, k.index, r.index]
-                        for arc in graph.arcs if arc.dst == r.pickup
-                        for k in vehicles
-                    )
-                    == 0,
-                    '(46)'
-                )
-
             # (47) ∑(i,j)∈A y_k_r_i_j = 0 ∀r ∈ R, ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k), i != o′ (k)
-            for r, k, i in product(requests, vehicles, depot_nodes):
-                if i == k.origin or i == k.dest:
-                    continue
-                model.addConstr(
-                    gb.quicksum(
-                        y[arc.src.index, arc.dst.index, k.index, r.index]
-                        for arc in graph.arcs if arc.src == i
-                    )
-                    == 0,
-                    '(47)'
-                )
+            # hold by construction: those y_k_r_i_j are not created, see may_carry
+
+        if symmetry_breaking:
+            add_symmetry_breaking(model, x, graph, vehicles, requests)
+            profiler.record('(S)')
+        if profile_build:
+            self.build_profile = profiler.report()
+        if separate_vi:
+            self._add_separation(graph, vehicles, requests)
+
+    def on_load(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request], *, vi: bool = False,
+                builder: str = 'expr', separate_vi: bool = False, symmetry_breaking: bool = False,
+                tight_big_m: bool = True, profile_build: bool = False) -> None:
+        self.time_windows = TimeWindows(graph, vehicles, tighten=tight_big_m)
+        self.vi_cuts = {}
+        if separate_vi:
+            self._add_separation(graph, vehicles, requests)
+
+    def _add_separation(self, graph: Graph, vehicles: set[Vehicle], requests: set[Request]) -> None:
+        """
+        Enable the separation of the valid inequalities on the x, y and s variables of self.variables
+        """
+        separator = CutSeparator(self.model, self.variables, graph, vehicles, requests)
+        self.vi_cuts = separator.cuts
+        self.callbacks.append(separator.separate)
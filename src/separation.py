@@ -0,0 +1,207 @@
+import gurobipy as gb
+import numpy as np
+import scipy.sparse as sp
+
+from itertools import product
+from typing import Mapping, Optional
+
+from build_profiler import BuildProfiler
+from graph import Graph, NodeType
+from request import Request
+from vehicle import Vehicle
+
+
+# families separated by CutSeparator, in the order they are checked
+FAMILIES = ('(40)', '(41)', '(42)', '(43)', '(44)', '(45)', '(P)', '(C)')
+# valid inequalities on x, added up front by add_valid_inequalities when they are not separated
+VALID_INEQUALITIES = ('(40)', '(41)', '(42)', '(43)', '(44)', '(45)')
+_DEPOT_TYPES = (NodeType.ORIGIN_DEPOT, NodeType.DESTINATION_DEPOT)
+# most violated rows added at each node, the others waiting for the next round of the node
+_MAX_NODE_CUTS = 100
+_TOLERANCE = 1e-6
+
+
+class CutSeparator:
+    """
+    Adds the rows of some families to the model from a callback, only when the LP relaxation of a node or a new
+    incumbent violates them, instead of adding all of them up front:
+    - the valid inequalities (40) to (45), as lazy constraints since they cut integer solutions, e.g. those visiting a
+    transfer station twice;
+    - (P) transfer precedence, also lazy: vehicle k1 hands request r over to k2 at t only if r reaches t on k1 and
+    leaves it on k2
+    s_k1_k2_t_r ≤ ∑(j,t)∈A y_k1_r_j_t, s_k1_k2_t_r ≤ ∑(t,j)∈A y_k2_r_t_j
+    ∀r ∈ R, t ∈ T, k1,k2 ∈ K, k1 != k2;
+    - (C) capacity covers, as user cuts since every integer solution satisfies them: a set S of requests whose loads
+    exceed u_k never travels together on vehicle k
+    ∑r∈S y_k_r_i_j ≤ (|S| − 1) x_k_i_j ∀(i,j) ∈ A, ∀k ∈ K, ∀S ⊆ R, ∑r∈S q_r > u_k
+    """
+
+    def __init__(self, model: gb.Model, variables: Mapping[str, Mapping[tuple, gb.Var]], graph: Graph,
+                 vehicles: set[Vehicle], requests: set[Request], families: tuple[str, ...] = FAMILIES):
+        """
+        Set the parameters the callback needs: call separate from the callback of the model
+        :param variables: the x, y and s variables of the model, with the keys of Rais and Sampaio
+        :param families: families to separate, among FAMILIES
+        """
+        # the variables must be in the model to be hashed
+        model.update()
+        self.families = families
+        # rows added by the callback, by family
+        self.cuts = {family: 0 for family in families}
+        x, y, s = variables['x'], variables['y'], variables['s']
+
+        rows = [row for family in families if family != '(C)'
+                for row in _rows(family, x, y, s, graph, vehicles, requests)]
+        self._columns: dict[gb.Var, int] = {}
+        self._family = np.array([family for family, *_ in rows])
+        self._sense = np.array([sense for _, _, sense, _ in rows])
+        self._rhs = np.array([rhs for *_, rhs in rows], dtype=float)
+        self._terms = [terms for _, terms, _, _ in rows]
+        entries = [(row, self._column(var), coefficient)
+                   for row, terms in enumerate(self._terms) for var, coefficient in terms]
+
+        # (C): for each arc and vehicle whose requests may exceed its capacity, x_k_i_j and the y_k_r_i_j with q_r
+        self._covers = []
+        if '(C)' in families:
+            for arc, k in product(graph.arcs, vehicles):
+                carried = [(y.get((arc.src.index, arc.dst.index, k.index, r.index)), r.load) for r in requests]
+                carried = [(var, load) for var, load in carried if var is not None]
+                if sum(load for _, load in carried) > k.capacity:
+                    self._covers.append((self._column(x[arc.src.index, arc.dst.index, k.index]), k.capacity,
+                                         np.array([self._column(var) for var, _ in carried]),
+                                         np.array([load for _, load in carried], dtype=float)))
+        self._vars = list(self._columns)
+        row, column, coefficient = zip(*entries) if entries else ((), (), ())
+        self._matrix = sp.csr_matrix((coefficient, (row, column)), shape=(len(rows), len(self._vars)))
+
+        model.setParam('LazyConstraints', 1)
+        if self._covers:
+            # user cuts are expressed on the original variables
+            model.setParam('PreCrush', 1)
+
+    def _column(self, var: gb.Var) -> int:
+        return self._columns.setdefault(var, len(self._columns))
+
+    def separate(self, model: gb.Model, where: int) -> None:
+        if where == gb.GRB.Callback.MIPSOL:
+            self._add_violated(model, np.array(model.cbGetSolution(self._vars)), node=False)
+        elif (where == gb.GRB.Callback.MIPNODE
+              and model.cbGet(gb.GRB.Callback.MIPNODE_STATUS) == gb.GRB.OPTIMAL):
+            self._add_violated(model, np.array(model.cbGetNodeRel(self._vars)), node=True)
+
+    def _add_violated(self, model: gb.Model, values: np.ndarray, node: bool) -> None:
+        """
+        Add the rows violated by the values, the most violated first and at most _MAX_NODE_CUTS of them at a node
+        """
+        lhs = self._matrix @ values
+        violation = np.where(self._sense == '<', lhs - self._rhs,
+                             np.where(self._sense == '>', self._rhs - lhs, np.abs(lhs - self._rhs)))
+        violated = np.flatnonzero(violation > _TOLERANCE)
+        violated = violated[np.argsort(-violation[violated], kind='stable')]
+        if node:
+            violated = violated[:_MAX_NODE_CUTS]
+        for row in violated:
+            model.cbLazy(_constraint(self._terms[row], self._sense[row], self._rhs[row]))
+            self.cuts[self._family[row]] += 1
+
+        if not node:
+            return
+        added = len(violated)
+        for x, capacity, ys, loads in self._covers:
+            if added >= _MAX_NODE_CUTS:
+                break
+            cover = _cover(values[x], values[ys], loads, capacity)
+            if cover is not None:
+                model.cbCut(gb.quicksum(self._vars[ys[r]] for r in cover) <= (len(cover) - 1) * self._vars[x])
+                self.cuts['(C)'] += 1
+                added += 1
+
+
+def add_valid_inequalities(model: gb.Model, variables: Mapping[str, Mapping[tuple, gb.Var]], graph: Graph,
+                           vehicles: set[Vehicle], requests: set[Request],
+                           profiler: Optional[BuildProfiler] = None) -> None:
+    """
+    Add the valid inequalities (40) to (45) to the model up front, the same rows CutSeparator adds when violated
+    :param variables: the x, y and s variables of the model, with the keys of Rais and Sampaio
+    :param profiler: profiler recording each family, if any
+    """
+    x, y, s = variables['x'], variables['y'], variables['s']
+    for family in VALID_INEQUALITIES:
+        for _, terms, sense, rhs in _rows(family, x, y, s, graph, vehicles, requests):
+            model.addConstr(_constraint(terms, sense, rhs), family)
+        if profiler is not None:
+            profiler.record(family)
+
+
+def _cover(x: float, y: np.ndarray, loads: np.ndarray, capacity: float):
+    """
+    Returns the requests of a capacity cover violated by the values x of x_k_i_j and y of y_k_r_i_j, if the greedy
+    search finds one: the requests are taken by increasing (x − y_r) / q_r until their loads exceed the capacity, the
+    cover being violated if ∑r∈S (x − y_r) < x
+    """
+    if x <= _TOLERANCE:
+        return None
+    slack = np.maximum(0, x - y)
+    order = np.argsort(slack / loads, kind='stable')
+    size = int(np.searchsorted(np.cumsum(loads[order]), capacity, side='right')) + 1
+    cover = order[:size]
+    if size > len(order) or slack[cover].sum() >= x - _TOLERANCE:
+        return None
+    return cover
+
+
+def _constraint(terms: list[tuple[gb.Var, float]], sense: str, rhs: float) -> gb.TempConstr:
+    lhs = gb.LinExpr([coefficient for _, coefficient in terms], [var for var, _ in terms])
+    if sense == '<':
+        return lhs <= rhs
+    if sense == '>':
+        return lhs >= rhs
+    return lhs == rhs
+
+
+def _rows(family: str, x, y, s, graph: Graph, vehicles: set[Vehicle], requests: set[Request]) -> list[tuple]:
+    """
+    Returns the rows of a family as tuples (family, terms, sense, rhs), terms being a list of (variable, coefficient)
+    """
+    transfer_stations = [t for t in graph.nodes if t.type is NodeType.TRANSFER_STATION]
+    # (40), (42) and (43) only hold for the vehicles whose routes end at a destination depot, not back at o(k) like
+    # those of the instances read for Sampaio
+    with_dest = [k for k in vehicles if k.dest != k.origin]
+
+    def arcs_of(arcs, k):
+        return [(x[arc.src.index, arc.dst.index, k.index], 1) for arc in arcs]
+
+    def carried(arcs, k, r):
+        keys = ((arc.src.index, arc.dst.index, k.index, r.index) for arc in arcs)
+        return [(y.get(key), -1) for key in keys if y.get(key) is not None]
+
+    if family == '(40)':
+        # (40) ∑(j,i)∈A x_k_j_i = 0 ∀k ∈ K, i = o(k)
+        return [(family, arcs_of(graph.in_arcs(k.origin), k), '=', 0) for k in with_dest]
+    if family == '(41)':
+        # (41) ∑(i,j)∈A x_k_i_j = 0 ∀k ∈ K, ∀i ∈ O ∪ O′, i != o(k)
+        return [(family, arcs_of(graph.out_arcs(i), k), '=', 0)
+                for k, i in product(vehicles, graph.nodes) if i.type in _DEPOT_TYPES and i != k.origin]
+    if family == '(42)':
+        # (42) ∑(j,i)∈A x_k_j_i = 1 ∀k ∈ K, i = o'(k)
+        return [(family, arcs_of(graph.in_arcs(k.dest), k), '=', 1) for k in with_dest]
+    if family == '(43)':
+        # (43) ∑(i,j)∈A x_k_j_i = 0 ∀k ∈ K, i = o'(k)
+        return [(family, arcs_of(graph.out_arcs(k.dest), k), '=', 0) for k in with_dest]
+    if family == '(44)':
+        # (44) ∑(i,j)∈A x_k_i_j ≤ 1 ∀k ∈ K, ∀i ∈ T
+        return [(family, arcs_of(graph.out_arcs(t), k), '<', 1) for k, t in product(vehicles, transfer_stations)]
+    if family == '(45)':
+        # (45) ∑(i,j)∈A ∑k∈K x_k_i_j = 1 ∀i ∈ P ∪ D
+        return [(family, [term for k in vehicles for term in arcs_of(graph.out_arcs(i), k)], '=', 1)
+                for i in graph.nodes if i.type in (NodeType.PICKUP, NodeType.DELIVERY)]
+    if family == '(P)':
+        # (P) s_k1_k2_t_r − ∑(j,t)∈A y_k1_r_j_t ≤ 0, s_k1_k2_t_r − ∑(t,j)∈A y_k2_r_t_j ≤ 0
+        rows = []
+        for t, r, k1, k2 in product(transfer_stations, requests, vehicles, vehicles):
+            if k1 != k2:
+                transfer = (s[t.index, r.index, k1.index, k2.index], 1)
+                rows.append((family, [transfer] + carried(graph.in_arcs(t), k1, r), '<', 0))
+                rows.append((family, [transfer] + carried(graph.out_arcs(t), k2, r), '<', 0))
+        return rows
+    raise ValueError(f'unknown family {family}')
@@ -0,0 +1,135 @@
+from graph import Graph
+from heuristic import Solution
+from request import Request
+from vehicle import Vehicle
+
+from typing import Any, Mapping, Optional
+
+import gurobipy as gb
+import numpy as np
+
+
+# variables read to decode a solution, with the length of their keys: routes, itineraries of the requests and times,
+# the latter missing in Rais
+_DECODED = {'x': 3, 'y': 4, 'a': 2, 'b': 2}
+
+
+class SolutionDecoder:
+    """
+    Turns the values of the x, y, a and b variables of a model into a Solution. The variables are read with a single
+    call to Gurobi, so that a solution can be decoded at every incumbent found, see decode
+    """
+
+    def __init__(self, variables: dict[str, Mapping[tuple, gb.Var]], graph: Graph, vehicles: set[Vehicle],
+                 requests: set[Request]):
+        """
+        :param variables: variables of the model by name, see AbstractModel.variables
+        """
+        self.nodes = {n.index: n for n in graph.nodes}
+        self.vehicles = {k.index: k for k in sorted(vehicles, key=lambda k: k.index)}
+        self.requests = {r.index: r for r in requests}
+        self.cost = {(arc.src.index, arc.dst.index): arc.cost for arc in graph.arcs}
+
+        self.names = [name for name in _DECODED if name in variables]
+        self.keys: dict[str, np.ndarray] = {}
+        self.vars: list[gb.Var] = []
+        # position of the first variable of each name in self.vars
+        self.offsets = [0]
+        for name in self.names:
+            # reshaped so that a model without requests, hence without y, decodes too
+            self.keys[name] = np.array(list(variables[name].keys()), dtype=int).reshape(-1, _DECODED[name])
+            self.vars += variables[name].values()
+            self.offsets.append(len(self.vars))
+
+    def values(self, model: gb.Model, callback: bool = False) -> dict[str, np.ndarray]:
+        """
+        Returns the values of the variables of each name, in the order of self.keys
+        :param callback: set to True in a MIPSOL callback to read the new incumbent instead of the current solution
+        """
+        values = np.array(model.cbGetSolution(self.vars) if callback else model.getAttr('X', self.vars))
+        return {name: values[self.offsets[p]:self.offsets[p + 1]] for p, name in enumerate(self.names)}
+
+    def decode(self, model: gb.Model, callback: bool = False, flow: Optional[list[tuple]] = None) -> Solution:
+        """
+        Returns the solution of the model, see values
+        :param flow: the keys (i, j, k, r) of the y variables equal to 1, for a model without y, see Lyu benders mode
+        """
+        values = self.values(model, callback)
+        x = self.keys['x'][values['x'] > 0.5]
+        y = np.array(flow, dtype=int).reshape(-1, 4) if flow is not None else self.keys['y'][values['y'] > 0.5]
+
+        routes, loads = {}, {}
+        for vehicle in self.vehicles.values():
+            arcs = x[x[:, 2] == vehicle.index]
+            route = _follow(dict(zip(arcs[:, 0].tolist(), arcs[:, 1].tolist())), vehicle.origin.index)
+            if len(route) == 1:
+                route.append(vehicle.dest.index)
+            routes[vehicle] = route
+
+        legs = {r: [] for r in self.requests.values()}
+        for r_index in np.unique(y[:, 3]).tolist():
+            r = self.requests[r_index]
+            for k, u, v in _itinerary(y[y[:, 3] == r_index], r.pickup.index, r.destination.index):
+                legs[r].append((self.vehicles[k], self.nodes[u], self.nodes[v]))
+                route = routes[self.vehicles[k]]
+                vehicle_loads = loads.setdefault(self.vehicles[k], [0.0] * (len(route) - 1))
+                start = route.index(u)
+                for p in range(start, route.index(v, start)):
+                    vehicle_loads[p] += float(r.load)
+
+        arrival, departure = {}, {}
+        for name, times in (('a', arrival), ('b', departure)):
+            if name not in values:
+                continue
+            value = dict(zip(map(tuple, self.keys[name].tolist()), values[name].tolist()))
+            for vehicle, route in routes.items():
+                times[vehicle] = {self.nodes[i]: value[i, vehicle.index] for i in route}
+
+        cost = 0.0
+        for vehicle, route in routes.items():
+            if len(route) > 2 or route[0] != route[-1]:
+                cost += sum(self.cost[i, j] for i, j in zip(route, route[1:])) * vehicle.travel_unit_cost
+            loads.setdefault(vehicle, [0.0] * (len(route) - 1))
+
+        return Solution({k: [self.nodes[i] for i in route] for k, route in routes.items()}, legs, arrival, departure,
+                        cost, loads)
+
+
+def _follow(successor: dict[int, int], start: int) -> list[int]:
+    """
+    Returns the nodes visited from start, one successor after the other, until a node without successor or start
+    """
+    route = [start]
+    while route[-1] in successor:
+        node = successor.pop(route[-1])
+        route.append(node)
+        if node == start:  # back to the origin depot, as in Sampaio
+            break
+    return route
+
+
+def _itinerary(arcs: np.ndarray, pickup: int, delivery: int) -> list[tuple[int, int, int]]:
+    """
+    Returns the legs (k, u, v) of a request, vehicle k carrying it from u to v, from the arcs (i, j, k, r) it travels
+    """
+    out: dict[int, list[tuple[int, int]]] = {}
+    for i, j, k, _ in arcs.tolist():
+        out.setdefault(i, []).append((j, k))
+
+    legs: list[list[Any]] = []
+    node = pickup
+    for _ in range(len(arcs)):
+        if node == delivery or node not in out:
+            break
+        nexts = out[node]
+        # stay on the same vehicle unless it leaves the request at node
+        p = next((p for p, (_, k) in enumerate(nexts) if legs and k == legs[-1][0]), 0)
+        j, k = nexts.pop(p)
+        if not nexts:
+            del out[node]
+        if legs and legs[-1][0] == k and legs[-1][2] == node:
+            legs[-1][2] = j
+        else:
+            legs.append([k, node, j])
+        node = j
+    return [tuple(leg) for leg in legs]
@@ -0,0 +1,55 @@
+from graph import Graph, Node, NodeType
+from request import Request
+from vehicle import Vehicle
+
+from typing import Mapping
+
+import gurobipy as gb
+
+
+_DEPOT_TYPES = (NodeType.ORIGIN_DEPOT, NodeType.DESTINATION_DEPOT)
+
+
+def interchangeable_vehicles(graph: Graph, vehicles: set[Vehicle]) -> list[list[Vehicle]]:
+    """
+    Returns the classes of vehicles that every solution can swap with each other: same capacity and travel unit cost,
+    origin and destination depots at the same place with the same time windows, and the same arcs to and from the other
+    nodes. Only the classes of two or more vehicles are returned, each sorted by index
+    """
+    classes: dict[tuple, list[Vehicle]] = {}
+    for k in sorted(vehicles, key=lambda k: k.index):
+        leaving = {(arc.dst.index, arc.cost) for arc in graph.out_arcs(k.origin) if arc.dst.type not in _DEPOT_TYPES}
+        entering = {(arc.src.index, arc.cost) for arc in graph.in_arcs(k.dest) if arc.src.type not in _DEPOT_TYPES}
+        key = (k.capacity, k.travel_unit_cost, _place(k.origin), _place(k.dest),
+               frozenset(leaving), frozenset(entering))
+        classes.setdefault(key, []).append(k)
+    return [vehicle_class for vehicle_class in classes.values() if len(vehicle_class) > 1]
+
+
+def add_symmetry_breaking(model: gb.Model, x: Mapping[tuple, gb.Var], graph: Graph, vehicles: set[Vehicle],
+                          requests: set[Request]) -> list[gb.Constr]:
+    """
+    Order the vehicles of each class of interchangeable_vehicles by the first pickup they visit, the pickups being
+    sorted by index, the vehicles visiting no pickup last: the next vehicle k2 of a class after k1 visits a pickup p
+    only if k1 visits a pickup before p
+    (S) ∑(p,j)∈A x_k2_p_j ≤ ∑p'∈P, p' < p ∑(p',j)∈A x_k1_p'_j ∀p ∈ P, ∀k1, k2 consecutive in a class
+    :param x: the x_k_i_j variables of the model, x[i, j, k] = 1 if vehicle k travels through arc (i,j)
+    :return: the constraints added, none if no two vehicles are interchangeable
+    """
+    pickups = sorted((r.pickup for r in requests), key=lambda p: p.index)
+
+    def visits(k: Vehicle, p: Node) -> gb.LinExpr:
+        return gb.quicksum(x[arc.src.index, arc.dst.index, k.index] for arc in graph.out_arcs(p))
+
+    constraints = []
+    for vehicle_class in interchangeable_vehicles(graph, vehicles):
+        for k1, k2 in zip(vehicle_class, vehicle_class[1:]):
+            for position, p in enumerate(pickups):
+                constraints.append(model.addConstr(
+                    visits(k2, p) <= gb.quicksum(visits(k1, q) for q in pickups[:position]), '(S)'
+                ))
+    return constraints
+
+
+def _place(node: Node) -> tuple:
+    return node.coordinates, node.earliest_time, node.latest_time
@@ -0,0 +1,89 @@
+from graph import Arc, Graph, Node
+from vehicle import Vehicle
+
+from typing import Iterable
+
+import heapq
+import math
+
+
+class TimeWindows:
+    """
+    Time windows of each vehicle at each node: vehicle k cannot arrive at node i before the earliest time it can reach
+    i from o(k), nor leave i later than it can and still reach its depots, following the shortest paths that respect
+    the time windows of the nodes. The windows bound the a_k_i and b_k_i variables of the models, and give the big-M of
+    their time constraints. A node that vehicle k cannot visit in time keeps its own time window [Ei, Li]
+    """
+
+    def __init__(self, graph: Graph, vehicles: set[Vehicle], tighten: bool = True):
+        """
+        :param tighten: set to False to keep the time windows of the nodes, giving the big-M of the original models
+        """
+        # earliest[i, k] ≤ a_k_i ≤ b_k_i ≤ latest[i, k], keyed by Node.index and Vehicle.index
+        self.earliest: dict[tuple[int, int], float] = {}
+        self.latest: dict[tuple[int, int], float] = {}
+        for k in vehicles:
+            earliest = _earliest_arrivals(graph, k.origin) if tighten else {}
+            latest = _latest_departures(graph, (k.origin, k.dest)) if tighten else {}
+            for i in graph.nodes:
+                window = earliest.get(i, math.inf), latest.get(i, -math.inf)
+                if window[0] > window[1]:
+                    window = i.earliest_time, i.latest_time
+                self.earliest[i.index, k.index], self.latest[i.index, k.index] = window
+
+    def arc_big_m(self, arc: Arc, k: Vehicle) -> float:
+        """
+        Returns the smallest M of b_k_i + τ_i_j − a_k_j ≤ M(1 − x_k_i_j) that every a_k_j and b_k_i within the
+        windows satisfy when x_k_i_j = 0
+        """
+        return max(0, self.latest[arc.src.index, k.index] + arc.cost - self.earliest[arc.dst.index, k.index])
+
+    def transfer_big_m(self, t: Node, k1: Vehicle, k2: Vehicle) -> float:
+        """
+        Returns the smallest M of a_k1_t − b_k2_t ≤ M(1 − s_k1_k2_t_r) that every a_k1_t and b_k2_t within the
+        windows satisfy when s_k1_k2_t_r = 0
+        """
+        return max(0, self.latest[t.index, k1.index] - self.earliest[t.index, k2.index])
+
+
+def _earliest_arrivals(graph: Graph, origin: Node) -> dict[Node, float]:
+    """
+    Returns the earliest arrival time at each node reachable in time from origin: a_j ≥ max(Ej, a_i + τ_i_j) along
+    the path, a node not being left if it is reached after its latest time
+    """
+    arrival = {origin: origin.earliest_time}
+    heap = [(origin.earliest_time, origin.index, origin)]
+    while heap:
+        time, _, i = heapq.heappop(heap)
+        if time > arrival[i] or time > i.latest_time:
+            continue
+        for arc in graph.out_arcs(i):
+            j = arc.dst
+            reached = max(j.earliest_time, time + arc.cost)
+            if reached < arrival.get(j, math.inf):
+                arrival[j] = reached
+                heapq.heappush(heap, (reached, j.index, j))
+    return arrival
+
+
+def _latest_departures(graph: Graph, depots: Iterable[Node]) -> dict[Node, float]:
+    """
+    Returns the latest departure time from each node that can reach one of the depots in time: b_i ≤ min(Li, b_j −
+    τ_i_j) along the path, the depots being left at their latest time, a node not being reached if it is left before
+    its earliest time
+    """
+    departure = {depot: depot.latest_time for depot in depots}
+    heap = [(-time, j.index, j) for j, time in departure.items()]
+    heapq.heapify(heap)
+    while heap:
+        time, _, j = heapq.heappop(heap)
+        time = -time
+        if time < departure[j] or time < j.earliest_time:
+            continue
+        for arc in graph.in_arcs(j):
+            i = arc.src
+            left = min(i.latest_time, time - arc.cost)
+            if left > departure.get(i, -math.inf):
+                departure[i] = left
+                heapq.heappush(heap, (-left, i.index, i))
+    return departure
@@ -1,10 +1,6 @@
-from itertools import product
-
+from compact_graph import read_compact_instance, to_instance_data
 from request import Request
 from vehicle import Vehicle
-from graph import NodeType
-from graph import Node
-from graph import Arc
 from graph import Graph
 
 from math import floor, ceil
@@ -19,82 +15,18 @@ PDPTWT_PAPER_RESULTS_PATH = '../data/Results/Results-PDPTWT.txt'
 PDPT_VEHICLES_PAPER_RESULTS_PATH = '../data/Results/Results-PDPT-vehicle.txt'
 
 
-def _get_euclidean_distance(node1: Node, node2: Node) -> float:
-    """
-    Returns the Euclidean distance between two nodes
-    """
-    x1, y1 = node1.coordinates
-    x2, y2 = node2.coordinates
-    return ((x2 - x1)**2 + (y2 - y1)**2) ** 0.5
-
-
-def get_instance_data(filepath: Path, *, sampaio: bool = False) -> tuple[Graph, set[Vehicle], set[Request]]:
+def get_instance_data(filepath: Path, *, sampaio: bool = False,
+                      prune: bool = True) -> tuple[Graph, set[Vehicle], set[Request]]:
     """
     Returns the data required to initialize a model
     :param filepath: Path of the .txt file containing the instance's parameters
     :param sampaio: Set to true to obtain the instance data for the Sampaio model (for each vehicle, the origin depot
     coincides with the destination depot)
+    :param prune: Set to false to keep the complete graph instead of removing the arcs that cannot be used, see
+    compact_graph.removable_arcs; the number of removed arcs is stored in Graph.removed_arcs
     :return: a tuple containing the graph, the set of vehicles and the set of requests
     """
-    requests = set()
-    nodes = set()
-    vehicles = set()
-    arcs = set()
-
-    with open(filepath, 'r') as f:
-        params_names = f.readline().replace('\n', '').split('\t')
-        params_values = f.readline().replace('\n', '').split('\t')
-        params = dict(zip(params_names, params_values))
-        f.readline()  # skip blank line
-        instance_data = f.readline().replace('\n', '').split('\t')
-        n_nodes = 2 * int(params['nr']) + 2 * int(params['nv']) + int(params['nt'])
-
-        pickup_nodes = dict()
-        origin_depot_nodes = dict()
-        i_requests = 0
-        i_vehicles = 0
-
-        for i in range(n_nodes):
-            line_data = f.readline().replace('\n', '').split('\t')
-            node_data = dict(zip(instance_data, line_data))
-
-            node_type = NodeType(node_data['node'][0])
-            coords = (int(node_data['x']), int(node_data['y']))
-            earliest_time = int(node_data['a'])
-            latest_time = int(node_data['b'])
-
-            if sampaio and node_type == NodeType.DESTINATION_DEPOT:
-                continue
-
-            node = Node(i, node_type, coords, earliest_time, latest_time)
-            nodes.add(node)
-
-            if node_type == NodeType.PICKUP:
-                pickup_nodes[node_data['node']] = node
-            if node_type == NodeType.DELIVERY:
-                pickup_node = pickup_nodes['p' + node_data['node'][1:]]
-                load = abs(int(node_data['load']))
-                requests.add(Request(i_requests, pickup_node, node, load))
-                i_requests += 1
-
-            if node_type == NodeType.ORIGIN_DEPOT:
-                if sampaio:
-                    vehicles.add(Vehicle(i_vehicles, node, node, params['capacity']))
-                    i_vehicles += 1
-                else:
-                    origin_depot_nodes[node_data['node']] = node
-            if node_type == NodeType.DESTINATION_DEPOT:
-                origin_node = origin_depot_nodes['o' + node_data['node'][1:]]
-                vehicles.add(Vehicle(i_vehicles, origin_node, node, params['capacity']))
-                i_vehicles += 1
-
-    for n1, n2 in product(nodes, nodes):
-        if n1 == n2:
-            continue
-        cost = _get_euclidean_distance(n1, n2)
-        arcs.add(Arc(n1, n2, cost))
-
-    return Graph(nodes, arcs), vehicles, requests
+    return to_instance_data(read_compact_instance(filepath, sampaio=sampaio, prune=prune))
 
 
 def _pick_median_instances(df: pd.DataFrame, k: int, skip: list[str] = None) -> list[str]:
@@ -208,9 +140,12 @@ def log_result(problem: str, model: str, instance_name: str, result: tuple[str,
     results_file = Path(f"../results/{problem}.csv")
     results_file.parent.mkdir(parents=True, exist_ok=True)
 
-    if not results_file.exists():
-        with open(results_file, 'w') as f:
+    # 'x' creates the file only if missing, so that concurrent loggers never truncate each other's results
+    try:
+        with open(results_file, 'x') as f:
             f.write('Instance,Status,Objective,Gap,Time,Model\n')
+    except FileExistsError:
+        pass
 
     with open(f"../results/{problem}.csv", 'a') as f:
         f.write(f"{instance_name},{result[0]},{result[1]},{result[2]},{result[3]},{model}\n")
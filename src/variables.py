@@ -0,0 +1,26 @@
+import gurobipy as gb
+
+from graph import Arc, NodeType
+from request import Request
+
+
+class SparseTupledict(gb.tupledict):
+    """
+    tupledict of variables, only some of which were created: the keys of the missing variables evaluate to 0
+    """
+
+    def __missing__(self, key):
+        return 0
+
+
+def may_carry(arc: Arc, r: Request) -> bool:
+    """
+    Returns False if no vehicle ever transports request r through the arc, i.e. y_k_r_i_j = 0 ∀k ∈ K, so that those
+    variables need not be created:
+    - requests never travel on arcs touching a depot, see (37), (38) and (47);
+    - request r never enters p(r), see (39) and (46), and therefore never leaves d(r)
+    """
+    depots = (NodeType.ORIGIN_DEPOT, NodeType.DESTINATION_DEPOT)
+    if arc.src.type in depots or arc.dst.type in depots:
+        return False
+    return arc.dst != r.pickup and arc.src != r.destination
@@ -0,0 +1,53 @@
+import sys
+
+from itertools import product
+from pathlib import Path
+
+import gurobipy as gb
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from lyu import Lyu  # noqa: E402
+from rais import Rais  # noqa: E402
+from sampaio import Sampaio  # noqa: E402
+from utils import get_instance_data  # noqa: E402
+
+
+EXAMPLES = sorted((Path(__file__).resolve().parent.parent / 'data' / 'Examples').glob('example*.txt'))
+# options of each model set to their non-default value, every subset of them being built with both builders
+OPTIONS = {
+    Rais: {'vi': True, 'symmetry_breaking': True, 'tight_big_m': False},
+    Sampaio: {'vi': True, 'symmetry_breaking': True, 'tight_big_m': False},
+    Lyu: {'symmetry_breaking': True, 'tight_big_m': False},
+}
+CASES = [
+    (model, {name: value for (name, value), on in zip(options.items(), subset) if on})
+    for model, options in OPTIONS.items()
+    for subset in product((False, True), repeat=len(options))
+]
+
+
+def _solve(model, path: Path, builder: str, options: dict) -> tuple[int, int, float]:
+    graph, vehicles, requests = get_instance_data(path, sampaio=model is Sampaio)
+    m = model(graph, vehicles, requests, builder=builder, **options)
+    m.model.setParam('OutputFlag', 0)
+    try:
+        m.optimize()
+    except gb.GurobiError as e:
+        if e.errno == gb.GRB.Error.SIZE_LIMIT_EXCEEDED:
+            pytest.skip('model too large for the Gurobi licence')
+        raise
+    assert m.model.Status == gb.GRB.OPTIMAL
+    return m.model.NumVars, m.model.NumConstrs, m.model.ObjVal
+
+
+@pytest.mark.parametrize('path', EXAMPLES, ids=lambda path: path.stem)
+@pytest.mark.parametrize('model, options', CASES,
+                         ids=['-'.join([model.__name__, *options]) for model, options in CASES])
+def test_matrix_builder_matches_expr(model, options: dict, path: Path):
+    expr_vars, expr_constrs, expr_objective = _solve(model, path, 'expr', options)
+    matrix_vars, matrix_constrs, matrix_objective = _solve(model, path, 'matrix', options)
+    assert matrix_vars == expr_vars
+    assert matrix_constrs == expr_constrs
+    assert matrix_objective == pytest.approx(expr_objective, rel=1e-6)